@@ -0,0 +1,24 @@
+// Live dashboard: subscribe through the websocket and update the changed fields
+function updateDashboardFields(fields) {
+	for (var tag in fields) {
+		$('[data-dashboard-field="' + tag + '"]').text(fields[tag]);
+	}
+}
+
+$(document).ready(function () {
+	var deferred = $.Deferred();
+	deferred.done(function(value) {
+		window.zynthianSocket.registerHandler('DashboardMessageHandler', updateDashboardFields);
+		window.zynthianSocket.registerHandler('JackMonitorMessageHandler', function(data) {
+			if (data.fields) updateDashboardFields(data.fields);
+		});
+		["DashboardMessageHandler", "JackMonitorMessageHandler"].forEach(function(handlerName) {
+			var socketMessage = {
+				"handler_name": handlerName,
+				"data": 'SUBSCRIBE'
+			};
+			window.zynthianSocket.send(JSON.stringify(socketMessage));
+		});
+	});
+	connectZynthianWebSocket(deferred);
+});
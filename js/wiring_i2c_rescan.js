@@ -0,0 +1,7 @@
+$('#zynthian_wiring_i2c_rescan_script').click(
+	function(){
+		$('#_command').val("RESCAN_I2C");
+		buttonElem = $('#zynthian_wiring_i2c_rescan_script');
+		buttonElem[0].form.submit();
+	}
+);
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Non-blocking subprocess runner
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import os
+import signal
+import logging
+import asyncio
+from subprocess import CalledProcessError, TimeoutExpired
+
+from lib.metrics import metrics
+
+# ------------------------------------------------------------------------------
+# Async command runner
+#
+# Replaces subprocess.check_output for code running on the tornado event loop.
+# Errors are raised as the same exceptions check_output uses, so existing
+# "except Exception" / "except CalledProcessError" blocks keep working.
+# Commands run in their own process group, so a timeout or cancellation
+# kills the whole pipeline, grandchildren included, not only the shell.
+# ------------------------------------------------------------------------------
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_MAX_OUTPUT = 1024 * 1024
+READ_CHUNK_SIZE = 4096
+
+
+async def _read_limited(stream, max_output):
+	data = bytearray()
+	while True:
+		chunk = await stream.read(READ_CHUNK_SIZE)
+		if not chunk:
+			break
+		# Keep draining the pipe beyond the limit so the child never blocks on write
+		if len(data) < max_output:
+			data += chunk[:max_output - len(data)]
+	return bytes(data)
+
+
+async def _kill(proc):
+	try:
+		# The group outlives its leader if some children are still running
+		os.killpg(proc.pid, signal.SIGKILL)
+	except ProcessLookupError:
+		pass
+	await proc.wait()
+
+
+async def run_exec(args, cwd=None, env=None, input=None, timeout=DEFAULT_TIMEOUT, max_output=DEFAULT_MAX_OUTPUT, check=True, stderr=False):
+	"""Run a command without blocking the event loop and return its stdout (bytes).
+
+	args : Command & arguments list, executed without shell.
+	timeout : Seconds before the process is killed and TimeoutExpired is raised. None for no limit.
+	max_output : Max bytes of stdout kept. The rest is discarded.
+	check : Raise CalledProcessError on non-zero exit code.
+	stderr : Merge stderr into the returned output. If False, stderr is discarded.
+	"""
+	with metrics.timed("subprocess"):
+		return await _run_exec(args, cwd, env, input, timeout, max_output, check, stderr)
+
+
+async def _run_exec(args, cwd, env, input, timeout, max_output, check, stderr):
+	proc = await asyncio.create_subprocess_exec(*args,
+		cwd=cwd,
+		env=env,
+		stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+		stdout=asyncio.subprocess.PIPE,
+		stderr=asyncio.subprocess.STDOUT if stderr else asyncio.subprocess.DEVNULL,
+		start_new_session=True)
+
+	async def communicate():
+		if input is not None:
+			proc.stdin.write(input)
+			await proc.stdin.drain()
+			proc.stdin.close()
+		out = await _read_limited(proc.stdout, max_output)
+		await proc.wait()
+		return out
+
+	try:
+		out = await asyncio.wait_for(communicate(), timeout)
+	except asyncio.TimeoutError:
+		await _kill(proc)
+		logging.warning("Command timeout ({}s) => {}".format(timeout, args))
+		raise TimeoutExpired(args, timeout)
+	except asyncio.CancelledError:
+		# Client went away or caller was cancelled => don't leave orphans behind
+		await _kill(proc)
+		raise
+
+	if check and proc.returncode != 0:
+		raise CalledProcessError(proc.returncode, args, output=out)
+	return out
+
+
+async def run_shell(cmd, **kwargs):
+	"""Run a shell command line (pipes, redirections, etc.). Same options as run_exec."""
+	return await run_exec(["/bin/sh", "-c", cmd], **kwargs)
+
+
+async def check_output(cmd, **kwargs):
+	"""Drop-in for subprocess.check_output(cmd, shell=True) returning decoded text."""
+	if isinstance(cmd, str):
+		out = await run_shell(cmd, **kwargs)
+	else:
+		out = await run_exec(cmd, **kwargs)
+	return out.decode('utf-8', 'ignore')
+
+# ------------------------------------------------------------------------------
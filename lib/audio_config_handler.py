@@ -249,23 +249,36 @@ soundcard_presets = {
 	}
 }
 
-try:
-	zynthian_engine_alsa_mixer.init_zynapi_instance()
-	rbpi_device_name = zynthian_engine_alsa_mixer.zynapi_get_rbpi_device_name()
-	logging.info("RBPi Device Name: '{}'".format(rbpi_device_name))
-except Exception as err:
-	rbpi_device_name = None
-	logging.error(err)
+resolved_soundcard_presets = None
 
-if rbpi_device_name == "Headphones":
-	soundcard_presets['RBPi Headphones']['JACKD_OPTIONS'] = soundcard_presets['RBPi Headphones']['JACKD_OPTIONS'].replace("#DEVNAME#", "Headphones")
-	soundcard_presets['RBPi HDMI']['JACKD_OPTIONS'] = soundcard_presets['RBPi HDMI']['JACKD_OPTIONS'].replace("#DEVNAME#", "b1")
-elif rbpi_device_name == "ALSA":
-	soundcard_presets['RBPi Headphones']['JACKD_OPTIONS'] = soundcard_presets['RBPi Headphones']['JACKD_OPTIONS'].replace("#DEVNAME#", "ALSA")
-	soundcard_presets['RBPi HDMI']['JACKD_OPTIONS'] = soundcard_presets['RBPi HDMI']['JACKD_OPTIONS'].replace("#DEVNAME#", "ALSA")
-else:
-	del soundcard_presets['RBPi Headphones']
-	del soundcard_presets['RBPi HDMI']
+
+# Probing the RBPi audio device is deferred until the presets are first needed
+def get_soundcard_presets():
+	global resolved_soundcard_presets
+	if resolved_soundcard_presets is not None:
+		return resolved_soundcard_presets
+
+	try:
+		zynthian_engine_alsa_mixer.init_zynapi_instance()
+		rbpi_device_name = zynthian_engine_alsa_mixer.zynapi_get_rbpi_device_name()
+		logging.info("RBPi Device Name: '{}'".format(rbpi_device_name))
+	except Exception as err:
+		rbpi_device_name = None
+		logging.error(err)
+
+	presets = copy.deepcopy(soundcard_presets)
+	if rbpi_device_name == "Headphones":
+		presets['RBPi Headphones']['JACKD_OPTIONS'] = presets['RBPi Headphones']['JACKD_OPTIONS'].replace("#DEVNAME#", "Headphones")
+		presets['RBPi HDMI']['JACKD_OPTIONS'] = presets['RBPi HDMI']['JACKD_OPTIONS'].replace("#DEVNAME#", "b1")
+	elif rbpi_device_name == "ALSA":
+		presets['RBPi Headphones']['JACKD_OPTIONS'] = presets['RBPi Headphones']['JACKD_OPTIONS'].replace("#DEVNAME#", "ALSA")
+		presets['RBPi HDMI']['JACKD_OPTIONS'] = presets['RBPi HDMI']['JACKD_OPTIONS'].replace("#DEVNAME#", "ALSA")
+	else:
+		del presets['RBPi Headphones']
+		del presets['RBPi HDMI']
+
+	resolved_soundcard_presets = presets
+	return resolved_soundcard_presets
 
 # ------------------------------------------------------------------------------
 # Audio Configuration Class
@@ -295,7 +308,7 @@ class AudioConfigHandler(ZynthianConfigHandler):
 		else:
 			custom_options_disabled = False
 
-		scpresets = copy.copy(soundcard_presets)
+		scpresets = copy.copy(get_soundcard_presets())
 		if os.environ.get('ZYNTHIAN_DISABLE_RBPI_AUDIO', '0') == '1':
 			try:
 				del scpresets['RBPi Headphones']
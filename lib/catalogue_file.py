@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Catalogue File Saving
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import os
+import asyncio
+import logging
+import tempfile
+import tornado.ioloop
+
+# ------------------------------------------------------------------------------
+# Catalogue File Saving
+#
+# Catalogues (snapshot catalogue, preset index, ...) are saved a few seconds
+# after their last change, in a worker thread. Only one write is in flight at
+# a time: changes made while writing are saved by a single follow-up write,
+# so writes can't interleave or land out of order. Every write goes to its own
+# temp file, which is fsynced before replacing the catalogue.
+# ------------------------------------------------------------------------------
+
+
+def write_atomic(fpath, lines):
+	"""Replace a text file atomically with lines, so it's never left half written"""
+	dname, fname = os.path.split(fpath)
+	fd, tmp_fpath = tempfile.mkstemp(prefix="." + fname + ".", suffix=".tmp", dir=dname or ".")
+	try:
+		with os.fdopen(fd, "w") as f:
+			f.writelines(lines)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp_fpath, fpath)
+	except BaseException:
+		try:
+			os.remove(tmp_fpath)
+		except OSError:
+			pass
+		raise
+	# Make the rename itself durable
+	dfd = os.open(dname or ".", os.O_RDONLY)
+	try:
+		os.fsync(dfd)
+	finally:
+		os.close(dfd)
+
+
+class CatalogueSaver:
+
+	def __init__(self, fpath, get_lines, delay, title):
+		self.fpath = fpath
+		# Called from the IOLoop when saving => list of lines
+		self.get_lines = get_lines
+		self.delay = delay
+		self.title = title
+		self.save_handle = None
+		self.writing = False
+		self.dirty = False
+
+	def schedule(self):
+		"""Save after delay seconds, unless already scheduled"""
+		if self.save_handle is None:
+			self.save_handle = tornado.ioloop.IOLoop.current().call_later(self.delay, self.save)
+
+	def save(self):
+		self.save_handle = None
+		if self.writing:
+			# Saved again when the current write ends
+			self.dirty = True
+			return
+		lines = self.get_lines()
+		self.writing = True
+		future = asyncio.get_event_loop().run_in_executor(None, self.write, lines)
+		future.add_done_callback(self.on_written)
+
+	def write(self, lines):
+		try:
+			write_atomic(self.fpath, lines)
+		except Exception as e:
+			logging.error("Can't save {} '{}' => {}".format(self.title, self.fpath, e))
+
+	def on_written(self, future):
+		self.writing = False
+		if self.dirty:
+			self.dirty = False
+			self.schedule()
+
+# ------------------------------------------------------------------------------
@@ -23,266 +23,363 @@
 # ********************************************************************
 
 import os
-import re
 import sys
 import logging
+import asyncio
+import jsonpickle
 import tornado.web
+import tornado.ioloop
+import tornado.websocket
 from distutils import util
-from subprocess import check_output, DEVNULL
+from concurrent.futures import ThreadPoolExecutor
+from lib.telemetry import telemetry, get_volume_usage, format_size
+from lib.git_info import git_info
+from lib.library_index import library_index
+from lib.snapshot_index import snapshot_index
+from lib.i2c_inventory import i2c_inventory
+from lib.jack_monitor import jack_monitor
 from lib.zynthian_config_handler import ZynthianBasicHandler
+from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, ZynthianWebSocketMessage
 
 sys.path.append(os.environ.get('ZYNTHIAN_UI_DIR'))
 import zynconf
 
+# Blocking probes (git, network & media status). Bounded, so hung probes can't pile up.
+probe_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="dashboard_probe")
+
 # ------------------------------------------------------------------------------
 # Dashboard Handler
 # ------------------------------------------------------------------------------
 
 class DashboardHandler(ZynthianBasicHandler):
 
+	# Seconds a section provider may take before its fallback is shown
+	section_timeout = float(os.environ.get('ZYNTHIAN_WEBCONF_DASHBOARD_TIMEOUT', 3))
+
+	# Section name => (icon, provider method name)
+	sections = {
+		'HARDWARE': ('glyphicon glyphicon-cog', 'get_hardware_info'),
+		'SYSTEM': ('glyphicon glyphicon-tasks', 'get_system_info'),
+		'JACK': ('glyphicon glyphicon-signal', 'get_jack_info'),
+		'MIDI & UI': ('glyphicon glyphicon-music', 'get_midi_ui_info'),
+		'SOFTWARE': ('glyphicon glyphicon-random', 'get_software_info'),
+		'LIBRARY': ('glyphicon glyphicon-book', 'get_library_info'),
+		'NETWORK': ('glyphicon glyphicon-link', 'get_network_info')
+	}
+
+	# Mount path => pending probe, so a hung mount isn't probed again until it returns
+	media_probes = {}
+
 	@tornado.web.authenticated
-	def get(self):
-		# Get git info
-		git_info_zyncoder = self.get_git_info("/zynthian/zyncoder")
-		git_info_ui = self.get_git_info("/zynthian/zynthian-ui")
-		git_info_sys = self.get_git_info("/zynthian/zynthian-sys")
-		git_info_webconf = self.get_git_info("/zynthian/zynthian-webconf")
-		git_info_data = self.get_git_info("/zynthian/zynthian-data")
-
-		# Get Memory & SD Card info
-		ram_info = self.get_ram_info()
-		sd_info = self.get_sd_info()
-
-		# get I2C chips info
-		i2c_chips = self.get_i2c_chips()
+	async def get(self):
+		# Sections are built concurrently, each one bounded by section_timeout
+		names = list(self.sections.keys())
+		results = await asyncio.gather(*[self.get_section(name) for name in names])
+		config = {name: {'icon': self.sections[name][0], 'info': info} for name, info in zip(names, results)}
+		super().get("dashboard_block.html", "Dashboard", config, None)
+
+	async def get_section(self, name):
+		try:
+			provider = getattr(self, self.sections[name][1])
+			return await asyncio.wait_for(provider(), self.section_timeout)
+		except asyncio.TimeoutError:
+			logging.warning("Dashboard section '{}' timed out".format(name))
+		except Exception as e:
+			logging.error("Can't get dashboard section '{}' => {}".format(name, e))
+		return {
+			'UNAVAILABLE': {
+				'title': 'Not available'
+			}
+		}
+
+	@staticmethod
+	async def run_probe(func, *args):
+		"""Run a blocking probe in the dashboard thread pool"""
+		return await asyncio.get_running_loop().run_in_executor(probe_executor, func, *args)
+
+	# --------------------------------------------------------------------------
+	# Section providers
+	# --------------------------------------------------------------------------
+
+	async def get_hardware_info(self):
+		i2c_chips = await i2c_inventory.get_chips()
 		if len(i2c_chips) > 0:
 			i2c_info = ", ".join(map(str, i2c_chips))
 		else:
 			i2c_info = "Not detected"
 
-		config = {
-			'HARDWARE': {
-				#'icon': 'glyphicon glyphicon-wrench',
-				'icon': 'glyphicon glyphicon-cog',
-				'info': {
-					'RBPI_VERSION': {
-						'title': os.environ.get('RBPI_VERSION')
-					},
-					'SOUNDCARD_NAME': {
-						'title': 'Audio',
-						'value': os.environ.get('SOUNDCARD_NAME'),
-						'url': "/hw-audio"
-					},
-					'DISPLAY_NAME': {
-						'title': 'Display',
-						'value': os.environ.get('DISPLAY_NAME'),
-						'url': "/hw-display"
-					},
-					'WIRING_LAYOUT': {
-						'title': 'Wiring',
-						'value': os.environ.get('ZYNTHIAN_WIRING_LAYOUT'),
-						'url': "/hw-wiring"
-					},
-					'I2C_CHIPS': {
-						'title': 'I2C',
-						'value': i2c_info,
-						'url': "/hw-wiring"
-					}
-				}
-			},
-			'SYSTEM': {
-				#'icon': 'glyphicon glyphicon-dashboard',
-				'icon': 'glyphicon glyphicon-tasks',
-				'info': {
-					'OS_INFO': {
-						'title': "{}".format(self.get_os_info())
-					},
-					'BUILD_DATE': {
-						'title': 'Build Date',
-						'value': self.get_build_info()['Timestamp'],
-					},
-					'RAM': {
-						'title': 'Memory',
-						'value': "{} ({}/{})".format(ram_info['usage'], ram_info['used'], ram_info['total'])
-					},
-					'SD CARD': {
-						'title': 'SD Card',
-						'value': "{} ({}/{})".format(sd_info['usage'], sd_info['used'], sd_info['total'])
-					},
-					'TEMPERATURE': {
-						'title': 'Temperature',
-						'value': self.get_temperature()
-					},
-					'OVERCLOCKING': {
-						'title': 'Overclock',
-						'value': os.environ.get('ZYNTHIAN_OVERCLOCKING', 'Disabled'),
-						'url': "/hw-options"
-					}
-				}
+		info = {
+			'RBPI_VERSION': {
+				'title': os.environ.get('RBPI_VERSION')
 			},
-			'MIDI & UI': {
-				'icon': 'glyphicon glyphicon-music',
-				'info': {
-					'FINE_TUNING': {
-						'title': 'Tuning',
-						'value': "{} Hz".format(os.environ.get('ZYNTHIAN_MIDI_FINE_TUNING', "440")),
-						'url': "/ui-midi-options"
-					},
-					'MASTER_CHANNEL': {
-						'title': 'Master Channel',
-						'value': self.get_midi_master_chan(),
-						'url': "/ui-midi-options"
-					},
-					'PRELOAD_PRESETS': {
-						'title': 'Preload Presets',
-						'value': self.bool2onoff(os.environ.get('ZYNTHIAN_MIDI_PRESET_PRELOAD_NOTEON', '1')),
-						'url': "/ui-midi-options"
-					},
-					'ZS3_SUBSNAPSHOTS': {
-						'title': 'ZS3 (SubSnapShots)',
-						'value': self.bool2onoff(os.environ.get('ZYNTHIAN_MIDI_PROG_CHANGE_ZS3', '1')),
-						'url': "/ui-midi-options"
-					},
-					'POWER_SAVE_DELAY': {
-						'title': 'Power Save',
-						'value': f"{os.environ.get('ZYNTHIAN_UI_POWER_SAVE_MINUTES', '60')} minutes",
-						'url': "/ui-options"
-					},
-					'AUDIO_LEVELS_SNAPSHOT': {
-						'title': 'Audio Levels on Snapshots',
-						'value': self.bool2onoff(os.environ.get('ZYNTHIAN_UI_SNAPSHOT_MIXER_SETTINGS', '0')),
-						'url': "/ui-options"
-					}
-				}
+			'SOUNDCARD_NAME': {
+				'title': 'Audio',
+				'value': os.environ.get('SOUNDCARD_NAME'),
+				'url': "/hw-audio"
 			},
-			'SOFTWARE': {
-				'icon': 'glyphicon glyphicon-random',
-				'info': {
-					'ZYNCODER': {
-						'title': 'zyncoder',
-						'value': "%s (%s) %s" % (git_info_zyncoder['branch'], git_info_zyncoder['gitid'][0:7], 'Update available' if git_info_zyncoder['update'] == '1' else ''),
-						'url': "https://github.com/zynthian/zyncoder/commit/{}".format(git_info_zyncoder['gitid'])
-					},
-					'UI': {
-						'title': 'zynthian-ui',
-						'value': "{} ({})".format(git_info_ui['branch'], git_info_ui['gitid'][0:7], 'Update available' if git_info_ui['update'] == '1' else ''),
-						'url': "https://github.com/zynthian/zynthian-ui/commit/{}".format(git_info_ui['gitid'])
-					},
-					'SYS': {
-						'title': 'zynthian-sys',
-						'value': "{} ({})".format(git_info_sys['branch'], git_info_sys['gitid'][0:7], 'Update available' if git_info_sys['update'] == '1' else ''),
-						'url': "https://github.com/zynthian/zynthian-sys/commit/{}".format(git_info_sys['gitid'])
-					},
-					'DATA': {
-						'title': 'zynthian-data',
-						'value': "{} ({})".format(git_info_data['branch'], git_info_data['gitid'][0:7], 'Update available' if git_info_data['update'] == '1' else ''),
-						'url': "https://github.com/zynthian/zynthian-data/commit/{}".format(git_info_data['gitid'])
-					},
-					'WEBCONF': {
-						'title': 'zynthian-webconf',
-						'value': "{} ({})".format(git_info_webconf['branch'], git_info_webconf['gitid'][0:7], 'Update available' if git_info_webconf['update'] == '1' else ''),
-						'url': "https://github.com/zynthian/zynthian-webconf/commit/{}".format(git_info_webconf['gitid'])
-					}
-				}
+			'DISPLAY_NAME': {
+				'title': 'Display',
+				'value': os.environ.get('DISPLAY_NAME'),
+				'url': "/hw-display"
 			},
-			'LIBRARY': {
-				'icon': 'glyphicon glyphicon-book',
-				'info': {
-					'SNAPSHOTS': {
-						'title': 'Snapshots',
-						'value': str(self.get_num_of_files(os.environ.get('ZYNTHIAN_MY_DATA_DIR')+"/snapshots")),
-						'url': "/lib-snapshot"
-					},
-					'USER_PRESETS': {
-						'title': 'User Presets',
-						'value': str(self.get_num_of_presets(os.environ.get('ZYNTHIAN_MY_DATA_DIR')+"/presets")),
-						'url': "/lib-presets"
-					},
-					'USER_SOUNDFONTS': {
-						'title': 'User Soundfonts',
-						'value': str(self.get_num_of_files(os.environ.get('ZYNTHIAN_MY_DATA_DIR')+"/soundfonts")),
-						'url': "/lib-soundfont"
-					},
-					'AUDIO_CAPTURES': {
-						'title': 'Audio Captures',
-						'value': str(self.get_num_of_files(os.environ.get('ZYNTHIAN_MY_DATA_DIR')+"/capture", "*.wav")),
-						'url': "/lib-captures"
-					},
-					'MIDI_CAPTURES': {
-						'title': 'MIDI Captures',
-						'value': str(self.get_num_of_files(os.environ.get('ZYNTHIAN_MY_DATA_DIR')+"/capture", "*.mid")),
-						'url': "/lib-captures"
-					}
-				}
+			'WIRING_LAYOUT': {
+				'title': 'Wiring',
+				'value': os.environ.get('ZYNTHIAN_WIRING_LAYOUT'),
+				'url': "/hw-wiring"
 			},
-			'NETWORK': {
-				'icon': 'glyphicon glyphicon-link',
-				'info': {
-					'HOSTNAME': {
-						'title': 'Hostname',
-						'value': self.get_host_name(),
-						'url': "/sys-security"
-					},
-					'WIFI': {
-						'title': 'Wifi',
-						'value': zynconf.get_nwdev_status_string("wlan0"),
-						#'url': "/sys-wifi"
-					},
-					'IP': {
-						'title': 'IP',
-						'value': self.get_ip(),
-						#'url': "/sys-wifi"
-					},
-					'VNC': {
-						'title': 'VNC',
-						'value': self.bool2onoff(os.environ.get('ZYNTHIAN_VNCSERVER_ENABLED', '0')),
-						'url': "/ui-options"
-					},
-					'MIDI': {
-						'title': 'MIDI Services',
-						'value': self.get_midi_network_services()
-					}
-				}
+			'I2C_CHIPS': {
+				'title': 'I2C',
+				'value': i2c_info,
+				'url': "/hw-wiring"
 			}
 		}
 
 		if len(i2c_chips) <= 2:
-			config['HARDWARE']['info']['CUSTOM_WIRING_PROFILE'] = {
+			info['CUSTOM_WIRING_PROFILE'] = {
 				'title': "Profile",
 				'value': os.environ.get('ZYNTHIAN_WIRING_LAYOUT_CUSTOM_PROFILE', ''),
 				'url': "/hw-wiring"
 			}
+		return info
+
+	async def get_system_info(self):
+		live_info = self.get_system_live_info()
+		info = {
+			'OS_INFO': {
+				'title': "{}".format(self.get_os_info())
+			},
+			'BUILD_DATE': {
+				'title': 'Build Date',
+				'value': self.get_build_info()['Timestamp'],
+			},
+			'RAM': {
+				'title': 'Memory',
+				'value': live_info['RAM']
+			},
+			'SD CARD': {
+				'title': 'SD Card',
+				'value': live_info['SD CARD']
+			},
+			'TEMPERATURE': {
+				'title': 'Temperature',
+				'value': live_info['TEMPERATURE']
+			},
+			'OVERCLOCKING': {
+				'title': 'Overclock',
+				'value': os.environ.get('ZYNTHIAN_OVERCLOCKING', 'Disabled'),
+				'url': "/hw-options"
+			}
+		}
 
 		ex_data_basedir = os.environ.get('ZYNTHIAN_EX_DATA_DIR', "/media/root")
-		ex_data_dirs = zynconf.get_external_storage_dirs(ex_data_basedir)
-		for exdir in ex_data_dirs:
-			media_info = self.get_media_info(exdir)
+		ex_data_dirs = await self.run_probe(zynconf.get_external_storage_dirs, ex_data_basedir)
+		media_infos = await asyncio.gather(*[self.get_media_info_async(exdir) for exdir in ex_data_dirs])
+		for exdir, media_info in zip(ex_data_dirs, media_infos):
 			if media_info:
 				dname = os.path.basename(exdir)
-				config['SYSTEM']['info']['MEDIA_' + dname] = {
+				info['MEDIA_' + dname] = {
 					'title': "USB/" + dname,
 					'value': "{} ({}/{})".format(media_info['usage'], media_info['used'], media_info['total']),
 					'url': "/lib-captures"
 				}
+		return info
 
-		if self.is_service_active("touchosc2midi"):
-			config['NETWORK']['info']['TOUCHOSC'] = {
+	async def get_jack_info(self):
+		fields = jack_monitor.get_fields(jack_monitor.stats)
+		return {
+			'JACK_DSP': {
+				'title': 'DSP Load',
+				'value': fields['JACK_DSP']
+			},
+			'JACK_XRUNS': {
+				'title': 'Xruns',
+				'value': fields['JACK_XRUNS']
+			},
+			'JACK_BUFFER': {
+				'title': 'Buffer',
+				'value': fields['JACK_BUFFER'],
+				'url': "/hw-audio"
+			}
+		}
+
+	async def get_midi_ui_info(self):
+		return {
+			'FINE_TUNING': {
+				'title': 'Tuning',
+				'value': "{} Hz".format(os.environ.get('ZYNTHIAN_MIDI_FINE_TUNING', "440")),
+				'url': "/ui-midi-options"
+			},
+			'MASTER_CHANNEL': {
+				'title': 'Master Channel',
+				'value': self.get_midi_master_chan(),
+				'url': "/ui-midi-options"
+			},
+			'PRELOAD_PRESETS': {
+				'title': 'Preload Presets',
+				'value': self.bool2onoff(os.environ.get('ZYNTHIAN_MIDI_PRESET_PRELOAD_NOTEON', '1')),
+				'url': "/ui-midi-options"
+			},
+			'ZS3_SUBSNAPSHOTS': {
+				'title': 'ZS3 (SubSnapShots)',
+				'value': self.bool2onoff(os.environ.get('ZYNTHIAN_MIDI_PROG_CHANGE_ZS3', '1')),
+				'url': "/ui-midi-options"
+			},
+			'POWER_SAVE_DELAY': {
+				'title': 'Power Save',
+				'value': f"{os.environ.get('ZYNTHIAN_UI_POWER_SAVE_MINUTES', '60')} minutes",
+				'url': "/ui-options"
+			},
+			'AUDIO_LEVELS_SNAPSHOT': {
+				'title': 'Audio Levels on Snapshots',
+				'value': self.bool2onoff(os.environ.get('ZYNTHIAN_UI_SNAPSHOT_MIXER_SETTINGS', '0')),
+				'url': "/ui-options"
+			}
+		}
+
+	async def get_software_info(self):
+		repos = [
+			('ZYNCODER', 'zyncoder'),
+			('UI', 'zynthian-ui'),
+			('SYS', 'zynthian-sys'),
+			('DATA', 'zynthian-data'),
+			('WEBCONF', 'zynthian-webconf')
+		]
+		git_infos = await asyncio.gather(*[self.run_probe(self.get_git_info, "/zynthian/" + repo) for tag, repo in repos])
+		info = {}
+		for (tag, repo), gi in zip(repos, git_infos):
+			info[tag] = {
+				'title': repo,
+				'value': "{} ({}) {}".format(gi['branch'], gi['gitid'][0:7], 'Update available' if gi['update'] else ''),
+				'url': "https://github.com/zynthian/{}/commit/{}".format(repo, gi['gitid'])
+			}
+		return info
+
+	async def get_library_info(self):
+		return {
+			'SNAPSHOTS': {
+				'title': 'Snapshots',
+				'value': str(snapshot_index.get_count()),
+				'url': "/lib-snapshot"
+			},
+			'USER_PRESETS': {
+				'title': 'User Presets',
+				'value': str(library_index.get_count('presets')),
+				'url': "/lib-presets"
+			},
+			'USER_SOUNDFONTS': {
+				'title': 'User Soundfonts',
+				'value': str(library_index.get_count('soundfonts')),
+				'url': "/lib-soundfont"
+			},
+			'AUDIO_CAPTURES': {
+				'title': 'Audio Captures',
+				'value': str(library_index.get_count('audio_captures')),
+				'url': "/lib-captures"
+			},
+			'MIDI_CAPTURES': {
+				'title': 'MIDI Captures',
+				'value': str(library_index.get_count('midi_captures')),
+				'url': "/lib-captures"
+			}
+		}
+
+	async def get_network_info(self):
+		live_info = await self.get_network_live_info()
+		info = {
+			'HOSTNAME': {
+				'title': 'Hostname',
+				'value': self.get_host_name(),
+				'url': "/sys-security"
+			},
+			'WIFI': {
+				'title': 'Wifi',
+				'value': live_info['WIFI'],
+				#'url': "/sys-wifi"
+			},
+			'IP': {
+				'title': 'IP',
+				'value': live_info['IP'],
+				#'url': "/sys-wifi"
+			},
+			'VNC': {
+				'title': 'VNC',
+				'value': self.bool2onoff(os.environ.get('ZYNTHIAN_VNCSERVER_ENABLED', '0')),
+				'url': "/ui-options"
+			},
+			'MIDI': {
+				'title': 'MIDI Services',
+				'value': live_info['MIDI']
+			}
+		}
+
+		if live_info['TOUCHOSC'] == 'on':
+			info['TOUCHOSC'] = {
 				'title': 'TouchOSC',
 				'value': 'on',
 				'url': "/ui-midi-options"
 			}
+		return info
 
-		super().get("dashboard_block.html", "Dashboard", config, None)
+	# --------------------------------------------------------------------------
+	# Live fields
+	# --------------------------------------------------------------------------
 
 	@staticmethod
-	def get_git_info(path, check_updates=False):
-		branch = check_output("cd %s; git branch | grep '*'" % path, shell=True).decode()[2:-1]
-		gitid = check_output("cd %s; git rev-parse HEAD" % path, shell=True).decode()[:-1]
-		if check_updates:
-			update = check_output("cd %s; git remote update; git status --porcelain -bs | grep behind | wc -l" % path, shell=True).decode()
-		else:
-			update = None
-		return {"branch": branch, "gitid": gitid, "update": update}
+	async def get_live_info():
+		"""Dashboard fields that change while the page is open, by tag"""
+		live_info = DashboardHandler.get_system_live_info()
+		live_info.update(await DashboardHandler.get_network_live_info())
+		return live_info
+
+	@staticmethod
+	def get_system_live_info():
+		ram_info = DashboardHandler.get_ram_info()
+		sd_info = DashboardHandler.get_sd_info()
+		return {
+			'RAM': "{} ({}/{})".format(ram_info['usage'], ram_info['used'], ram_info['total']),
+			'SD CARD': "{} ({}/{})".format(sd_info['usage'], sd_info['used'], sd_info['total']),
+			'TEMPERATURE': DashboardHandler.get_temperature()
+		}
+
+	@staticmethod
+	async def get_network_live_info():
+		# Service states come from "systemctl show", when the status cache expires
+		wifi, midi, touchosc = await asyncio.gather(
+			DashboardHandler.run_probe(zynconf.get_nwdev_status_string, "wlan0"),
+			DashboardHandler.run_probe(DashboardHandler.get_midi_network_services),
+			DashboardHandler.run_probe(DashboardHandler.is_service_active, "touchosc2midi")
+		)
+		return {
+			'WIFI': wifi,
+			'IP': DashboardHandler.get_ip(),
+			'MIDI': midi,
+			'TOUCHOSC': 'on' if touchosc else 'off'
+		}
+
+	# --------------------------------------------------------------------------
+	# Probes
+	# --------------------------------------------------------------------------
+
+	@classmethod
+	async def get_media_info_async(cls, mpath):
+		# A stale mount can block statvfs forever => never queue a second probe behind it
+		probe = cls.media_probes.get(mpath)
+		if probe is None:
+			probe = cls.media_probes[mpath] = asyncio.ensure_future(cls.run_probe(cls.get_media_info, mpath))
+			probe.add_done_callback(lambda f: cls.media_probes.pop(mpath, None))
+		try:
+			return await asyncio.wait_for(asyncio.shield(probe), cls.section_timeout / 2)
+		except asyncio.TimeoutError:
+			logging.warning("Media '{}' is not responding".format(mpath))
+			return None
+
+	@staticmethod
+	def get_git_info(path):
+		try:
+			return git_info.get_info(path)
+		except Exception as e:
+			logging.error("Can't get git info for '{}' => {}".format(path, e))
+			return {"branch": "???", "gitid": "", "update": None}
 
 	@staticmethod
 	def get_host_name():
@@ -292,7 +389,7 @@ class DashboardHandler(ZynthianBasicHandler):
 
 	@staticmethod
 	def get_os_info():
-		return check_output("lsb_release -ds", shell=True).decode()
+		return telemetry.get_os_info()
 
 	@staticmethod
 	def get_build_info():
@@ -317,71 +414,47 @@ class DashboardHandler(ZynthianBasicHandler):
 
 	@staticmethod
 	def get_ip():
-		#out=check_output("hostname -I | cut -f1 -d' '", shell=True).decode()
-		ips = []
-		for ip in check_output("hostname -I", shell=True).decode().split(" "):
-			# Filter ip6 addresses
-			if '.' in ip:
-				ips.append(ip)
-		return " ".join(ips)
-
-	@staticmethod
-	def get_i2c_chips():
-		res = []
-		out = check_output("i2cdetect -y 1", shell=True).decode().split("\n")
-		if len(out) > 3:
-			for i in range(1, 8):
-				for adr in out[i][4:].split(" "):
-					try:
-						adr = int(adr, 16)
-						if 0x20 <= adr <= 0x27:
-							out1 = check_output("i2cget -y 1 {} 0x01".format(adr), shell=True).decode().strip()
-							out2 = check_output("i2cget -y 1 {} 0x10".format(adr), shell=True).decode().strip()
-							if out1 == '0x00' and out2 == '0x00':
-								res.append("MCP23008@0x{:02X}".format(adr))
-							else:
-								res.append("MCP23017@0x{:02X}".format(adr))
-						elif 0x48 <= adr <= 0x4B:
-							res.append("ADS1115@0x{:02X}".format(adr))
-						elif 0x61 <= adr <= 0x67:
-							res.append("MCP4728@0x{:02X}".format(adr))
-					except:
-						pass
-		return res
+		try:
+			return " ".join(telemetry.get_latest()['ips'])
+		except:
+			return ""
 
 	@staticmethod
 	def get_ram_info():
-		out = check_output("free -m | grep 'Mem'", shell=True).decode()
-		parts = re.split('\s+', out)
-		return {'total': parts[1]+"M", 'used': parts[2]+"M", 'free': parts[3]+"M", 'usage': "{}%".format(int(100*float(parts[2])/float(parts[1])))}
+		try:
+			data = telemetry.get_latest()
+			total = data['ram_total'] // 1048576
+			used = data['ram_used'] // 1048576
+			free = data['ram_free'] // 1048576
+			return {'total': "{}M".format(total), 'used': "{}M".format(used), 'free': "{}M".format(free), 'usage': "{}%".format(int(100 * used / total))}
+		except:
+			return {'total': 'NA', 'used': 'NA', 'free': 'NA', 'usage': 'NA'}
 
 	@staticmethod
 	def get_temperature():
 		try:
-			return check_output("vcgencmd measure_temp", shell=True).decode()[5:-3] + "ºC"
+			return "{:.1f}ºC".format(telemetry.get_latest()['temperature'])
 		except:
 			return "???"
 
 	@staticmethod
-	def get_volume_info(volume=None):
-		if volume is None:
-			volume = "/dev/mmcblk0p2\|/dev/root"
+	def get_volume_info(path="/"):
 		try:
-			out = check_output("df -h | grep '{}'".format(volume), shell=True).decode()
-			parts = re.split('\s+', out)
-			return {'total': parts[1], 'used': parts[2], 'free': parts[3], 'usage': parts[4]}
+			total, used, free = get_volume_usage(path)
+			# Same rounding as "df": used / (used + available), rounded up
+			usage = -(-100 * used // (used + free)) if used + free > 0 else 0
+			return {'total': format_size(total), 'used': format_size(used), 'free': format_size(free), 'usage': "{}%".format(usage)}
 		except:
 			return {'total': 'NA', 'used': 'NA', 'free': 'NA', 'usage': 'NA'}
 
 	@staticmethod
 	def get_sd_info():
-		return DashboardHandler.get_volume_info("/dev/mmcblk0p2\|/dev/root")
+		return DashboardHandler.get_volume_info("/")
 
 	@staticmethod
 	def get_media_info(mpath="/media/usb0"):
 		try:
-			out = check_output("mountpoint '{}'".format(mpath), shell=True).decode()
-			if out.startswith("{} is a mountpoint".format(mpath)):
+			if os.path.ismount(mpath):
 				return DashboardHandler.get_volume_info(mpath)
 			else:
 				return None
@@ -389,35 +462,6 @@ class DashboardHandler(ZynthianBasicHandler):
 			#logging.error("Can't get info for '{}' => {}".format(mpath,e))
 			pass
 
-	@staticmethod
-	def get_num_of_files(path, pattern=None):
-		if pattern:
-			pattern = "-name \"{}\"".format(pattern)
-		else:
-			pattern = ""
-		try:
-			n = int(check_output("find {} -type f -follow {} | wc -l".format(path, pattern), shell=True, stderr=DEVNULL).decode())
-		except Exception as e:
-			logging.error("Can't get num of files for '{}' => {}".format(path, e))
-			n = 0
-		return n
-
-	@staticmethod
-	def get_num_of_presets(path):
-		# LV2 presets
-		n1 = int(check_output("find {}/lv2 -type f -prune -name manifest.ttl | wc -l".format(path), shell=True).decode())
-		logging.debug("LV2 presets => {}".format(n1))
-		# Pianoteq presets
-		n2 = int(check_output("find {}/pianoteq -type f -prune | wc -l".format(path), shell=True).decode())
-		logging.debug("Pianoteq presets => {}".format(n2))
-		# Puredata presets
-		n3 = int(check_output("find {}/puredata/*/* -type d -prune | wc -l".format(path), shell=True, stderr=DEVNULL).decode())
-		logging.debug("Puredata presets => {}".format(n3))
-		# ZynAddSubFX presets
-		n4 = int(check_output("find {}/zynaddsubfx -type f -name *.xiz | wc -l".format(path), shell=True).decode())
-		logging.debug("ZynAddSubFX presets => {}".format(n4))
-		return n1 + n2 + n3 + n4
-
 	@staticmethod
 	def get_midi_master_chan():
 		mmc = os.environ.get('ZYNTHIAN_MIDI_MASTER_CHANNEL', "16")
@@ -437,22 +481,96 @@ class DashboardHandler(ZynthianBasicHandler):
 			res.append("QMidiNet")
 		return ", ".join(res)
 
-	@staticmethod
-	def is_service_active(service):
-		cmd = "systemctl is-active %s" % service
-		try:
-			result = check_output(cmd, shell=True).decode('utf-8', 'ignore')
-		except Exception as e:
-			result = "ERROR: %s" % e
-		#print("Is service "+str(service)+" active? => "+str(result))
-		if result.strip() == 'active':
-			return True
-		else:
-			return False
-
 	@staticmethod
 	def bool2onoff(b):
 		if (isinstance(b, str) and util.strtobool(b)) or (isinstance(b, bool) and b):
 			return "On"
 		else:
 			return "Off"
+
+# ------------------------------------------------------------------------------
+# Live Dashboard
+#
+# Connected dashboards subscribe through the websocket. The live fields are
+# sampled once per interval for all of them, and only the changed ones are
+# pushed. Sampling stops when nobody is subscribed.
+# ------------------------------------------------------------------------------
+
+
+class DashboardLiveSampler:
+
+	def __init__(self, interval=float(os.environ.get('ZYNTHIAN_WEBCONF_DASHBOARD_INTERVAL', 2))):
+		self.interval = interval
+		self.subscribers = set()
+		self.values = {}
+		self.periodic = None
+		self.sampling = False
+
+	def subscribe(self, handler):
+		self.subscribers.add(handler)
+		# Full snapshot for the new subscriber, deltas after that
+		if self.values:
+			self.send(handler, self.encode(self.values))
+		if self.periodic is None:
+			self.periodic = tornado.ioloop.PeriodicCallback(self.on_timer, self.interval * 1000)
+			self.periodic.start()
+			self.on_timer()
+
+	def unsubscribe(self, handler):
+		self.subscribers.discard(handler)
+		if not self.subscribers and self.periodic:
+			self.periodic.stop()
+			self.periodic = None
+			# Stale values must not be sent when sampling restarts
+			self.values = {}
+
+	def on_timer(self):
+		if not self.sampling:
+			asyncio.ensure_future(self.sample())
+
+	async def sample(self):
+		self.sampling = True
+		try:
+			values = await DashboardHandler.get_live_info()
+		except Exception as e:
+			logging.error("Can't sample live dashboard info => {}".format(e))
+			return
+		finally:
+			self.sampling = False
+		delta = {k: v for k, v in values.items() if self.values.get(k) != v}
+		self.values = values
+		if delta:
+			message = self.encode(delta)
+			for handler in list(self.subscribers):
+				self.send(handler, message)
+
+	@staticmethod
+	def encode(data):
+		return jsonpickle.encode(ZynthianWebSocketMessage('DashboardMessageHandler', data))
+
+	def send(self, handler, message):
+		try:
+			handler.websocket.write_message(message)
+		except tornado.websocket.WebSocketClosedError:
+			self.unsubscribe(handler)
+
+
+dashboard_live_sampler = DashboardLiveSampler()
+
+
+class DashboardMessageHandler(ZynthianWebSocketMessageHandler):
+
+	@classmethod
+	def is_registered_for(cls, handler_name):
+		return handler_name == 'DashboardMessageHandler'
+
+	def on_websocket_message(self, message):
+		if message == 'SUBSCRIBE':
+			dashboard_live_sampler.subscribe(self)
+		elif message == 'UNSUBSCRIBE':
+			dashboard_live_sampler.unsubscribe(self)
+
+	def on_close(self):
+		dashboard_live_sampler.unsubscribe(self)
+
+# ------------------------------------------------------------------------------
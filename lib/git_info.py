@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Git Repository Info
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import os
+import asyncio
+import logging
+import threading
+import tornado.ioloop
+
+from lib.async_subprocess import check_output
+
+# Repositories checked for updates in the background
+ZYNTHIAN_DIR = os.environ.get('ZYNTHIAN_DIR', "/zynthian")
+ZYNTHIAN_REPOS = ["zyncoder", "zynthian-ui", "zynthian-sys", "zynthian-webconf", "zynthian-data"]
+
+# Seconds between background update checks. 0 (default) => disabled, as every
+# check fetches all the repositories from their remotes.
+UPDATE_CHECK_INTERVAL = int(os.environ.get('ZYNTHIAN_WEBCONF_UPDATE_CHECK_INTERVAL', 0))
+
+# ------------------------------------------------------------------------------
+# Git metadata reader
+#
+# Branch & commit are read from .git/HEAD, loose refs and packed-refs, without
+# spawning git. Results are cached and reused while the files they were read
+# from are unchanged (inode, size & mtime).
+# ------------------------------------------------------------------------------
+
+
+def get_file_key(fpath):
+	try:
+		st = os.stat(fpath)
+		return st.st_ino, st.st_size, st.st_mtime_ns
+	except OSError:
+		return None
+
+
+def read_text(fpath):
+	try:
+		with open(fpath) as f:
+			return f.read().strip()
+	except OSError:
+		return None
+
+
+def find_git_dir(path):
+	"""Return (git_dir, common_dir) for a work tree. Handles "gitdir:" files (worktrees, submodules)."""
+	git_dir = os.path.join(path, ".git")
+	if os.path.isfile(git_dir):
+		content = read_text(git_dir) or ""
+		if not content.startswith("gitdir:"):
+			return None, None
+		git_dir = os.path.normpath(os.path.join(path, content[7:].strip()))
+	if not os.path.isdir(git_dir):
+		return None, None
+	common_dir = read_text(os.path.join(git_dir, "commondir"))
+	if common_dir:
+		common_dir = os.path.normpath(os.path.join(git_dir, common_dir))
+	else:
+		common_dir = git_dir
+	return git_dir, common_dir
+
+
+def read_packed_refs(fpath):
+	refs = {}
+	try:
+		with open(fpath) as f:
+			for line in f:
+				if line.startswith(("#", "^")):
+					continue
+				parts = line.split()
+				if len(parts) == 2:
+					refs[parts[1]] = parts[0]
+	except OSError:
+		pass
+	return refs
+
+
+class GitRepoInfo:
+
+	def __init__(self, path):
+		self.path = path
+		self.git_dir, self.common_dir = find_git_dir(path)
+		# Files read to get the current info => their keys
+		self.deps = None
+		self.info = None
+
+	def get_ref_fpath(self, ref):
+		# Per-worktree refs live in git_dir, the rest in common_dir
+		if ref == "HEAD" or ref.startswith("refs/bisect/"):
+			return os.path.join(self.git_dir, ref)
+		return os.path.join(self.common_dir, ref)
+
+	def resolve_ref(self, ref, deps, packed_refs):
+		"""Follow symbolic refs until a commit id is found. Every file read is recorded in deps."""
+		for i in range(10):
+			fpath = self.get_ref_fpath(ref)
+			deps[fpath] = get_file_key(fpath)
+			content = read_text(fpath)
+			if content is None:
+				if packed_refs is None:
+					fpath = os.path.join(self.common_dir, "packed-refs")
+					deps[fpath] = get_file_key(fpath)
+					packed_refs = read_packed_refs(fpath)
+				return packed_refs.get(ref), packed_refs
+			if content.startswith("ref:"):
+				ref = content[4:].strip()
+			else:
+				return content, packed_refs
+		return None, packed_refs
+
+	def is_valid(self):
+		if self.deps is None:
+			return False
+		for fpath, key in self.deps.items():
+			if get_file_key(fpath) != key:
+				return False
+		return True
+
+	def read(self):
+		if self.git_dir is None:
+			raise FileNotFoundError("Not a git repository: '{}'".format(self.path))
+		deps = {}
+		head_fpath = self.get_ref_fpath("HEAD")
+		deps[head_fpath] = get_file_key(head_fpath)
+		head = read_text(head_fpath) or ""
+		if head.startswith("ref:"):
+			ref = head[4:].strip()
+			gitid, packed_refs = self.resolve_ref(ref, deps, None)
+			if ref.startswith("refs/heads/"):
+				branch = ref[11:]
+			else:
+				branch = ref
+		else:
+			ref = None
+			gitid = head
+			# Same as "git branch" shows it
+			branch = "(HEAD detached at {})".format(gitid[:7])
+		self.info = {"branch": branch, "gitid": gitid or "", "ref": ref}
+		self.deps = deps
+		return self.info
+
+	def get_info(self):
+		if not self.is_valid():
+			self.read()
+		return self.info
+
+	def get_upstream_ref(self):
+		"""Remote tracking ref of the current branch, from .git/config"""
+		info = self.get_info()
+		ref = info['ref']
+		if not ref or not ref.startswith("refs/heads/"):
+			return None
+		section = '[branch "{}"]'.format(ref[11:])
+		remote = merge = None
+		in_section = False
+		try:
+			with open(os.path.join(self.common_dir, "config")) as f:
+				for line in f:
+					line = line.strip()
+					if line.startswith("["):
+						in_section = (line == section)
+					elif in_section and "=" in line:
+						key, val = [s.strip() for s in line.split("=", 1)]
+						if key == "remote":
+							remote = val
+						elif key == "merge":
+							merge = val
+		except OSError:
+			return None
+		if not remote or not merge or not merge.startswith("refs/heads/"):
+			return None
+		if remote == ".":
+			return merge
+		return "refs/remotes/{}/{}".format(remote, merge[11:])
+
+	def get_upstream_gitid(self):
+		upstream_ref = self.get_upstream_ref()
+		if upstream_ref:
+			gitid, packed_refs = self.resolve_ref(upstream_ref, {}, None)
+			return gitid
+
+
+class GitInfo:
+	"""
+	Git info for the zynthian repositories. The "behind upstream" check needs
+	to fetch and count commits, so it runs in the background and its result
+	is only read from requests.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.repos = {}
+		# path => ((head gitid, upstream gitid), number of commits behind)
+		self.behind = {}
+		self.periodic = None
+		self.checking = False
+
+	def get_repo(self, path):
+		with self.lock:
+			try:
+				return self.repos[path]
+			except KeyError:
+				repo = self.repos[path] = GitRepoInfo(path)
+				return repo
+
+	def get_info(self, path):
+		"""Return {'branch', 'gitid', 'update'}. 'update' is None until the background check has run."""
+		repo = self.get_repo(path)
+		with self.lock:
+			info = repo.get_info()
+		res = {"branch": info['branch'], "gitid": info['gitid'], "update": None}
+		try:
+			key, behind = self.behind[path]
+			if key[0] == info['gitid']:
+				res['update'] = behind > 0
+		except KeyError:
+			pass
+		return res
+
+	def get_branch(self, path):
+		return self.get_info(path)['branch']
+
+	async def check_updates(self, path, fetch=True):
+		repo = self.get_repo(path)
+		if fetch:
+			try:
+				await check_output(["git", "remote", "update"], cwd=path, timeout=60)
+			except Exception as e:
+				logging.debug("Can't fetch '{}' => {}".format(path, e))
+		with self.lock:
+			gitid = repo.get_info()['gitid']
+			upstream_gitid = repo.get_upstream_gitid()
+		if not upstream_gitid:
+			self.behind.pop(path, None)
+			return None
+		key = (gitid, upstream_gitid)
+		try:
+			if self.behind[path][0] == key:
+				return self.behind[path][1]
+		except KeyError:
+			pass
+		if gitid == upstream_gitid:
+			behind = 0
+		else:
+			behind = int(await check_output(["git", "rev-list", "--count", "HEAD..{}".format(upstream_gitid)], cwd=path))
+		self.behind[path] = (key, behind)
+		return behind
+
+	async def check_all_updates(self, paths):
+		if self.checking:
+			return
+		self.checking = True
+		try:
+			for path in paths:
+				try:
+					await self.check_updates(path)
+				except Exception as e:
+					logging.warning("Can't check updates for '{}' => {}".format(path, e))
+		finally:
+			self.checking = False
+
+	def start_update_check(self, paths=None, interval=UPDATE_CHECK_INTERVAL):
+		"""Check periodically (interval in seconds) if the repositories are behind their upstream"""
+		if paths is None:
+			paths = [os.path.join(ZYNTHIAN_DIR, repo) for repo in ZYNTHIAN_REPOS]
+		if self.periodic is None and interval > 0:
+			def run():
+				asyncio.ensure_future(self.check_all_updates(paths))
+			self.periodic = tornado.ioloop.PeriodicCallback(run, interval * 1000)
+			self.periodic.start()
+			run()
+
+	def stop_update_check(self):
+		if self.periodic:
+			self.periodic.stop()
+			self.periodic = None
+
+
+git_info = GitInfo()
+
+# ------------------------------------------------------------------------------
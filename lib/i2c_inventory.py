@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# I2C Bus Inventory
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import os
+import fcntl
+import ctypes
+import asyncio
+import logging
+
+# ------------------------------------------------------------------------------
+# SMBus access through the i2c-dev ioctls (linux/i2c-dev.h, linux/i2c.h)
+# ------------------------------------------------------------------------------
+
+I2C_SLAVE = 0x0703
+I2C_SMBUS = 0x0720
+
+I2C_SMBUS_WRITE = 0
+I2C_SMBUS_READ = 1
+
+I2C_SMBUS_QUICK = 0
+I2C_SMBUS_BYTE_DATA = 2
+
+
+class i2c_smbus_data(ctypes.Union):
+	_fields_ = [
+		("byte", ctypes.c_uint8),
+		("word", ctypes.c_uint16),
+		("block", ctypes.c_uint8 * 34)
+	]
+
+
+class i2c_smbus_ioctl_data(ctypes.Structure):
+	_fields_ = [
+		("read_write", ctypes.c_uint8),
+		("command", ctypes.c_uint8),
+		("size", ctypes.c_uint32),
+		("data", ctypes.POINTER(i2c_smbus_data))
+	]
+
+
+class SMBus:
+
+	def __init__(self, bus):
+		self.fd = os.open("/dev/i2c-{}".format(bus), os.O_RDWR)
+		self.addr = None
+
+	def close(self):
+		os.close(self.fd)
+
+	def set_address(self, addr):
+		# EBUSY => address in use by a kernel driver ("UU" in i2cdetect)
+		if addr != self.addr:
+			fcntl.ioctl(self.fd, I2C_SLAVE, addr)
+			self.addr = addr
+
+	def smbus_access(self, read_write, command, size, data=None):
+		args = i2c_smbus_ioctl_data(read_write, command, size, ctypes.pointer(data) if data is not None else None)
+		fcntl.ioctl(self.fd, I2C_SMBUS, args)
+
+	def write_quick(self, addr):
+		self.set_address(addr)
+		self.smbus_access(I2C_SMBUS_WRITE, 0, I2C_SMBUS_QUICK)
+
+	def read_byte_data(self, addr, register):
+		self.set_address(addr)
+		data = i2c_smbus_data()
+		self.smbus_access(I2C_SMBUS_READ, register, I2C_SMBUS_BYTE_DATA, data)
+		return data.byte
+
+	def probe(self, addr):
+		"""Same as the default i2cdetect probe for these address ranges (SMBus quick write)"""
+		try:
+			self.write_quick(addr)
+			return True
+		except OSError:
+			return False
+
+# ------------------------------------------------------------------------------
+# I2C Inventory
+#
+# Chips on the zynthian I2C bus are detected once and cached. The bus is only
+# probed again on explicit request (wiring page) or when the wiring layout
+# changes, so the web UI doesn't compete with zyncoder for the bus.
+# ------------------------------------------------------------------------------
+
+
+class I2CInventory:
+
+	def __init__(self, bus=1):
+		self.bus = bus
+		# Detected chips, as "NAME@0xNN" strings
+		self.chips = None
+		# Increased on every scan, so derived data can be refreshed
+		self.version = 0
+		self.scan_task = None
+
+	def scan(self):
+		res = []
+		try:
+			bus = SMBus(self.bus)
+		except OSError as e:
+			logging.warning("Can't open I2C bus {} => {}".format(self.bus, e))
+			return res
+		try:
+			# Only the address ranges used by the zynthian chips are probed
+			for adr in range(0x20, 0x28):
+				if bus.probe(adr):
+					try:
+						# On MCP23017, register 0x01 is IODIRB (0xFF after reset) => both reading 0 means MCP23008
+						if bus.read_byte_data(adr, 0x01) == 0 and bus.read_byte_data(adr, 0x10) == 0:
+							res.append("MCP23008@0x{:02X}".format(adr))
+						else:
+							res.append("MCP23017@0x{:02X}".format(adr))
+					except OSError:
+						pass
+			for adr in range(0x48, 0x4C):
+				if bus.probe(adr):
+					res.append("ADS1115@0x{:02X}".format(adr))
+			for adr in range(0x61, 0x68):
+				if bus.probe(adr):
+					res.append("MCP4728@0x{:02X}".format(adr))
+		finally:
+			bus.close()
+		logging.info("Detected I2C chips: {}".format(res))
+		return res
+
+	async def rescan(self):
+		# Concurrent callers wait for the same scan
+		if self.scan_task is None:
+			self.scan_task = asyncio.ensure_future(self._rescan())
+		return await asyncio.shield(self.scan_task)
+
+	async def _rescan(self):
+		try:
+			self.chips = await asyncio.get_running_loop().run_in_executor(None, self.scan)
+			self.version += 1
+			return self.chips
+		finally:
+			self.scan_task = None
+
+	async def get_chips(self):
+		if self.chips is None:
+			return await self.rescan()
+		return self.chips
+
+	def invalidate(self):
+		"""Rescan on next access. Called when the saved wiring layout changes."""
+		self.chips = None
+
+	def start(self):
+		asyncio.ensure_future(self.rescan())
+
+
+i2c_inventory = I2CInventory()
+
+# ------------------------------------------------------------------------------
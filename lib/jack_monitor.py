@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# JACK DSP Load & Xrun Monitor
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import os
+import time
+import logging
+import threading
+import jsonpickle
+from collections import deque
+import tornado.ioloop
+import tornado.websocket
+
+from lib.lazy_handler import timed_import
+from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, ZynthianWebSocketMessage
+
+# ------------------------------------------------------------------------------
+# JACK Monitor
+#
+# A persistent JACK client polls the DSP load and counts xruns (from the xrun
+# callback, with a bounded log of timestamped events). Every window the load
+# is aggregated (min/avg/max) and pushed to the websocket subscribers.
+# Set ZYNTHIAN_WEBCONF_JACK_SERVER to monitor a named server, e.g. one running
+# the dummy driver: jackd -n test -d dummy
+#
+# The JACK client library (cffi) is only loaded when the monitor starts.
+# ------------------------------------------------------------------------------
+
+JACK_SERVER = os.environ.get('ZYNTHIAN_WEBCONF_JACK_SERVER') or None
+
+# Seconds between DSP load polls & aggregation window
+POLL_INTERVAL = 0.25
+WINDOW = float(os.environ.get('ZYNTHIAN_WEBCONF_JACK_WINDOW', 1))
+
+# Seconds between connection attempts while JACK is not running
+RECONNECT_INTERVAL = 5
+
+XRUN_LOG_SIZE = 256
+
+
+class JackMonitor:
+
+	def __init__(self, servername=JACK_SERVER, window=WINDOW):
+		self.servername = servername
+		self.window = window
+		# JACK client module, loaded on start
+		self.jack = None
+		self.client = None
+		self.lock = threading.Lock()
+		self.subscribers = set()
+		self.poll_periodic = None
+		self.window_periodic = None
+		self.reconnect_periodic = None
+		self.io_loop = None
+		self.blocksize = None
+		self.samplerate = None
+		self.xrun_total = 0
+		self.xrun_window = 0
+		self.xrun_delay_max = 0.0
+		# (timestamp, delayed usecs)
+		self.xrun_log = deque(maxlen=XRUN_LOG_SIZE)
+		self.reset_window()
+		self.stats = self.get_empty_stats()
+
+	def reset_window(self):
+		self.load_min = None
+		self.load_max = None
+		self.load_sum = 0.0
+		self.load_count = 0
+
+	@staticmethod
+	def get_empty_stats():
+		return {
+			'connected': False,
+			'cpu_min': None,
+			'cpu_avg': None,
+			'cpu_max': None,
+			'xruns': 0,
+			'xrun_total': 0,
+			'xrun_delay_max': None,
+			'last_xrun': None,
+			'blocksize': None,
+			'samplerate': None,
+			'latency_ms': None
+		}
+
+	# --------------------------------------------------------------------------
+	# JACK client
+	# --------------------------------------------------------------------------
+
+	def start(self):
+		try:
+			self.jack = timed_import("jack")
+		except (ImportError, OSError) as e:
+			logging.warning("JACK monitor disabled: JACK client library not available => {}".format(e))
+			return
+		self.io_loop = tornado.ioloop.IOLoop.current()
+		self.poll_periodic = tornado.ioloop.PeriodicCallback(self.poll, POLL_INTERVAL * 1000)
+		self.window_periodic = tornado.ioloop.PeriodicCallback(self.end_window, self.window * 1000)
+		self.reconnect_periodic = tornado.ioloop.PeriodicCallback(self.connect, RECONNECT_INTERVAL * 1000)
+		self.window_periodic.start()
+		self.reconnect_periodic.start()
+		self.connect()
+
+	def stop(self):
+		for periodic in (self.poll_periodic, self.window_periodic, self.reconnect_periodic):
+			if periodic:
+				periodic.stop()
+		self.disconnect()
+
+	def connect(self):
+		if self.client:
+			return
+		try:
+			client = self.jack.Client("ZynthianWebConfMonitor", no_start_server=True, servername=self.servername)
+		except Exception as e:
+			logging.debug("JACK monitor can't connect => {}".format(e))
+			return
+		client.set_xrun_callback(self.on_xrun)
+		client.set_blocksize_callback(self.on_blocksize)
+		client.set_samplerate_callback(self.on_samplerate)
+		client.set_shutdown_callback(self.on_shutdown)
+		client.activate()
+		self.client = client
+		self.blocksize = client.blocksize
+		self.samplerate = client.samplerate
+		self.reconnect_periodic.stop()
+		self.poll_periodic.start()
+		logging.info("JACK monitor connected ({} frames @ {} Hz)".format(self.blocksize, self.samplerate))
+
+	def disconnect(self, deactivate=True):
+		if self.client:
+			try:
+				# After a server shutdown, only closing the client is allowed
+				if deactivate:
+					self.client.deactivate()
+				self.client.close()
+			except Exception:
+				pass
+			self.client = None
+		if self.poll_periodic:
+			self.poll_periodic.stop()
+
+	def on_lost(self):
+		logging.warning("JACK monitor lost connection to JACK")
+		self.disconnect(False)
+		self.reset_window()
+		self.reconnect_periodic.start()
+
+	# JACK thread callbacks => no blocking, no IOLoop access except add_callback
+
+	def on_xrun(self, delayed_usecs):
+		with self.lock:
+			self.xrun_total += 1
+			self.xrun_window += 1
+			self.xrun_delay_max = max(self.xrun_delay_max, delayed_usecs)
+			self.xrun_log.append((time.time(), delayed_usecs))
+
+	def on_blocksize(self, blocksize):
+		self.blocksize = blocksize
+
+	def on_samplerate(self, samplerate):
+		self.samplerate = samplerate
+
+	def on_shutdown(self, status, reason):
+		self.io_loop.add_callback(self.on_lost)
+
+	# --------------------------------------------------------------------------
+	# Sampling & aggregation
+	# --------------------------------------------------------------------------
+
+	def poll(self):
+		if not self.client:
+			return
+		try:
+			load = self.client.cpu_load()
+		except Exception:
+			self.on_lost()
+			return
+		self.load_sum += load
+		self.load_count += 1
+		if self.load_min is None or load < self.load_min:
+			self.load_min = load
+		if self.load_max is None or load > self.load_max:
+			self.load_max = load
+
+	def end_window(self):
+		with self.lock:
+			xruns = self.xrun_window
+			delay_max = self.xrun_delay_max
+			self.xrun_window = 0
+			self.xrun_delay_max = 0.0
+			last_xrun = self.xrun_log[-1][0] if self.xrun_log else None
+		stats = self.get_empty_stats()
+		stats['xrun_total'] = self.xrun_total
+		stats['last_xrun'] = last_xrun
+		if self.client:
+			stats['connected'] = True
+			stats['xruns'] = xruns
+			stats['xrun_delay_max'] = delay_max if xruns else None
+			stats['blocksize'] = self.blocksize
+			stats['samplerate'] = self.samplerate
+			if self.blocksize and self.samplerate:
+				stats['latency_ms'] = round(1000.0 * self.blocksize / self.samplerate, 2)
+			if self.load_count:
+				stats['cpu_min'] = round(self.load_min, 1)
+				stats['cpu_avg'] = round(self.load_sum / self.load_count, 1)
+				stats['cpu_max'] = round(self.load_max, 1)
+		self.reset_window()
+		self.stats = stats
+		if self.subscribers:
+			message = self.encode({'stats': stats, 'fields': self.get_fields(stats)})
+			for handler in list(self.subscribers):
+				self.send(handler, message)
+
+	def get_xrun_log(self):
+		with self.lock:
+			return [{'time': ts, 'delayed_usecs': delayed} for ts, delayed in self.xrun_log]
+
+	@staticmethod
+	def get_fields(stats):
+		"""Dashboard fields, by tag"""
+		if not stats['connected']:
+			return {
+				'JACK_DSP': "Not running",
+				'JACK_XRUNS': str(stats['xrun_total']),
+				'JACK_BUFFER': "-"
+			}
+		if stats['cpu_avg'] is not None:
+			dsp = "{:.1f}% ({:.1f}/{:.1f})".format(stats['cpu_avg'], stats['cpu_min'], stats['cpu_max'])
+		else:
+			dsp = "???"
+		if stats['last_xrun']:
+			xruns = "{} (last at {})".format(stats['xrun_total'], time.strftime("%H:%M:%S", time.localtime(stats['last_xrun'])))
+		else:
+			xruns = str(stats['xrun_total'])
+		buffer = "{} @ {} Hz ({} ms)".format(stats['blocksize'], stats['samplerate'], stats['latency_ms'])
+		return {
+			'JACK_DSP': dsp,
+			'JACK_XRUNS': xruns,
+			'JACK_BUFFER': buffer
+		}
+
+	# --------------------------------------------------------------------------
+	# Websocket subscribers
+	# --------------------------------------------------------------------------
+
+	def subscribe(self, handler):
+		self.subscribers.add(handler)
+		self.send(handler, self.encode({'stats': self.stats, 'fields': self.get_fields(self.stats)}))
+
+	def unsubscribe(self, handler):
+		self.subscribers.discard(handler)
+
+	@staticmethod
+	def encode(data):
+		return jsonpickle.encode(ZynthianWebSocketMessage('JackMonitorMessageHandler', data))
+
+	def send(self, handler, message):
+		try:
+			handler.websocket.write_message(message)
+		except tornado.websocket.WebSocketClosedError:
+			self.unsubscribe(handler)
+
+
+jack_monitor = JackMonitor()
+
+
+class JackMonitorMessageHandler(ZynthianWebSocketMessageHandler):
+
+	@classmethod
+	def is_registered_for(cls, handler_name):
+		return handler_name == 'JackMonitorMessageHandler'
+
+	def on_websocket_message(self, message):
+		if message == 'SUBSCRIBE':
+			jack_monitor.subscribe(self)
+		elif message == 'UNSUBSCRIBE':
+			jack_monitor.unsubscribe(self)
+		elif message == 'GET_XRUNS':
+			jack_monitor.send(self, jack_monitor.encode({'xrun_log': jack_monitor.get_xrun_log()}))
+
+	def on_close(self):
+		jack_monitor.unsubscribe(self)
+
+# ------------------------------------------------------------------------------
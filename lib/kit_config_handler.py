@@ -26,9 +26,10 @@ import os
 import tornado.web
 
 from lib.zynthian_config_handler import ZynthianConfigHandler
-from lib.audio_config_handler import soundcard_presets
+from lib.audio_config_handler import get_soundcard_presets
 from lib.display_config_handler import DisplayConfigHandler
 from lib.wiring_config_handler import WiringConfigHandler
+from lib.i2c_inventory import i2c_inventory
 
 #------------------------------------------------------------------------------
 # Kit Configuration
@@ -66,19 +67,19 @@ class KitConfigHandler(ZynthianConfigHandler):
 
 
 	@tornado.web.authenticated
-	def post(self):
+	async def post(self):
 		postedConfig = tornado.escape.recursive_unicode(self.request.arguments)
 		current_kit_version = os.environ.get('ZYNTHIAN_KIT_VERSION')
 
 		errors={}
 		if postedConfig['ZYNTHIAN_KIT_VERSION'][0]!=current_kit_version:
-			errors = self.configure_kit(postedConfig)
+			errors = await self.configure_kit(postedConfig)
 			self.reboot_flag = True
 
 		self.get(errors)
 
 
-	def configure_kit(self, pconfig):
+	async def configure_kit(self, pconfig):
 		kit_version = pconfig['ZYNTHIAN_KIT_VERSION'][0]
 		if kit_version != "Custom":
 			if kit_version == "MINI V2":
@@ -153,7 +154,7 @@ class KitConfigHandler(ZynthianConfigHandler):
 				overclocking = "None"
 
 			pconfig['SOUNDCARD_NAME']=[soundcard_name]
-			for k,v in soundcard_presets[soundcard_name].items():
+			for k,v in get_soundcard_presets()[soundcard_name].items():
 				pconfig[k]=[v]
 
 			pconfig['DISPLAY_NAME']=[display_name]
@@ -161,7 +162,9 @@ class KitConfigHandler(ZynthianConfigHandler):
 				pconfig[k]=[v]
 
 			pconfig['ZYNTHIAN_WIRING_LAYOUT']=[wiring_layout]
-			for k,v in WiringConfigHandler.wiring_presets[wiring_layout].items():
+			if wiring_layout != os.environ.get('ZYNTHIAN_WIRING_LAYOUT'):
+				i2c_inventory.invalidate()
+			for k,v in (await WiringConfigHandler.get_wiring_presets())[wiring_layout].items():
 				pconfig[k]=[v]
 
 			pconfig['ZYNTHIAN_WIRING_LAYOUT_CUSTOM_PROFILE']=[wiring_layout_custom_profile]
@@ -173,6 +176,6 @@ class KitConfigHandler(ZynthianConfigHandler):
 
 		errors = self.update_config(pconfig)
 		DisplayConfigHandler.delete_fb_splash()
-		WiringConfigHandler.rebuild_zyncoder()
+		await WiringConfigHandler.rebuild_zyncoder()
 		
 		return errors
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Lazy Handler Loading
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import sys
+import time
+import logging
+import importlib
+import tornado.web
+
+from lib.metrics import metrics
+
+# ------------------------------------------------------------------------------
+# Timed imports
+# ------------------------------------------------------------------------------
+
+
+def timed_import(module_name):
+	"""Import a module, recording the time spent the first time it is loaded."""
+	try:
+		return sys.modules[module_name]
+	except KeyError:
+		pass
+	ts = time.monotonic()
+	module = importlib.import_module(module_name)
+	dt = time.monotonic() - ts
+	metrics.observe_import(module_name, dt)
+	logging.info("Imported '{}' in {:.3f}s".format(module_name, dt))
+	return module
+
+
+def log_import_report():
+	report = sorted(metrics.import_times.items(), key=lambda item: item[1], reverse=True)
+	lines = ["{:>8.3f}s  {}".format(dt, module_name) for module_name, dt in report]
+	logging.info("Startup imports ({:.3f}s total):\n{}".format(sum(metrics.import_times.values()), "\n".join(lines)))
+
+# ------------------------------------------------------------------------------
+# Lazy Request Handler
+#
+# Route target standing for a handler class that is imported on the first
+# request to its URL. Handlers using @stream_request_body must be registered
+# with stream_request_body=True, because tornado checks it before instancing.
+# ------------------------------------------------------------------------------
+
+
+def lazy_handler(module_name, class_name, stream_request_body=False):
+
+	class LazyHandler(tornado.web.RequestHandler):
+		handler_class = None
+
+		def __new__(cls, application, request, **kwargs):
+			if cls.handler_class is None:
+				cls.handler_class = getattr(timed_import(module_name), class_name)
+			return cls.handler_class(application, request, **kwargs)
+
+	LazyHandler.__name__ = LazyHandler.__qualname__ = "Lazy" + class_name
+	if stream_request_body:
+		LazyHandler._stream_request_body = True
+	return LazyHandler
+
+# ------------------------------------------------------------------------------
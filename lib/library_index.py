@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Library Content Index
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import os
+import errno
+import ctypes
+import ctypes.util
+import struct
+import logging
+import threading
+from fnmatch import fnmatchcase
+import tornado.ioloop
+
+# ------------------------------------------------------------------------------
+# Library Content Index
+#
+# Per-category file counts & sizes for the user's library. A full scan is done
+# at startup, then kept up to date from inotify events. If inotify can't be
+# used (or the watch limit is reached), it falls back to periodic rescans.
+# ------------------------------------------------------------------------------
+
+MY_DATA_DIR = os.environ.get('ZYNTHIAN_MY_DATA_DIR', "/zynthian/zynthian-my-data")
+
+# Top level directories of MY_DATA_DIR being indexed
+INDEXED_DIRS = ("snapshots", "presets", "soundfonts", "capture")
+
+CATEGORIES = ("snapshots", "presets", "soundfonts", "audio_captures", "midi_captures")
+
+# Seconds between full rescans when inotify is not available
+RESCAN_INTERVAL = 300
+
+# inotify constants (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def classify(parts, is_dir):
+	"""Category of a path (split relative to MY_DATA_DIR), or None if not counted. Same criteria as the former find commands."""
+	top = parts[0]
+	name = parts[-1]
+	if is_dir:
+		# Puredata presets are directories: presets/puredata/<type>/<preset>
+		if top == "presets" and len(parts) == 4 and parts[1] == "puredata":
+			return "presets"
+		return None
+	if len(parts) < 2:
+		return None
+	if top == "snapshots":
+		return "snapshots"
+	if top == "soundfonts":
+		return "soundfonts"
+	if top == "capture":
+		if fnmatchcase(name, "*.wav"):
+			return "audio_captures"
+		if fnmatchcase(name, "*.mid"):
+			return "midi_captures"
+		return None
+	if top == "presets" and len(parts) > 2:
+		engine = parts[1]
+		if engine == "lv2":
+			return "presets" if name == "manifest.ttl" else None
+		if engine == "pianoteq":
+			return "presets"
+		if engine == "zynaddsubfx":
+			return "presets" if fnmatchcase(name, "*.xiz") else None
+	return None
+
+
+class Inotify:
+	"""Minimal libc inotify binding"""
+
+	def __init__(self):
+		libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+		self._add_watch = libc.inotify_add_watch
+		self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+		self._rm_watch = libc.inotify_rm_watch
+		self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+		self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self.fd < 0:
+			err = ctypes.get_errno()
+			raise OSError(err, os.strerror(err))
+
+	def add_watch(self, path, mask):
+		wd = self._add_watch(self.fd, os.fsencode(path), mask)
+		if wd < 0:
+			err = ctypes.get_errno()
+			raise OSError(err, os.strerror(err), path)
+		return wd
+
+	def rm_watch(self, wd):
+		self._rm_watch(self.fd, wd)
+
+	def read_events(self):
+		"""Return a list of (wd, mask, name) for the pending events"""
+		res = []
+		try:
+			buf = os.read(self.fd, 65536)
+		except BlockingIOError:
+			return res
+		pos = 0
+		while pos + EVENT_HEADER.size <= len(buf):
+			wd, mask, cookie, length = EVENT_HEADER.unpack_from(buf, pos)
+			pos += EVENT_HEADER.size
+			name = os.fsdecode(buf[pos:pos + length].rstrip(b"\0"))
+			pos += length
+			res.append((wd, mask, name))
+		return res
+
+	def close(self):
+		os.close(self.fd)
+
+
+class LibraryIndex:
+
+	def __init__(self, root=MY_DATA_DIR):
+		self.root = root
+		self.lock = threading.RLock()
+		self.inotify = None
+		self.io_loop = None
+		self.periodic = None
+		self.ready = False
+		# A full scan is running / another one must follow it
+		self.scanning = False
+		self.rescan_pending = False
+		self.reset()
+		# Counts & sizes served while a full scan is running
+		self.last_counts = dict(self.counts)
+		self.last_sizes = dict(self.sizes)
+
+	def reset(self):
+		# path => (category, size)
+		self.entries = {}
+		self.counts = dict.fromkeys(CATEGORIES, 0)
+		self.sizes = dict.fromkeys(CATEGORIES, 0)
+		# Indexed directories (path => real path) and their watches
+		self.dirs = {}
+		self.wd_paths = {}
+		self.path_wds = {}
+
+	def start(self):
+		self.io_loop = tornado.ioloop.IOLoop.current()
+		try:
+			self.inotify = Inotify()
+			tornado.ioloop.IOLoop.current().add_handler(self.inotify.fd, self.on_inotify, tornado.ioloop.IOLoop.READ)
+		except Exception as e:
+			logging.warning("Library index can't use inotify, falling back to rescans each {}s => {}".format(RESCAN_INTERVAL, e))
+			self.inotify = None
+			self.start_rescans()
+		self.start_scan()
+
+	def start_scan(self):
+		"""Start a full scan in a thread. While one is running, requests are coalesced into a single rescan after it."""
+		with self.lock:
+			if self.scanning:
+				self.rescan_pending = True
+				return None
+			self.scanning = True
+		thread = threading.Thread(target=self.run_scans, name="library_index", daemon=True)
+		thread.start()
+		return thread
+
+	def run_scans(self):
+		while True:
+			try:
+				self.full_scan()
+			except Exception as e:
+				logging.error("Library index scan failed => {}".format(e))
+			with self.lock:
+				if not self.rescan_pending:
+					self.scanning = False
+					return
+				self.rescan_pending = False
+
+	def start_rescans(self):
+		if self.periodic is None:
+			self.periodic = tornado.ioloop.PeriodicCallback(self.start_scan, RESCAN_INTERVAL * 1000)
+			self.periodic.start()
+
+	def full_scan(self):
+		with self.lock:
+			if self.ready:
+				self.last_counts = dict(self.counts)
+				self.last_sizes = dict(self.sizes)
+			self.ready = False
+			if self.inotify:
+				for wd in self.wd_paths:
+					self.inotify.rm_watch(wd)
+			self.reset()
+			self.add_watch(self.root)
+		for dname in INDEXED_DIRS:
+			self.scan_dir(os.path.join(self.root, dname))
+		self.ready = True
+		logging.info("Library index: {}".format(self.counts))
+
+	# --------------------------------------------------------------------------
+	# Index updates
+	# --------------------------------------------------------------------------
+
+	def get_parts(self, path):
+		rpath = os.path.relpath(path, self.root)
+		if rpath.startswith(".."):
+			return None
+		return rpath.split(os.sep)
+
+	def add_watch(self, dpath):
+		if not self.inotify:
+			return
+		try:
+			wd = self.inotify.add_watch(dpath, WATCH_MASK)
+		except OSError as e:
+			if e.errno == errno.ENOSPC:
+				logging.warning("Library index reached the inotify watch limit, falling back to rescans")
+				# Called from the scanning thread too => schedule it on the loop
+				self.io_loop.add_callback(self.start_rescans)
+			return
+		# Same inode reached through a different path => keep the first one
+		if wd not in self.wd_paths:
+			self.wd_paths[wd] = dpath
+			self.path_wds[dpath] = wd
+
+	def add_entry(self, path, is_dir):
+		parts = self.get_parts(path)
+		if not parts:
+			return
+		cat = classify(parts, is_dir)
+		if cat is None:
+			return
+		try:
+			size = 0 if is_dir else os.stat(path).st_size
+		except OSError:
+			return
+		self.remove_entry(path)
+		self.entries[path] = (cat, size)
+		self.counts[cat] += 1
+		self.sizes[cat] += size
+
+	def remove_entry(self, path):
+		try:
+			cat, size = self.entries.pop(path)
+		except KeyError:
+			return
+		self.counts[cat] -= 1
+		self.sizes[cat] -= size
+
+	def scan_dir(self, dpath):
+		"""Index a directory tree, following symlinks like "find -follow" does"""
+		stack = [dpath]
+		while stack:
+			dpath = stack.pop()
+			try:
+				rpath = os.path.realpath(dpath)
+			except OSError:
+				continue
+			with self.lock:
+				if dpath in self.dirs or rpath in self.dirs.values() or not os.path.isdir(dpath):
+					continue
+				self.dirs[dpath] = rpath
+				# Watch before listing, so nothing created meanwhile is missed
+				self.add_watch(dpath)
+				self.add_entry(dpath, True)
+				try:
+					with os.scandir(dpath) as it:
+						for entry in it:
+							try:
+								if entry.is_dir():
+									stack.append(entry.path)
+								else:
+									self.add_entry(entry.path, False)
+							except OSError:
+								pass
+				except OSError:
+					pass
+
+	def remove_tree(self, dpath):
+		prefix = dpath + os.sep
+		for path in [p for p in self.dirs if p == dpath or p.startswith(prefix)]:
+			del self.dirs[path]
+			wd = self.path_wds.pop(path, None)
+			if wd is not None:
+				del self.wd_paths[wd]
+				self.inotify.rm_watch(wd)
+		for path in [p for p in self.entries if p.startswith(prefix)]:
+			self.remove_entry(path)
+		self.remove_entry(dpath)
+
+	def on_inotify(self, fd, events):
+		rescan = False
+		with self.lock:
+			for wd, mask, name in self.inotify.read_events():
+				if mask & IN_Q_OVERFLOW:
+					rescan = True
+					continue
+				if mask & IN_IGNORED:
+					path = self.wd_paths.pop(wd, None)
+					if path is not None:
+						self.path_wds.pop(path, None)
+					continue
+				try:
+					dpath = self.wd_paths[wd]
+				except KeyError:
+					continue
+				path = os.path.join(dpath, name)
+				if dpath == self.root and name not in INDEXED_DIRS:
+					continue
+				if mask & (IN_DELETE | IN_MOVED_FROM):
+					if path in self.dirs:
+						self.remove_tree(path)
+					else:
+						self.remove_entry(path)
+				elif mask & (IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE):
+					# Symlinks to directories are followed too
+					if os.path.isdir(path):
+						if mask & IN_MOVED_TO and path in self.dirs:
+							self.remove_tree(path)
+						self.scan_dir(path)
+					else:
+						self.add_entry(path, False)
+		if rescan:
+			logging.warning("Library index: inotify queue overflow, rescanning")
+			self.start_scan()
+
+	# --------------------------------------------------------------------------
+	# Queries
+	# --------------------------------------------------------------------------
+
+	def get_count(self, category):
+		if self.ready:
+			return self.counts[category]
+		return self.last_counts[category]
+
+	def get_size(self, category):
+		if self.ready:
+			return self.sizes[category]
+		return self.last_sizes[category]
+
+	def get_stats(self):
+		with self.lock:
+			return {cat: {'count': self.get_count(cat), 'size': self.get_size(cat)} for cat in CATEGORIES}
+
+
+library_index = LibraryIndex()
+
+# ------------------------------------------------------------------------------
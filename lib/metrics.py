@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Request & Websocket Metrics
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# ------------------------------------------------------------------------------
+# Metrics Registry
+# ------------------------------------------------------------------------------
+
+# Upper bounds (seconds) of the latency histogram buckets. +Inf is implicit.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Window (seconds) used for the websocket message rate in the JSON output
+RATE_WINDOW = 60
+
+# Route (handler name) of the request being served in the current context
+current_route = ContextVar("current_route", default=None)
+
+
+class Histogram:
+
+	def __init__(self, buckets=LATENCY_BUCKETS):
+		self.buckets = buckets
+		self.counts = [0] * (len(buckets) + 1)
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value):
+		i = 0
+		for le in self.buckets:
+			if value <= le:
+				break
+			i += 1
+		self.counts[i] += 1
+		self.sum += value
+		self.count += 1
+
+	def cumulative(self):
+		res = []
+		acc = 0
+		for i, le in enumerate(self.buckets):
+			acc += self.counts[i]
+			res.append((le, acc))
+		res.append(("+Inf", self.count))
+		return res
+
+
+class RouteMetrics:
+
+	def __init__(self):
+		self.requests = {}
+		self.latency = Histogram()
+		self.bytes_sent = 0
+		# Time spent in each category (subprocess, zynconf, ...) while serving this route
+		self.timing = {}
+
+
+class Metrics:
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.start_ts = time.time()
+		self.routes = {}
+		# category => [count, seconds]
+		self.timing = {}
+		# handler_name => [count, seconds]
+		self.ws_messages = {}
+		self.ws_recent = deque(maxlen=10000)
+		# module => seconds spent importing it
+		self.import_times = {}
+
+	def get_route(self, route):
+		try:
+			return self.routes[route]
+		except KeyError:
+			rm = self.routes[route] = RouteMetrics()
+			return rm
+
+	def observe_request(self, route, method, status, latency, bytes_sent):
+		with self.lock:
+			rm = self.get_route(route)
+			key = (method, status)
+			rm.requests[key] = rm.requests.get(key, 0) + 1
+			rm.latency.observe(latency)
+			rm.bytes_sent += bytes_sent
+
+	def observe_timing(self, category, seconds, route=None):
+		with self.lock:
+			t = self.timing.setdefault(category, [0, 0.0])
+			t[0] += 1
+			t[1] += seconds
+			if route:
+				rt = self.get_route(route).timing.setdefault(category, [0, 0.0])
+				rt[0] += 1
+				rt[1] += seconds
+
+	def observe_ws_message(self, handler_name, seconds):
+		with self.lock:
+			m = self.ws_messages.setdefault(handler_name, [0, 0.0])
+			m[0] += 1
+			m[1] += seconds
+			self.ws_recent.append((time.monotonic(), handler_name))
+
+	def observe_import(self, module_name, seconds):
+		with self.lock:
+			self.import_times[module_name] = seconds
+
+	@contextmanager
+	def timed(self, category):
+		"""Account the time spent inside the block to category and to the current route."""
+		ts = time.monotonic()
+		try:
+			yield
+		finally:
+			self.observe_timing(category, time.monotonic() - ts, current_route.get())
+
+	def get_ws_rates(self):
+		limit = time.monotonic() - RATE_WINDOW
+		rates = {}
+		for ts, name in self.ws_recent:
+			if ts >= limit:
+				rates[name] = rates.get(name, 0) + 1
+		return {name: n / RATE_WINDOW for name, n in rates.items()}
+
+	def to_json(self):
+		with self.lock:
+			routes = {}
+			for route, rm in self.routes.items():
+				count = rm.latency.count
+				routes[route] = {
+					'requests': sum(rm.requests.values()),
+					'status': {"{} {}".format(*k): v for k, v in rm.requests.items()},
+					'latency_avg': rm.latency.sum / count if count else 0,
+					'latency_buckets': {str(le): n for le, n in rm.latency.cumulative()},
+					'bytes_sent': rm.bytes_sent,
+					'timing': {cat: {'count': t[0], 'seconds': t[1]} for cat, t in rm.timing.items()}
+				}
+			return {
+				'uptime': time.time() - self.start_ts,
+				'routes': routes,
+				'timing': {cat: {'count': t[0], 'seconds': t[1]} for cat, t in self.timing.items()},
+				'websocket': {name: {'count': m[0], 'seconds': m[1]} for name, m in self.ws_messages.items()},
+				'websocket_rates': self.get_ws_rates(),
+				'imports': dict(self.import_times)
+			}
+
+	def to_prometheus(self):
+		lines = []
+		with self.lock:
+			lines.append("# HELP webconf_uptime_seconds Seconds since webconf started.")
+			lines.append("# TYPE webconf_uptime_seconds gauge")
+			lines.append("webconf_uptime_seconds {:.3f}".format(time.time() - self.start_ts))
+
+			lines.append("# HELP webconf_requests_total HTTP requests served, by route, method and status.")
+			lines.append("# TYPE webconf_requests_total counter")
+			for route, rm in self.routes.items():
+				for (method, status), n in rm.requests.items():
+					lines.append('webconf_requests_total{{route="{}",method="{}",status="{}"}} {}'.format(route, method, status, n))
+
+			lines.append("# HELP webconf_request_duration_seconds HTTP request latency, by route.")
+			lines.append("# TYPE webconf_request_duration_seconds histogram")
+			for route, rm in self.routes.items():
+				for le, n in rm.latency.cumulative():
+					lines.append('webconf_request_duration_seconds_bucket{{route="{}",le="{}"}} {}'.format(route, le, n))
+				lines.append('webconf_request_duration_seconds_sum{{route="{}"}} {:.6f}'.format(route, rm.latency.sum))
+				lines.append('webconf_request_duration_seconds_count{{route="{}"}} {}'.format(route, rm.latency.count))
+
+			lines.append("# HELP webconf_response_bytes_total Response bytes sent, by route.")
+			lines.append("# TYPE webconf_response_bytes_total counter")
+			for route, rm in self.routes.items():
+				lines.append('webconf_response_bytes_total{{route="{}"}} {}'.format(route, rm.bytes_sent))
+
+			lines.append("# HELP webconf_timing_seconds_total Time spent in subprocesses, zynconf, etc., by category (requests & background tasks).")
+			lines.append("# TYPE webconf_timing_seconds_total counter")
+			for cat, t in self.timing.items():
+				lines.append('webconf_timing_seconds_total{{category="{}"}} {:.6f}'.format(cat, t[1]))
+
+			lines.append("# HELP webconf_route_timing_seconds_total Time spent in subprocesses, zynconf, etc. while serving requests, by category and route.")
+			lines.append("# TYPE webconf_route_timing_seconds_total counter")
+			for route, rm in self.routes.items():
+				for cat, t in rm.timing.items():
+					lines.append('webconf_route_timing_seconds_total{{category="{}",route="{}"}} {:.6f}'.format(cat, route, t[1]))
+
+			lines.append("# HELP webconf_timing_calls_total Calls to subprocesses, zynconf, etc., by category.")
+			lines.append("# TYPE webconf_timing_calls_total counter")
+			for cat, t in self.timing.items():
+				lines.append('webconf_timing_calls_total{{category="{}"}} {}'.format(cat, t[0]))
+
+			lines.append("# HELP webconf_websocket_messages_total Websocket messages received, by message handler.")
+			lines.append("# TYPE webconf_websocket_messages_total counter")
+			for name, m in self.ws_messages.items():
+				lines.append('webconf_websocket_messages_total{{handler="{}"}} {}'.format(name, m[0]))
+
+			lines.append("# HELP webconf_websocket_message_seconds_total Time spent handling websocket messages.")
+			lines.append("# TYPE webconf_websocket_message_seconds_total counter")
+			for name, m in self.ws_messages.items():
+				lines.append('webconf_websocket_message_seconds_total{{handler="{}"}} {:.6f}'.format(name, m[1]))
+
+			lines.append("# HELP webconf_import_seconds Time spent importing each module (startup and lazy handlers).")
+			lines.append("# TYPE webconf_import_seconds gauge")
+			for module_name, seconds in self.import_times.items():
+				lines.append('webconf_import_seconds{{module="{}"}} {:.6f}'.format(module_name, seconds))
+
+		return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+# ------------------------------------------------------------------------------
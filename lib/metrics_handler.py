@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Metrics Handler
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import os
+import tornado.web
+
+from lib.metrics import metrics
+from lib.zynthian_config_handler import ZynthianAuthHandler
+from lib.metrics_history import metrics_history, SERIES, RESOLUTIONS
+
+# ------------------------------------------------------------------------------
+# Metrics Handler
+#
+# /metrics => Prometheus text format
+# /metrics?json=1 => JSON, for the dashboard
+# /metrics/history => system metrics history (JSON), for sparklines
+#
+# Set ZYNTHIAN_WEBCONF_METRICS_PUBLIC=1 to allow scraping without login.
+# ------------------------------------------------------------------------------
+
+
+class MetricsHandler(ZynthianAuthHandler):
+
+	public = os.environ.get('ZYNTHIAN_WEBCONF_METRICS_PUBLIC', '0') == '1'
+
+	def get_current_user(self):
+		if self.public:
+			return "metrics"
+		return super().get_current_user()
+
+	def set_default_headers(self):
+		self.set_header('Cache-Control', 'no-store, no-cache, must-revalidate, max-age=0')
+
+	@tornado.web.authenticated
+	def get(self):
+		if self.get_argument('json', None):
+			self.write(metrics.to_json())
+		else:
+			self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+			self.write(metrics.to_prometheus())
+
+
+class MetricsHistoryHandler(MetricsHandler):
+	"""
+	Query arguments (all optional):
+		series: comma separated list of series names (default: all)
+		span: seconds back from now (default: 3600)
+		points: max number of values per series (default: 120)
+		resolution: 1s, 1m or 1h (default: finest one covering span)
+	"""
+
+	max_points = 2000
+
+	@tornado.web.authenticated
+	def get(self):
+		try:
+			series = [name for name in self.get_argument('series', ",".join(SERIES)).split(",") if name]
+			for name in series:
+				if name not in SERIES:
+					raise ValueError("Unknown series '{}'".format(name))
+			span = float(self.get_argument('span', 3600))
+			points = int(self.get_argument('points', 120))
+			if span <= 0 or not 0 < points <= self.max_points:
+				raise ValueError("Wrong span or points")
+			resolution = self.get_argument('resolution', None)
+			if resolution is not None and resolution not in RESOLUTIONS:
+				raise ValueError("Unknown resolution '{}'".format(resolution))
+		except ValueError as e:
+			raise tornado.web.HTTPError(400, str(e))
+		if not metrics_history.rings:
+			raise tornado.web.HTTPError(503, "Metrics history not available")
+		self.write(metrics_history.get_history(series, span, points, resolution))
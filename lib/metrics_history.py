@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# System Metrics History
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import os
+import math
+import mmap
+import struct
+import logging
+
+from lib.telemetry import telemetry
+
+# ------------------------------------------------------------------------------
+# Metrics History
+#
+# Fixed size ring buffers at 3 resolutions (1s, 1min, 1h), stored in a memory
+# mapped file on tmpfs, so history survives webconf restarts (not reboots)
+# without touching the SD card. Coarser resolutions are downsampled from the
+# finer ones: mean for measures, OR for the throttling flags. Samples come
+# from the telemetry collector, which reads /proc & /sys once per second.
+# ------------------------------------------------------------------------------
+
+HISTORY_FPATH = os.environ.get('ZYNTHIAN_WEBCONF_METRICS_HISTORY_FILE', "/dev/shm/zynthian-webconf-metrics.bin")
+
+SERIES = ("cpu_load", "temperature", "throttled", "ram_used", "swap_used")
+
+# Name => (step in seconds, number of slots)
+RESOLUTIONS = {
+	"1s": (1, 3600),
+	"1m": (60, 1440),
+	"1h": (3600, 720)
+}
+
+MAGIC = b"ZWMH"
+VERSION = 1
+FILE_HEADER = struct.Struct("4sIII")
+RING_HEADER_SIZE = 16
+
+
+def aggregate(name, values):
+	values = [v for v in values if not math.isnan(v)]
+	if not values:
+		return float('nan')
+	if name == "throttled":
+		res = 0
+		for v in values:
+			res |= int(v)
+		return float(res)
+	return sum(values) / len(values)
+
+
+class MappedRing:
+	"""Ring buffer of timestamps plus one float32 array per series, on top of a memoryview"""
+
+	def __init__(self, buf, offset, size, nseries):
+		self.size = size
+		# pos, count
+		self.header = buf[offset:offset + RING_HEADER_SIZE].cast('q')
+		offset += RING_HEADER_SIZE
+		self.times = buf[offset:offset + 8 * size].cast('d')
+		offset += 8 * size
+		self.series = []
+		for i in range(nseries):
+			self.series.append(buf[offset:offset + 4 * size].cast('f'))
+			offset += 4 * size
+		self.end = offset
+
+	@staticmethod
+	def get_nbytes(size, nseries):
+		return RING_HEADER_SIZE + 8 * size + 4 * size * nseries
+
+	def is_valid(self):
+		return 0 <= self.header[0] < self.size and 0 <= self.header[1] <= self.size
+
+	def clear(self):
+		self.header[0] = 0
+		self.header[1] = 0
+
+	def append(self, ts, values):
+		pos = self.header[0]
+		self.times[pos] = ts
+		for i, v in enumerate(values):
+			self.series[i][pos] = v
+		self.header[0] = (pos + 1) % self.size
+		if self.header[1] < self.size:
+			self.header[1] += 1
+
+	def last_time(self):
+		if self.header[1] == 0:
+			return None
+		return self.times[self.header[0] - 1]
+
+	def get_range(self, n):
+		"""Indexes of the last n slots, oldest first"""
+		count = self.header[1]
+		if n > count:
+			n = count
+		start = self.header[0] - n
+		return [(start + i) % self.size for i in range(n)]
+
+
+class MetricsHistory:
+
+	def __init__(self, fpath=HISTORY_FPATH):
+		self.fpath = fpath
+		self.mm = None
+		self.rings = {}
+		# Resolution => (bucket, [values per series]) being accumulated for it
+		self.pending = {}
+
+	def open(self):
+		nbytes = FILE_HEADER.size
+		for step, size in RESOLUTIONS.values():
+			nbytes += MappedRing.get_nbytes(size, len(SERIES))
+		fd = os.open(self.fpath, os.O_RDWR | os.O_CREAT, 0o600)
+		try:
+			reset = os.fstat(fd).st_size != nbytes
+			if reset:
+				os.ftruncate(fd, nbytes)
+			self.mm = mmap.mmap(fd, nbytes)
+		finally:
+			os.close(fd)
+		buf = memoryview(self.mm)
+		magic, version, nseries, nres = FILE_HEADER.unpack_from(self.mm, 0)
+		if (magic, version, nseries, nres) != (MAGIC, VERSION, len(SERIES), len(RESOLUTIONS)):
+			reset = True
+		offset = FILE_HEADER.size
+		for name, (step, size) in RESOLUTIONS.items():
+			ring = self.rings[name] = MappedRing(buf, offset, size, len(SERIES))
+			offset = ring.end
+			if reset or not ring.is_valid():
+				ring.clear()
+		FILE_HEADER.pack_into(self.mm, 0, MAGIC, VERSION, len(SERIES), len(RESOLUTIONS))
+
+	def start(self):
+		try:
+			self.open()
+		except Exception as e:
+			logging.error("Can't open metrics history file '{}' => {}".format(self.fpath, e))
+			return
+		telemetry.add_listener(self.on_sample)
+		telemetry.start()
+
+	def on_sample(self, sample):
+		"""Store a telemetry sample (see TelemetryCollector.add_listener)"""
+		nan = float('nan')
+		self.record(sample['time'], (
+			sample['cpu_load'] if sample['cpu_load'] is not None else nan,
+			sample['temperature'] if sample['temperature'] is not None else nan,
+			sample['throttled'] if sample['throttled'] is not None else nan,
+			sample['ram_used'] / 1048576,
+			sample['swap_used'] / 1048576
+		))
+
+	def record(self, ts, values, resolution="1s"):
+		"""Store a sample and feed it to the next (coarser) resolution"""
+		step = RESOLUTIONS[resolution][0]
+		self.rings[resolution].append(ts - ts % step, values)
+		names = list(RESOLUTIONS.keys())
+		i = names.index(resolution)
+		if i + 1 < len(names):
+			next_res = names[i + 1]
+			next_step = RESOLUTIONS[next_res][0]
+			bucket = ts - ts % next_step
+			try:
+				pending_bucket, pending_values = self.pending[next_res]
+			except KeyError:
+				pending_bucket, pending_values = bucket, [[] for name in SERIES]
+			if bucket != pending_bucket:
+				# Bucket complete => downsample & store it
+				self.pending.pop(next_res)
+				self.record(pending_bucket, [aggregate(name, vals) for name, vals in zip(SERIES, pending_values)], next_res)
+				pending_bucket, pending_values = bucket, [[] for name in SERIES]
+			for vals, v in zip(pending_values, values):
+				vals.append(v)
+			self.pending[next_res] = (pending_bucket, pending_values)
+
+	# --------------------------------------------------------------------------
+	# Queries
+	# --------------------------------------------------------------------------
+
+	def choose_resolution(self, span):
+		"""Finest resolution whose ring covers span seconds"""
+		for name, (step, size) in RESOLUTIONS.items():
+			if step * size >= span:
+				return name
+		return name
+
+	def get_history(self, series=SERIES, span=3600, points=120, resolution=None):
+		"""
+		Last span seconds of the requested series, decimated to at most points
+		values each. NaN (no data) is returned as None.
+		"""
+		if resolution is None:
+			resolution = self.choose_resolution(span)
+		step, size = RESOLUTIONS[resolution]
+		ring = self.rings[resolution]
+		indexes = ring.get_range(min(size, math.ceil(span / step)))
+		# Drop slots older than span (ring may have gaps, i.e. webconf not running)
+		last_ts = ring.last_time()
+		if last_ts is not None:
+			indexes = [i for i in indexes if ring.times[i] > last_ts - span]
+		group = max(1, math.ceil(len(indexes) / points))
+		groups = [indexes[i:i + group] for i in range(0, len(indexes), group)]
+		res = {
+			'resolution': resolution,
+			'step': step * group,
+			'time': [ring.times[g[-1]] for g in groups],
+			'series': {}
+		}
+		for name in series:
+			data = ring.series[SERIES.index(name)]
+			values = []
+			for g in groups:
+				v = aggregate(name, [data[i] for i in g])
+				values.append(None if math.isnan(v) else round(v, 2))
+			res['series'][name] = values
+		return res
+
+
+metrics_history = MetricsHistory()
+
+# ------------------------------------------------------------------------------
@@ -32,6 +32,7 @@ from shutil import copyfile
 from lib.zynthian_config_handler import ZynthianConfigHandler
 
 import zynconf
+from lib.zynconf_cache import zynconf_cache
 from zyngine.zynthian_midi_filter import MidiFilterScript
 from zyngui.zynthian_gui import zynthian_gui
 
@@ -329,8 +330,8 @@ class MidiConfigHandler(ZynthianConfigHandler):
 		'PB': 'Pitch Bending'
 	}
 
-	def prepare(self):
-		super().prepare()
+	async def prepare(self):
+		await super().prepare()
 		self.current_midi_profile_script = None
 		self.load_midi_profile_directories()
 
@@ -569,7 +570,7 @@ class MidiConfigHandler(ZynthianConfigHandler):
 					mode = os.stat(self.current_midi_profile_script).st_mode
 					mode |= (mode & 0o444) >> 2	 # copy R bits to X
 					os.chmod(self.current_midi_profile_script, mode)
-					errors = zynconf.save_config({'ZYNTHIAN_SCRIPT_MIDI_PROFILE': self.current_midi_profile_script})
+					errors = zynconf_cache.save_config({'ZYNTHIAN_SCRIPT_MIDI_PROFILE': self.current_midi_profile_script})
 					self.load_midi_profile_directories()
 				except:
 					errors['zynthian_midi_profile_saveas_script'] = "Can't create new profile!"
@@ -579,7 +580,7 @@ class MidiConfigHandler(ZynthianConfigHandler):
 				if self.current_midi_profile_script.startswith(self.PROFILES_DIRECTORY):
 					os.remove(self.current_midi_profile_script)
 					self.current_midi_profile_script = "{}/default.sh".format(self.PROFILES_DIRECTORY)
-					errors = zynconf.save_config({'ZYNTHIAN_SCRIPT_MIDI_PROFILE': self.current_midi_profile_script})
+					errors = zynconf_cache.save_config({'ZYNTHIAN_SCRIPT_MIDI_PROFILE': self.current_midi_profile_script})
 					self.load_midi_profile_directories()
 				else:
 					errors['zynthian_midi_profile_delete_script'] = 'You are allowed to delete user profiles only!'
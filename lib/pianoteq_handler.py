@@ -32,6 +32,7 @@ from xml.etree import ElementTree
 from subprocess import check_output, STDOUT
 
 import zynconf
+from lib.zynconf_cache import zynconf_cache
 from zyngine.zynthian_engine_pianoteq import *
 from lib.zynthian_config_handler import ZynthianBasicHandler
 
@@ -164,7 +165,7 @@ class PianoteqHandler(ZynthianBasicHandler):
 			"ZYNTHIAN_PIANOTEQ_VOICE_LIMIT": self.get_argument('ZYNTHIAN_PIANOTEQ_VOICE_LIMIT'),
 			"ZYNTHIAN_PIANOTEQ_CPU_OVERLOAD_DETECTION": self.get_argument('ZYNTHIAN_PIANOTEQ_CPU_OVERLOAD_DETECTION')
 		}
-		errors = zynconf.save_config(config, updsys=True)
+		errors = zynconf_cache.save_config(config, updsys=True)
 
 		# Restarts UI if pianoteq engine is running
 		for process in psutil.process_iter():
@@ -189,6 +190,6 @@ class PianoteqHandler(ZynthianBasicHandler):
 			if "cpu_overload_detection" in info:
 				config["ZYNTHIAN_PIANOTEQ_CPU_OVERLOAD_DETECTION"] = info["cpu_overload_detection"]
 
-			zynconf.save_config(config, updsys=True)
+			zynconf_cache.save_config(config, updsys=True)
 
 # *****************************************************************************
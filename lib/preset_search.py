@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Preset Search Index
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import os
+import re
+import json
+import time
+import heapq
+import bisect
+import asyncio
+import difflib
+import logging
+
+from lib.lazy_handler import timed_import
+from lib.catalogue_file import CatalogueSaver
+from lib.preset_tree import get_bank_mtime
+
+# ------------------------------------------------------------------------------
+# Preset Search Index
+#
+# Presets of every enabled engine (ZynAddSubFX, LV2 plugins, Pianoteq,
+# Puredata, soundfonts, ...), as listed by their zynapi_get_banks &
+# zynapi_get_presets, indexed by the words of their names. Queries rank exact
+# word matches over prefix matches over fuzzy ones (similar words sharing
+# trigrams), so typos still find presets.
+#
+# The index is saved as a JSON-lines file, one line per bank, and refreshed
+# incrementally in the background, bank by bank, listing from a worker thread:
+# only the banks whose directory/file mtime changed are listed again. Banks that aren't files or
+# directories are listed again after BANK_TTL. Banks listed by the presets
+# page are taken from the preset tree cache.
+# ------------------------------------------------------------------------------
+
+MY_DATA_DIR = os.environ.get('ZYNTHIAN_MY_DATA_DIR', "/zynthian/zynthian-my-data")
+INDEX_FPATH = os.environ.get('ZYNTHIAN_WEBCONF_PRESET_INDEX', MY_DATA_DIR + "/.preset-index.jsonl")
+INDEX_VERSION = 1
+
+# Seconds from startup to the first refresh, so it doesn't compete with it
+START_DELAY = 60
+# Seconds from a refresh to the next one, triggered by a search
+REFRESH_INTERVAL = 300
+BANK_TTL = 3600
+# Seconds from a change to the index being saved
+SAVE_DELAY = 5
+
+SEARCH_LIMIT = 50
+FUZZY_MIN_RATIO = 0.75
+
+WORD_RE = re.compile(r"\w+")
+
+
+def get_words(text):
+	return WORD_RE.findall(str(text).lower())
+
+
+def get_trigrams(word):
+	word = "^" + word + "$"
+	return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+class PresetSearch:
+
+	def __init__(self, fpath=INDEX_FPATH):
+		self.fpath = fpath
+		# (engine code, bank fullpath) => {'engine', 'title', 'bank', 'name', 'mtime', 'listed', 'presets': [[name, fullpath]]}
+		self.banks = {}
+		# Serialized index lines, by bank key
+		self.lines = {}
+		# doc id => (bank key, preset name, preset fullpath, normalized name)
+		self.docs = {}
+		self.bank_docs = {}
+		self.next_doc_id = 0
+		# word => doc ids; trigram => words
+		self.postings = {}
+		self.trigrams = {}
+		# Sorted words, for prefix matching. None => must be rebuilt.
+		self.words = None
+		# Bank key => preset list object taken from the preset tree cache
+		self.fed = {}
+		self.started = False
+		self.saver = CatalogueSaver(fpath, self.get_lines, SAVE_DELAY, "preset index")
+		self.task = None
+		self.last_refresh = None
+
+	def start(self):
+		if self.started:
+			return
+		self.started = True
+		self.load()
+		asyncio.get_event_loop().call_later(START_DELAY, self.refresh)
+
+	# --------------------------------------------------------------------------
+	# Persistence
+	# --------------------------------------------------------------------------
+
+	def load(self):
+		try:
+			with open(self.fpath) as f:
+				header = json.loads(f.readline())
+				if header.get('version') != INDEX_VERSION:
+					logging.info("Preset index version changed, rebuilding it")
+					return
+				for line in f:
+					item = json.loads(line)
+					key = (item['engine'], item['bank'])
+					self.index_bank(key, item)
+					self.lines[key] = line
+		except FileNotFoundError:
+			return
+		except Exception as e:
+			logging.warning("Can't load preset index '{}' => {}".format(self.fpath, e))
+			for key in list(self.banks):
+				self.remove_bank(key)
+			self.lines = {}
+			return
+		logging.info("Loaded preset index: {} presets in {} banks".format(len(self.docs), len(self.banks)))
+
+	def changed(self, key):
+		self.lines.pop(key, None)
+		if self.started:
+			self.saver.schedule()
+
+	def get_line(self, key):
+		try:
+			return self.lines[key]
+		except KeyError:
+			pass
+		line = self.lines[key] = json.dumps(self.banks[key], separators=(',', ':')) + "\n"
+		return line
+
+	def get_lines(self):
+		lines = [json.dumps({'version': INDEX_VERSION}) + "\n"]
+		lines += [self.get_line(key) for key in self.banks]
+		return lines
+
+	# --------------------------------------------------------------------------
+	# Indexing
+	# --------------------------------------------------------------------------
+
+	def index_bank(self, key, item):
+		"""Add or replace a bank of presets"""
+		self.remove_bank(key)
+		self.banks[key] = item
+		doc_ids = self.bank_docs[key] = []
+		for name, fullpath in item['presets']:
+			doc_id = self.next_doc_id
+			self.next_doc_id += 1
+			words = get_words(name)
+			self.docs[doc_id] = (key, name, fullpath, " ".join(words))
+			doc_ids.append(doc_id)
+			for word in set(words):
+				try:
+					self.postings[word].add(doc_id)
+				except KeyError:
+					self.postings[word] = {doc_id}
+					for trigram in get_trigrams(word):
+						self.trigrams.setdefault(trigram, set()).add(word)
+					self.words = None
+
+	def remove_bank(self, key):
+		if self.banks.pop(key, None) is None:
+			return
+		self.fed.pop(key, None)
+		for doc_id in self.bank_docs.pop(key):
+			bank_key, name, fullpath, norm_name = self.docs.pop(doc_id)
+			for word in set(norm_name.split()):
+				doc_ids = self.postings[word]
+				doc_ids.discard(doc_id)
+				if not doc_ids:
+					del self.postings[word]
+					for trigram in get_trigrams(word):
+						words = self.trigrams[trigram]
+						words.discard(word)
+						if not words:
+							del self.trigrams[trigram]
+					self.words = None
+
+	def set_bank(self, eng_code, title, bank_name, fullpath, mtime, presets):
+		"""Store the presets ([name, fullpath] pairs) of a bank, if they changed"""
+		key = (eng_code, fullpath)
+		item = {
+			'engine': eng_code,
+			'title': title,
+			'bank': fullpath,
+			'name': bank_name,
+			'mtime': mtime,
+			'listed': time.time(),
+			'presets': presets
+		}
+		old_item = self.banks.get(key)
+		if old_item and old_item['presets'] == presets and old_item['name'] == bank_name and old_item['title'] == title:
+			# Unchanged => only validated
+			old_item['mtime'] = mtime
+			old_item['listed'] = item['listed']
+		else:
+			self.index_bank(key, item)
+		self.changed(key)
+
+	def is_valid(self, key, bank_name, mtime):
+		item = self.banks.get(key)
+		if item is None or item['name'] != bank_name or item['mtime'] != mtime:
+			return False
+		return mtime is not None or time.time() - item['listed'] < BANK_TTL
+
+	def remove_missing(self, eng_codes, keys):
+		"""Remove the banks of the engines not listed in eng_codes & the banks of those engines not in keys"""
+		for key in list(self.banks):
+			if key[0] not in eng_codes or (eng_codes[key[0]] and key not in keys):
+				self.remove_bank(key)
+				self.changed(key)
+
+	def update_from_tree(self, eng_code, title, tree):
+		"""Take the banks listed by the preset tree cache (see lib.preset_tree) for an engine"""
+		keys = set()
+		for fullpath, (bank_node, mtime, listed, nodes) in tree['presets'].items():
+			key = (eng_code, fullpath)
+			keys.add(key)
+			# Same list object => already taken
+			if listed is None or self.fed.get(key) is nodes:
+				continue
+			self.set_bank(eng_code, title, bank_node['name'], fullpath, mtime, [[p['name'], p['fullpath']] for p in nodes])
+			self.fed[key] = nodes
+		for key in [key for key in self.banks if key[0] == eng_code and key not in keys]:
+			self.remove_bank(key)
+			self.changed(key)
+
+	def refresh(self):
+		"""Start a refresh of the index, unless it's already running"""
+		if self.task is None:
+			self.task = asyncio.ensure_future(self.do_refresh())
+
+	async def do_refresh(self):
+		try:
+			# zyngine is only loaded when the index is refreshed
+			presets_lib = timed_import("lib.presets_config_handler")
+			engines = presets_lib.get_engine_info()
+			loop = asyncio.get_running_loop()
+			# Engine code => True if its banks were listed
+			listed_engines = {}
+			keys = set()
+			n_listed = 0
+			for eng_code, info in engines.items():
+				engine_cls = info['ENGINE']
+				listed_engines[eng_code] = False
+				try:
+					banks = await loop.run_in_executor(None, presets_lib.call_engine, eng_code, engine_cls, "zynapi_get_banks")
+				except Exception as e:
+					logging.warning("Preset index: can't list banks of {} => {}".format(eng_code, e))
+					continue
+				listed_engines[eng_code] = True
+				for bank in banks:
+					fullpath = bank['fullpath']
+					if fullpath is None:
+						continue
+					key = (eng_code, fullpath)
+					keys.add(key)
+					mtime = get_bank_mtime(bank)
+					if self.is_valid(key, bank['name'], mtime):
+						continue
+					try:
+						# Requests may select another LV2 plugin meanwhile => selected on every call
+						presets = await loop.run_in_executor(None, presets_lib.call_engine, eng_code, engine_cls, "zynapi_get_presets", bank)
+						presets = [[p['name'], p['fullpath']] for p in presets]
+					except Exception as e:
+						logging.warning("Preset index: can't list presets of {} => {}".format(fullpath, e))
+						continue
+					self.set_bank(eng_code, info['TITLE'], bank['name'], fullpath, mtime, presets)
+					n_listed += 1
+			self.remove_missing(listed_engines, keys)
+			self.last_refresh = time.monotonic()
+			logging.info("Preset index refreshed: {} banks listed, {} presets in {} banks".format(n_listed, len(self.docs), len(self.banks)))
+		except Exception as e:
+			logging.error("Can't refresh preset index => {}".format(e))
+		finally:
+			self.task = None
+
+	# --------------------------------------------------------------------------
+	# Search
+	# --------------------------------------------------------------------------
+
+	def match_word(self, qword):
+		"""doc id => score of the docs matching a query word: 3 for the word, 2 for a prefix, 0-1 if similar"""
+		scores = {}
+		if self.words is None:
+			self.words = sorted(self.postings)
+		i = bisect.bisect_left(self.words, qword)
+		while i < len(self.words) and self.words[i].startswith(qword):
+			word = self.words[i]
+			score = 3 if word == qword else 2
+			for doc_id in self.postings[word]:
+				if scores.get(doc_id, 0) < score:
+					scores[doc_id] = score
+			i += 1
+		if len(qword) < 3:
+			return scores
+		# Fuzzy: words sharing enough trigrams, checked by similarity ratio
+		trigrams = get_trigrams(qword)
+		shared = {}
+		for trigram in trigrams:
+			for word in self.trigrams.get(trigram, ()):
+				shared[word] = shared.get(word, 0) + 1
+		matcher = difflib.SequenceMatcher(None)
+		# seq2 is the one preprocessed => set once
+		matcher.set_seq2(qword)
+		min_shared = max(1, len(trigrams) // 3)
+		for word, n in shared.items():
+			if n < min_shared or word.startswith(qword):
+				continue
+			# Upper bound of the ratio from the lengths
+			if 2.0 * min(len(word), len(qword)) / (len(word) + len(qword)) < FUZZY_MIN_RATIO:
+				continue
+			matcher.set_seq1(word)
+			if matcher.quick_ratio() < FUZZY_MIN_RATIO:
+				continue
+			ratio = matcher.ratio()
+			if ratio < FUZZY_MIN_RATIO:
+				continue
+			for doc_id in self.postings[word]:
+				if scores.get(doc_id, 0) < ratio:
+					scores[doc_id] = ratio
+		return scores
+
+	def search(self, query, engine=None, limit=SEARCH_LIMIT):
+		"""Ranked presets matching every word of the query, as (total, [result dicts])"""
+		qwords = get_words(query)
+		if not qwords:
+			return 0, []
+		scores = None
+		for qword in qwords:
+			word_scores = self.match_word(qword)
+			if scores is None:
+				scores = word_scores
+			else:
+				scores = {doc_id: score + word_scores[doc_id] for doc_id, score in scores.items() if doc_id in word_scores}
+			if not scores:
+				return 0, []
+		query = " ".join(qwords)
+		ranked = []
+		for doc_id, score in scores.items():
+			key, name, fullpath, norm_name = self.docs[doc_id]
+			if engine and key[0] != engine:
+				continue
+			# Names starting with the query first
+			if norm_name.startswith(query):
+				score += 1
+			ranked.append((-score, len(name), norm_name, doc_id))
+		results = []
+		for score, length, norm_name, doc_id in heapq.nsmallest(limit, ranked):
+			key, name, fullpath, norm_name = self.docs[doc_id]
+			bank = self.banks[key]
+			results.append({
+				'engine': bank['engine'],
+				'title': bank['title'],
+				'bank': bank['name'],
+				'bank_fullpath': bank['bank'],
+				'name': name,
+				'fullpath': fullpath,
+				'score': round(-score, 2)
+			})
+		return len(ranked), results
+
+	def get_count(self):
+		return len(self.docs)
+
+	def is_stale(self):
+		return self.last_refresh is None or time.monotonic() - self.last_refresh > REFRESH_INTERVAL
+
+
+preset_search = PresetSearch()
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Preset Tree Cache
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import os
+import json
+import time
+import base64
+import logging
+
+# ------------------------------------------------------------------------------
+# Preset Tree Cache
+#
+# Listing the presets of every bank is slow for engines having thousands of
+# them (ZynAddSubFX, LV2 plugins, ...), so presets are cached per engine and
+# bank. Bank lists are cheap and are always listed again, but the presets of
+# a bank are only listed again when the bank is touched by a mutation, when
+# its file/directory mtime changes (i.e. saved from the UI) or, for banks that
+# aren't files or directories, after CACHE_TTL seconds.
+#
+# Every change of an engine's tree gets a new version number, so a client
+# holding the previous version only needs a delta: if the bank list changed
+# and the preset counts of the changed banks.
+#
+# Clients browse the tree lazily: pages of banks with their preset counts,
+# then pages of presets of a bank, optionally filtered by name. Pages are
+# continued with opaque cursors, which survive changes of the tree.
+# ------------------------------------------------------------------------------
+
+CACHE_TTL = 300
+
+BANKS_PAGE_SIZE = 200
+PRESETS_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def get_bank_mtime(bank):
+	try:
+		return os.stat(bank['fullpath']).st_mtime_ns
+	except (OSError, TypeError, ValueError):
+		return None
+
+
+def get_bank_node(bank):
+	"""Tree node of a bank (or bank header, without fullpath), without its presets"""
+	if bank['fullpath'] is None:
+		return {
+			'text': bank['text'],
+			'name': bank['name'],
+			'fullpath': None,
+			'readonly': False,
+			'node_type': "BANK_HEAD"
+		}
+	return {
+		'text': bank['text'],
+		'name': bank['name'],
+		'fullpath': bank['fullpath'],
+		'readonly': bank['readonly'],
+		'node_type': "BANK",
+		'icon': "glyphicon glyphicon-link" if bank['readonly'] else None
+	}
+
+
+def get_preset_nodes(engine_cls, bank):
+	nodes = []
+	for p in engine_cls.zynapi_get_presets(bank):
+		nodes.append({
+			'text': p['text'],
+			'name': p['name'],
+			'fullpath': p['fullpath'],
+			'readonly': p['readonly'] or bank['readonly'],
+			'bank_fullpath': bank['fullpath'],
+			'node_type': 'PRESET',
+			'icon': "glyphicon glyphicon-link" if p['readonly'] else None
+		})
+	return nodes
+
+
+def get_filter_words(query):
+	if query:
+		return query.lower().split()
+	return []
+
+
+def match_words(words, *texts):
+	"""True if every word is in some of the texts"""
+	text = " ".join(str(t) for t in texts).lower()
+	return all(word in text for word in words)
+
+
+def get_node_key(node):
+	return node['fullpath'] if node['fullpath'] is not None else "#" + node['text']
+
+
+def encode_cursor(offset, key):
+	return base64.urlsafe_b64encode(json.dumps([offset, key]).encode()).decode()
+
+
+def decode_cursor(cursor):
+	try:
+		offset, key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+		return int(offset), key
+	except Exception:
+		raise ValueError("Invalid cursor: {}".format(cursor))
+
+
+def get_page(nodes, cursor=None, limit=None):
+	"""
+	Page of nodes after cursor. The cursor holds the offset & the key of the
+	last node sent, so a page continues after that node even if the list
+	changed. Return (page, cursor of the next page or None).
+	"""
+	offset = 0
+	if cursor:
+		offset, key = decode_cursor(cursor)
+		if not (0 < offset <= len(nodes) and get_node_key(nodes[offset - 1]) == key):
+			for i, node in enumerate(nodes):
+				if get_node_key(node) == key:
+					offset = i + 1
+					break
+			else:
+				offset = min(max(offset, 0), len(nodes))
+	page = nodes[offset:offset + limit]
+	end = offset + len(page)
+	if end < len(nodes) and page:
+		return page, encode_cursor(end, get_node_key(page[-1]))
+	return page, None
+
+
+def get_limit(limit, default):
+	if limit is None or limit == "":
+		return default
+	return min(max(int(limit), 1), MAX_PAGE_SIZE)
+
+
+class PresetTreeCache:
+
+	def __init__(self):
+		# engine code => {'version', 'banks': bank nodes, 'bank_info': {bank fullpath: engine's bank},
+		#                 'presets': {bank fullpath: (bank node, mtime, listing time, preset nodes)}}
+		self.trees = {}
+		# Versions from a previous run must not match
+		self.last_version = int(time.time() * 1000)
+
+	def next_version(self):
+		self.last_version += 1
+		return self.last_version
+
+	@staticmethod
+	def is_valid(entry, bank_node, mtime):
+		"""True if a cached (bank node, mtime, listing time, presets) entry is still valid"""
+		bank_node0, mtime0, listed, nodes = entry
+		if listed is None or bank_node0 != bank_node or mtime0 != mtime:
+			return False
+		return mtime is not None or time.monotonic() - listed < CACHE_TTL
+
+	def update(self, eng_code, engine_cls, touched=()):
+		"""
+		Bring an engine's tree up to date, listing again the presets of the
+		touched banks (fullpaths) & the changed ones. Return the delta from the
+		previous version: {'from_version', 'version', 'banks_changed',
+		'counts': {bank fullpath: preset count, for the changed banks}}.
+		"""
+		try:
+			tree = self.trees[eng_code]
+		except KeyError:
+			tree = self.trees[eng_code] = {'version': self.next_version(), 'banks': None, 'bank_info': {}, 'presets': {}}
+		from_version = tree['version']
+		bank_nodes = []
+		changed_presets = {}
+		presets = {}
+		bank_info = {}
+		for bank in engine_cls.zynapi_get_banks():
+			bank_node = get_bank_node(bank)
+			bank_nodes.append(bank_node)
+			fpath = bank['fullpath']
+			if fpath is None:
+				continue
+			bank_info[fpath] = bank
+			entry = tree['presets'].get(fpath)
+			presets[fpath] = self.get_entry(engine_cls, bank, bank_node, entry, fpath in touched)
+			if entry is None or entry[3] != presets[fpath][3]:
+				changed_presets[fpath] = len(presets[fpath][3])
+		tree['presets'] = presets
+		tree['bank_info'] = bank_info
+		delta = {
+			'from_version': from_version,
+			'banks_changed': bank_nodes != tree['banks'],
+			'counts': changed_presets
+		}
+		tree['banks'] = bank_nodes
+		if delta['banks_changed'] or changed_presets:
+			tree['version'] = self.next_version()
+		delta['version'] = tree['version']
+		return delta
+
+	def get_entry(self, engine_cls, bank, bank_node, entry, touched=False):
+		"""Cache entry of a bank, listing its presets again if needed"""
+		mtime = get_bank_mtime(bank)
+		if entry and not touched and self.is_valid(entry, bank_node, mtime):
+			return entry
+		listed = time.monotonic()
+		try:
+			nodes = get_preset_nodes(engine_cls, bank)
+		except Exception as e:
+			logging.error("PRESETS OF BANK {} => {}".format(bank['fullpath'], e))
+			# Listed again next time
+			nodes = []
+			listed = None
+		return bank_node, mtime, listed, nodes
+
+	def update_bank(self, eng_code, engine_cls, fpath):
+		"""Bring a bank of an engine's tree up to date. Return False if the bank doesn't exist."""
+		tree = self.trees.get(eng_code)
+		if tree is None:
+			self.update(eng_code, engine_cls)
+			tree = self.trees[eng_code]
+		try:
+			entry = tree['presets'][fpath]
+		except KeyError:
+			return False
+		new_entry = self.get_entry(engine_cls, tree['bank_info'][fpath], entry[0], entry)
+		if new_entry is not entry:
+			tree['presets'][fpath] = new_entry
+			if new_entry[3] != entry[3]:
+				tree['version'] = self.next_version()
+		return True
+
+	def get_bank_page(self, eng_code, cursor=None, limit=None, query=None):
+		"""
+		Page of bank nodes (and headers), without their presets but with their
+		count ('count'), as {'version', 'banks', 'total', 'next_cursor'}. With
+		a query, only the banks having presets matching it, counting those.
+		"""
+		tree = self.trees[eng_code]
+		words = get_filter_words(query)
+		banks = []
+		head = None
+		for bank_node in tree['banks']:
+			if bank_node['node_type'] != "BANK":
+				# Headers only shown before their banks
+				head = bank_node
+				continue
+			presets = tree['presets'][bank_node['fullpath']][3]
+			if words:
+				count = sum(1 for p in presets if match_words(words, bank_node['name'], p['name']))
+				if count == 0:
+					continue
+			else:
+				count = len(presets)
+			if head is not None:
+				banks.append(head)
+				head = None
+			banks.append(dict(bank_node, count=count))
+		page, next_cursor = get_page(banks, cursor, get_limit(limit, BANKS_PAGE_SIZE))
+		return {
+			'version': tree['version'],
+			'banks': page,
+			'total': len(banks),
+			'next_cursor': next_cursor
+		}
+
+	def get_preset_page(self, eng_code, fpath, cursor=None, limit=None, query=None):
+		"""Page of preset nodes of a bank, as {'version', 'bank', 'presets', 'total', 'next_cursor'}"""
+		tree = self.trees[eng_code]
+		bank_node, mtime, listed, presets = tree['presets'][fpath]
+		words = get_filter_words(query)
+		if words:
+			presets = [p for p in presets if match_words(words, bank_node['name'], p['name'])]
+		page, next_cursor = get_page(presets, cursor, get_limit(limit, PRESETS_PAGE_SIZE))
+		return {
+			'version': tree['version'],
+			'bank': fpath,
+			'presets': page,
+			'total': len(presets),
+			'next_cursor': next_cursor
+		}
+
+
+preset_tree_cache = PresetTreeCache()
+
+# ------------------------------------------------------------------------------
@@ -28,6 +28,7 @@ import glob
 import shutil
 import logging
 import zipfile
+import threading
 import tarfile
 import requests
 import tornado.web
@@ -36,13 +37,43 @@ from zyngui.zynthian_gui_engine import *
 from zyngine.zynthian_chain_manager import zynthian_chain_manager
 
 from lib.upload_handler import TMP_DIR
-from lib.zynthian_config_handler import ZynthianBasicHandler
+from lib.preset_tree import preset_tree_cache
+from lib.preset_search import preset_search, SEARCH_LIMIT
+from lib.zynthian_config_handler import ZynthianBasicHandler, ZynthianAuthHandler
 
 # ------------------------------------------------------------------------------
 # Soundfont Configuration
 # ------------------------------------------------------------------------------
 
 
+def get_engine_info():
+	"""Enabled engines having a preset management API"""
+	engine_info = copy.copy(zynthian_chain_manager.get_engine_info())
+	for e in list(engine_info):
+		if not engine_info[e]['ENABLED'] or not hasattr(engine_info[e]['ENGINE'], "zynapi_get_banks"):
+			del engine_info[e]
+	return engine_info
+
+
+# Held while selecting an engine & calling its API, as the preset index lists
+# presets from a worker thread and LV2 plugins share the engine class.
+engine_lock = threading.RLock()
+
+
+def init_engine(eng_code, engine_cls):
+	"""LV2 plugins share the engine class => select the plugin before calling its API"""
+	if engine_cls == zynthian_engine_jalv:
+		engine_cls.init_zynapi_instance(eng_code)
+
+
+def call_engine(eng_code, engine_cls, method, *args):
+	"""Select an engine & call a method of its API, from any thread"""
+	with engine_lock:
+		init_engine(eng_code, engine_cls)
+		return getattr(engine_cls, method)(*args)
+
+
+
 class PresetsConfigHandler(ZynthianBasicHandler):
 
 	@tornado.web.authenticated
@@ -58,49 +89,95 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 
 	@tornado.web.authenticated
 	def post(self, action):
-		try:
-			self.eng_code = self.get_argument('ENGINE', 'ZY')
-			self.eng_info = self.get_engine_info()[self.eng_code]
-			self.engine_cls = self.eng_info['ENGINE']
-			if self.engine_cls == zynthian_engine_jalv:
-				self.engine_cls.init_zynapi_instance(self.eng_code)
-		except Exception as e:
-			logging.error("Can't initialize engine '{}': {}\n{}".format(self.eng_code, e, self.eng_info))
+		with engine_lock:
+			try:
+				self.eng_code = self.get_argument('ENGINE', 'ZY')
+				self.eng_info = self.get_engine_info()[self.eng_code]
+				self.engine_cls = self.eng_info['ENGINE']
+				init_engine(self.eng_code, self.engine_cls)
+			except Exception as e:
+				logging.error("Can't initialize engine '{}': {}\n{}".format(self.eng_code, e, self.eng_info))
 
-		try:
-			result = {
-				'get_tree': lambda: self.do_get_tree(),
-				'new_bank': lambda: self.do_new_bank(),
-				'remove_bank': lambda: self.do_remove_bank(),
-				'rename_bank': lambda: self.do_rename_bank(),
-				'remove_preset': lambda: self.do_remove_preset(),
-				'rename_preset': lambda: self.do_rename_preset(),
-				'download': lambda: self.do_download(),
-				'search': lambda: self.do_search(),
-				'install': lambda: self.do_install_url(),
-				'upload': lambda: self.do_install_file()
-			}[action]()
+			try:
+				result = {
+					'get_tree': lambda: self.do_get_tree(),
+					'get_banks': lambda: self.do_get_banks(),
+					'get_presets': lambda: self.do_get_presets(),
+					'new_bank': lambda: self.do_new_bank(),
+					'remove_bank': lambda: self.do_remove_bank(),
+					'rename_bank': lambda: self.do_rename_bank(),
+					'remove_preset': lambda: self.do_remove_preset(),
+					'rename_preset': lambda: self.do_rename_preset(),
+					'download': lambda: self.do_download(),
+					'search': lambda: self.do_search(),
+					'install': lambda: self.do_install_url(),
+					'upload': lambda: self.do_install_file()
+				}[action]()
 
-		except:
-			result = {}
-		# JSON Ouput
-		if result:
-			self.write(result)
+			except:
+				result = {}
+			# JSON Ouput
+			if result:
+				self.write(result)
 
 	def do_get_tree(self):
 		result = {}
 		try:
 			result['methods'] = self.engine_cls.get_zynapi_methods()
 			result['formats'] = self.get_upload_formats()
-			result['presets'] = self.get_presets_data()
+			result.update(self.do_get_banks())
 		except Exception as e:
 			result['methods'] = None
 			result['formats'] = None
+			logging.error(e)
+			result['errors'] = "Can't get preset tree data: {}".format(e)
+		return result
+
+	def do_get_banks(self):
+		"""Page of banks with their preset counts, the presets being loaded lazily with get_presets"""
+		result = {}
+		try:
+			preset_tree_cache.update(self.eng_code, self.engine_cls)
+			self.update_search_index()
+			result['banks'] = preset_tree_cache.get_bank_page(self.eng_code,
+				self.get_argument('CURSOR', None), self.get_argument('LIMIT', None), self.get_argument('FILTER', None))
+		except Exception as e:
+			result['banks'] = None
+			logging.error(e)
+			result['errors'] = "Can't get bank list: {}".format(e)
+		return result
+
+	def do_get_presets(self):
+		"""Page of presets of a bank (BANK_FULLPATH)"""
+		result = {}
+		bank_fullpath = self.get_argument('BANK_FULLPATH')
+		try:
+			if not preset_tree_cache.update_bank(self.eng_code, self.engine_cls, bank_fullpath):
+				raise ValueError("bank not found")
+			self.update_search_index()
+			result['presets'] = preset_tree_cache.get_preset_page(self.eng_code, bank_fullpath,
+				self.get_argument('CURSOR', None), self.get_argument('LIMIT', None), self.get_argument('FILTER', None))
+		except Exception as e:
 			result['presets'] = None
+			logging.error(e)
+			result['errors'] = "Can't get presets of bank {}: {}".format(bank_fullpath, e)
+		return result
+
+	def do_get_tree_delta(self, *touched):
+		"""Changes of the preset tree after a mutation, listing again the touched banks"""
+		result = {}
+		try:
+			result['tree_delta'] = preset_tree_cache.update(self.eng_code, self.engine_cls, touched)
+			self.update_search_index()
+		except Exception as e:
 			logging.error(e)
 			result['errors'] = "Can't get preset tree data: {}".format(e)
 		return result
 
+	def update_search_index(self):
+		"""Banks just listed are taken by the preset search index"""
+		preset_search.update_from_tree(self.eng_code, self.eng_info['TITLE'], preset_tree_cache.trees[self.eng_code])
+
 	def do_new_bank(self):
 		result = {}
 		try:
@@ -108,7 +185,7 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 		except Exception as e:
 			logging.error(e)
 			result['errors'] = "Can't create new bank: {}".format(e)
-		result.update(self.do_get_tree())
+		result.update(self.do_get_tree_delta())
 		return result
 
 	def do_rename_bank(self):
@@ -118,7 +195,7 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 		except Exception as e:
 			logging.error(e)
 			result['errors'] = "Can't rename bank: {}".format(e)
-		result.update(self.do_get_tree())
+		result.update(self.do_get_tree_delta(self.get_argument('SEL_FULLPATH')))
 		return result
 
 	def do_remove_bank(self):
@@ -128,7 +205,7 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 		except Exception as e:
 			logging.error(e)
 			result['errors'] = "Can't remove bank: {}".format(e)
-		result.update(self.do_get_tree())
+		result.update(self.do_get_tree_delta(self.get_argument('SEL_FULLPATH')))
 		return result
 
 	def do_rename_preset(self):
@@ -138,7 +215,7 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 		except Exception as e:
 			logging.error(e)
 			result['errors'] = "Can't rename preset: {}".format(e)
-		result.update(self.do_get_tree())
+		result.update(self.do_get_tree_delta(self.get_argument('SEL_BANK_FULLPATH')))
 		return result
 
 	def do_remove_preset(self):
@@ -148,7 +225,7 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 		except Exception as e:
 			logging.error(e)
 			result['errors'] = "Can't remove preset: {}".format(e)
-		result.update(self.do_get_tree())
+		result.update(self.do_get_tree_delta(self.get_argument('SEL_BANK_FULLPATH')))
 		return result
 
 	def do_download(self):
@@ -209,7 +286,7 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 		except Exception as e:
 			logging.error(e)
 			result['errors'] = "Can't install file: {}".format(e)
-		result.update(self.do_get_tree())
+		result.update(self.do_get_tree_delta(self.get_argument('SEL_BANK_FULLPATH', None)))
 		return result
 
 	def do_install_url(self):
@@ -219,7 +296,7 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 		except Exception as e:
 			logging.error(e)
 			result['errors'] = "Can't install URL: {}".format(e)
-		result.update(self.do_get_tree())
+		result.update(self.do_get_tree_delta(self.get_argument('SEL_BANK_FULLPATH', None)))
 		return result
 
 	def search_artifacts(self, formats, tags):
@@ -311,11 +388,7 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 			self.install_file(fpath)
 
 	def get_engine_info(self):
-		engine_info = copy.copy(zynthian_chain_manager.get_engine_info())
-		for e in list(engine_info):
-			if not engine_info[e]['ENABLED'] or not hasattr(engine_info[e]['ENGINE'], "zynapi_get_banks"):
-				del engine_info[e]
-		return engine_info
+		return get_engine_info()
 
 	def get_upload_formats(self):
 		try:
@@ -323,74 +396,27 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 		except:
 			return ""
 
-	def get_presets_data(self):
-		i = 0
-		superbanks_data = []
-		superbank_row = None
-		banks_data = []
-		try:
-			for b in self.engine_cls.zynapi_get_banks():
-				if b['fullpath'] is None:
-					if banks_data and superbank_row:
-						superbank_row['nodes'] = banks_data
-						superbanks_data.append(superbank_row)
-						banks_data = []
-					superbank_row = {
-						'id': i,
-						'text': b['text'],
-						'name': b['name'],
-						'fullpath': None,
-						'readonly': False,
-						'node_type': "BANK_HEAD",
-						'nodes': []
-					}
-					continue
-
-				brow = {
-					'id': i,
-					'text': b['text'],
-					'name': b['name'],
-					'fullpath': b['fullpath'],
-					'readonly': b['readonly'],
-					'node_type': "BANK",
-					'nodes': [],
-					'icon': "glyphicon glyphicon-link" if b['readonly'] else None
-				}
-				i += 1
-				try:
-					presets_data = []
-					for p in self.engine_cls.zynapi_get_presets(b):
-						prow = {
-							'id': i,
-							'text': p['text'],
-							'name': p['name'],
-							'fullpath': p['fullpath'],
-							'readonly': p['readonly'] or b['readonly'],
-							'bank_fullpath': b['fullpath'],
-							'node_type': 'PRESET',
-							'icon': "glyphicon glyphicon-link" if p['readonly'] else None
-						}
-						i += 1
-						presets_data.append(prow)
-
-					brow['nodes'] = presets_data
-
-				except Exception as e:
-					logging.error("PRESET NODE {} => {}".format(i, e))
-
-				banks_data.append(brow)
-
-			if banks_data:
-				if superbank_row:
-					superbank_row['nodes'] = banks_data
-					superbanks_data.append(superbank_row)
-				else:
-					superbanks_data = banks_data
 
 
-		except Exception as e:
-			logging.error("BANK NODE {} => {}".format(i, e))
+class PresetSearchHandler(ZynthianAuthHandler):
+	"""
+	Presets of every engine matching a query (GET /lib-presets/find?q=...),
+	ranked, optionally restricted to an engine & limited in number.
+	"""
 
-		return superbanks_data
+	@tornado.web.authenticated
+	def get(self):
+		preset_search.start()
+		if preset_search.is_stale():
+			# Results from the current index meanwhile
+			preset_search.refresh()
+		limit = min(max(int(self.get_argument('limit', SEARCH_LIMIT)), 1), 500)
+		total, results = preset_search.search(self.get_argument('q', ""), self.get_argument('engine', None), limit)
+		self.write({
+			'results': results,
+			'total': total,
+			'indexed': preset_search.get_count(),
+			'refreshing': preset_search.task is not None
+		})
 
 # ------------------------------------------------------------------------------
@@ -27,12 +27,10 @@ import re
 import logging
 import tornado.web
 from collections import OrderedDict
-from subprocess import check_output, call
 
+from lib.async_subprocess import check_output
+from lib.git_info import git_info
 from lib.zynthian_config_handler import ZynthianConfigHandler
-from lib.audio_config_handler import AudioConfigHandler
-from lib.display_config_handler import DisplayConfigHandler
-from lib.wiring_config_handler import WiringConfigHandler
 
 
 # ------------------------------------------------------------------------------
@@ -54,11 +52,11 @@ class RepositoryHandler(ZynthianConfigHandler):
 	]
 
 	@tornado.web.authenticated
-	def get(self, errors=None):
-		super().get("Repositories", self.get_config_info(), errors)
+	async def get(self, errors=None):
+		super().get("Repositories", await self.get_config_info(), errors)
 
 	@tornado.web.authenticated
-	def post(self):
+	async def post(self):
 		postedConfig = tornado.escape.recursive_unicode(self.request.arguments)
 		logging.info(postedConfig)
 		try:
@@ -77,13 +75,13 @@ class RepositoryHandler(ZynthianConfigHandler):
 			else:
 				branch = version
 			try:
-				if branch and self.set_repo_branch(repitem[0], branch):
+				if branch and await self.set_repo_branch(repitem[0], branch):
 					changed_repos += 1
 			except Exception as err:
 				logging.error(err)
 				errors[posted_key] = err
 
-		config = self.get_config_info(version)
+		config = await self.get_config_info(version)
 		if changed_repos > 0:
 			config['ZYNTHIAN_MESSAGE'] = {
 				'type': 'html',
@@ -93,12 +91,12 @@ class RepositoryHandler(ZynthianConfigHandler):
 
 		super().get("Repositories", config, errors)
 
-	def get_config_info(self, version=None):
+	async def get_config_info(self, version=None):
 		stable_overall = True
 		testing_overall = True
 		repo_branches = []
 		for repitem in self.repository_list:
-			branch = self.get_repo_current_branch(repitem[0])
+			branch = await self.get_repo_current_branch(repitem[0])
 			stable_overall &= (branch == self.stable_branch)
 			testing_overall &= (branch == self.testing_branch)
 			repo_branches.append(branch)
@@ -123,7 +121,7 @@ class RepositoryHandler(ZynthianConfigHandler):
 		}
 		if version == "custom":
 			for i, repitem in enumerate(self.repository_list):
-				options = self.get_repo_branch_list(repitem[0])
+				options = await self.get_repo_branch_list(repitem[0])
 				config[f"ZYNTHIAN_REPO_{repitem[0]}"] = {
 					'type': 'select',
 					'title': repitem[0],
@@ -138,23 +136,23 @@ class RepositoryHandler(ZynthianConfigHandler):
 		}
 		return config
 
-	def get_repo_tag_list(self, repo_name):
+	async def get_repo_tag_list(self, repo_name):
 		result = ["master"]
 		repo_dir = self.zynthian_base_dir + "/" + repo_name
 
-		check_output("cd {}; git remote update origin --prune".format(repo_dir), shell=True)
-		for byteLine in check_output("cd {}; git tag".format(repo_dir), shell=True).splitlines():
-			result.append(byteLine.decode("utf-8").strip())
+		await check_output(["git", "remote", "update", "origin", "--prune"], cwd=repo_dir, timeout=60)
+		for line in (await check_output(["git", "tag"], cwd=repo_dir)).splitlines():
+			result.append(line.strip())
 
 		return result
 
-	def get_repo_branch_list(self, repo_name):
+	async def get_repo_branch_list(self, repo_name):
 		result = ["master"]
 		repo_dir = self.zynthian_base_dir + "/" + repo_name
 
-		check_output("cd {}; git remote update origin --prune".format(repo_dir), shell=True)
-		for byteLine in check_output("cd {}; git branch -a".format(repo_dir), shell=True).splitlines():
-			bname = byteLine.decode("utf-8").strip()
+		await check_output(["git", "remote", "update", "origin", "--prune"], cwd=repo_dir, timeout=60)
+		for line in (await check_output(["git", "branch", "-a"], cwd=repo_dir)).splitlines():
+			bname = line.strip()
 			if bname.startswith("*"):
 				bname = bname[2:]
 			if bname.startswith("remotes/origin/"):
@@ -166,37 +164,32 @@ class RepositoryHandler(ZynthianConfigHandler):
 
 		return result
 
-	def get_repo_current_branch(self, repo_name):
+	async def get_repo_current_branch(self, repo_name):
 		repo_dir = self.zynthian_base_dir + "/" + repo_name
+		return git_info.get_branch(repo_dir)
 
-		for byteLine in check_output("cd {}; git branch | grep \* | cut -d ' ' -f2".format(repo_dir),
-									 shell=True).splitlines():
-			return byteLine.decode("utf-8")
-
-	def set_repo_tag(self, repo_name, tag_name):
+	async def set_repo_tag(self, repo_name, tag_name):
 		logging.info("Changing repository '{}' to tag '{}'".format(repo_name, tag_name))
 
 		repo_dir = self.zynthian_base_dir + "/" + repo_name
-		current_branch = self.get_repo_current_branch(repo_name)
+		current_branch = await self.get_repo_current_branch(repo_name)
 
 		if tag_name != current_branch:
 			logging.info("... needs change: '{}' != '{}'".format(current_branch, tag_name))
 			if tag_name == 'master':
-				check_output("cd {}; git checkout .; git checkout {}".format(repo_dir, tag_name), shell=True)
+				await check_output("git checkout .; git checkout {}".format(tag_name), cwd=repo_dir)
 			else:
-				check_output(
-					"cd {}; git checkout .; git branch -d {}; git checkout tags/{} -b {}".format(repo_dir, tag_name,
-																								 tag_name, tag_name),
-					shell=True)
+				await check_output("git checkout .; git branch -d {}; git checkout tags/{} -b {}".format(tag_name, tag_name, tag_name),
+					cwd=repo_dir)
 			return True
 
-	def set_repo_branch(self, repo_name, branch_name):
+	async def set_repo_branch(self, repo_name, branch_name):
 		logging.info("Changing repository '{}' to branch '{}'".format(repo_name, branch_name))
 
 		repo_dir = self.zynthian_base_dir + "/" + repo_name
-		current_branch = self.get_repo_current_branch(repo_name)
+		current_branch = await self.get_repo_current_branch(repo_name)
 
 		if branch_name != current_branch:
 			logging.info("... needs change: '{}' != '{}'".format(current_branch, branch_name))
-			check_output("cd {}; git checkout .; git checkout {}".format(repo_dir, branch_name), shell=True)
+			await check_output("git checkout .; git checkout {}".format(branch_name), cwd=repo_dir)
 			return True
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Systemd Service Status Cache
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import time
+import logging
+import threading
+import tornado.locks
+import tornado.ioloop
+from subprocess import check_output
+
+from lib.metrics import metrics
+from lib.async_subprocess import run_exec
+
+# ------------------------------------------------------------------------------
+# Service Status Cache
+# ------------------------------------------------------------------------------
+
+
+class ServiceStatusCache:
+	"""
+	Active state of the systemd units webconf cares about, refreshed for all
+	units at once with a single "systemctl show" call when the TTL expires.
+	Units asked for that are not in the list are added to it.
+	Once started, refreshes run on the IOLoop without blocking it, and the
+	cached states are served meanwhile. After invalidate() (a service was
+	started/stopped), wait_fresh() waits for a refresh run after it.
+	"""
+
+	default_units = [
+		"zynthian",
+		"mod-ui",
+		"novnc0",
+		"novnc1",
+		"jacknetumpd",
+		"jackrtpmidid",
+		"qmidinet",
+		"touchosc2midi"
+	]
+
+	def __init__(self, ttl=2.0):
+		self.ttl = ttl
+		self.lock = threading.Lock()
+		self.units = list(self.default_units)
+		self.states = {}
+		self.ts = 0
+		self.io_loop = None
+		self.refreshing = False
+		# Increased by invalidate(). The states are fresh if they come from a
+		# refresh started with the current generation (None => not refreshed yet).
+		self.generation = 0
+		self.states_generation = None
+		# Notified on the IOLoop when a refresh ends
+		self.refreshed = tornado.locks.Condition()
+
+	def start(self):
+		self.io_loop = tornado.ioloop.IOLoop.current()
+		self.refreshing = True
+		self.io_loop.add_callback(self.async_refresh)
+
+	@staticmethod
+	def get_cmd(units):
+		return ["systemctl", "show", "--property=ActiveState"] + units
+
+	def set_states(self, units, out, generation):
+		# One "ActiveState=..." block per unit, in the same order as requested
+		states = [line[12:] for line in out.splitlines() if line.startswith("ActiveState=")]
+		if len(states) == len(units):
+			self.states = dict(zip(units, states))
+		else:
+			self.states = {}
+		self.ts = time.monotonic()
+		self.states_generation = generation
+
+	def refresh(self):
+		"""Blocking refresh, used until started"""
+		generation = self.generation
+		try:
+			with metrics.timed("subprocess"):
+				out = check_output(self.get_cmd(self.units)).decode('utf-8', 'ignore')
+		except Exception as e:
+			logging.error("Can't get service status: {}".format(e))
+			out = ""
+		self.set_states(self.units, out, generation)
+
+	async def async_refresh(self):
+		try:
+			with self.lock:
+				units = list(self.units)
+				generation = self.generation
+			try:
+				out = (await run_exec(self.get_cmd(units), timeout=10)).decode('utf-8', 'ignore')
+			except Exception as e:
+				logging.error("Can't get service status: {}".format(e))
+				out = ""
+			with self.lock:
+				self.set_states(units, out, generation)
+				# Units added meanwhile => refresh again on next request
+				if len(self.units) != len(units):
+					self.ts = 0
+		finally:
+			self.refreshing = False
+			self.refreshed.notify_all()
+
+	def get_state(self, unit):
+		with self.lock:
+			if unit not in self.units:
+				self.units.append(unit)
+				self.ts = 0
+			if time.monotonic() - self.ts > self.ttl:
+				if self.io_loop is None:
+					self.refresh()
+				elif not self.refreshing:
+					# Thread safe => probes running in worker threads can trigger it
+					self.refreshing = True
+					self.io_loop.add_callback(self.async_refresh)
+			return self.states.get(unit, "unknown")
+
+	def is_active(self, unit):
+		return self.get_state(unit) == "active"
+
+	def invalidate(self):
+		with self.lock:
+			self.ts = 0
+			self.generation += 1
+
+	async def wait_fresh(self):
+		"""Wait for the states to be refreshed after the last invalidate(). Returns at once if they are."""
+		while self.io_loop is not None and self.states_generation != self.generation:
+			with self.lock:
+				refreshing = self.refreshing
+				self.refreshing = True
+			if refreshing:
+				# It may have started before invalidate() => checked again when it ends
+				await self.refreshed.wait()
+			else:
+				await self.async_refresh()
+
+
+service_status = ServiceStatusCache()
+
+# ------------------------------------------------------------------------------
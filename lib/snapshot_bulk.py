@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Bulk Snapshot Reorganisation
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import os
+import shutil
+import logging
+
+# ------------------------------------------------------------------------------
+# Bulk Snapshot Reorganisation
+#
+# A batch of operations on snapshots & banks is validated as a whole, so bank
+# and program collisions are detected before touching anything, and then
+# applied in 2 phases: every source is renamed to a staging name and then to
+# its target. If a rename fails, the done ones are reverted. Deletions are
+# only done at the end, once all the renames have succeeded.
+#
+# Operations, as dicts with the snapshot/bank "path" they apply to:
+#   {"op": "move", "path": snapshot, "bank": bank directory name, "" for root}
+#   {"op": "renumber", "path": snapshot or bank, "num": program/bank number}
+#   {"op": "rename", "path": snapshot or bank, "name": new name}
+#   {"op": "delete", "path": snapshot or bank}
+# Several operations can apply to the same path. Bank directory names refer
+# to the banks before the batch is applied.
+# ------------------------------------------------------------------------------
+
+
+class BulkError(Exception):
+	pass
+
+
+def split_name(name):
+	"""(number, name) from a bank directory name or a snapshot file name without extension"""
+	parts = name.split("-", 1)
+	if len(parts) == 2:
+		return parts[0], parts[1]
+	return parts[0], ""
+
+
+def check_name(name):
+	"""Bank directory or snapshot name, which must stay in its parent directory"""
+	name = str(name)
+	if os.sep in name or ".." in name or name.startswith("."):
+		raise BulkError("Invalid name: {}".format(name))
+	return name
+
+
+def join_name(num, name):
+	if num and name:
+		return num + "-" + name
+	return num or name
+
+
+class SnapshotBulkPlan:
+
+	def __init__(self, root, ops):
+		self.root = root
+		# src => dest, for files and banks
+		self.file_moves = {}
+		self.bank_moves = {}
+		self.deletes = []
+		self.errors = []
+		self.build(ops)
+		if not self.errors:
+			self.check()
+
+	def error(self, msg):
+		self.errors.append(msg)
+
+	def get_path(self, op):
+		path = os.path.normpath(str(op.get('path', "")))
+		if not path.startswith(self.root + os.sep) or not os.path.exists(path):
+			raise BulkError("Not found: {}".format(path))
+		return path
+
+	def build(self, ops):
+		# path => [bank dirname or None for banks, num, name]
+		targets = {}
+		for op in ops:
+			try:
+				path = self.get_path(op)
+				is_bank = os.path.isdir(path)
+				if path not in targets:
+					if is_bank:
+						if os.path.dirname(path) != self.root:
+							raise BulkError("Not a bank: {}".format(path))
+						targets[path] = [None] + list(split_name(os.path.basename(path)))
+					else:
+						if not path.endswith(".zss"):
+							raise BulkError("Not a snapshot: {}".format(path))
+						bank_dname = os.path.relpath(os.path.dirname(path), self.root)
+						targets[path] = [bank_dname if bank_dname != "." else ""] + list(split_name(os.path.basename(path)[:-4]))
+				target = targets[path]
+				action = op.get('op')
+				if action == "delete":
+					if path not in self.deletes:
+						self.deletes.append(path)
+				elif action == "move":
+					if is_bank:
+						raise BulkError("Banks can't be moved: {}".format(path))
+					target[0] = check_name(op['bank'])
+				elif action == "renumber":
+					num = int(op['num'])
+					if not 0 <= num <= 127:
+						raise BulkError("Number out of range: {}".format(num))
+					target[1] = str(num).zfill(3)
+				elif action == "rename":
+					target[2] = check_name(op['name'])
+				else:
+					raise BulkError("Unknown operation: {}".format(action))
+			except (KeyError, ValueError) as e:
+				self.error("Invalid operation {}: {}".format(op, e))
+			except BulkError as e:
+				self.error(str(e))
+		for path, (bank_dname, num, name) in targets.items():
+			if path in self.deletes:
+				continue
+			fname = join_name(num, name)
+			if not fname:
+				self.error("Empty name: {}".format(path))
+				continue
+			if bank_dname is None:
+				dest = os.path.join(self.root, fname)
+			else:
+				dest = os.path.join(self.root, bank_dname, fname + ".zss")
+			if not os.path.normpath(dest).startswith(self.root + os.sep):
+				self.error("Invalid target: {}".format(dest))
+				continue
+			if dest == path:
+				continue
+			if bank_dname is None:
+				self.bank_moves[path] = dest
+			else:
+				self.file_moves[path] = dest
+
+	def check(self):
+		"""Detect collisions between the targets and with the existing files"""
+		deleted = set(self.deletes)
+		for path in self.deletes:
+			if os.path.isdir(path):
+				prefix = path + os.sep
+				for src, dest in self.file_moves.items():
+					if dest.startswith(prefix):
+						self.error("Target bank is deleted: {}".format(dest))
+		# Final content of the changed directories: path => (number, is moved)
+		moved_away = deleted | set(self.file_moves) | set(self.bank_moves)
+		final = {}
+		for src, dest in list(self.file_moves.items()) + list(self.bank_moves.items()):
+			dname = os.path.dirname(dest)
+			if dname not in final:
+				if not os.path.isdir(dname):
+					self.error("Bank doesn't exist: {}".format(dname))
+					continue
+				final[dname] = {}
+				for fname in os.listdir(dname):
+					fpath = os.path.join(dname, fname)
+					if fpath in moved_away or not (fname.endswith(".zss") or os.path.isdir(fpath)):
+						continue
+					final[dname][fpath] = (split_name(fname[:-4] if fname.endswith(".zss") else fname)[0], False)
+			if dest in final[dname]:
+				self.error("Target already exists: {}".format(dest))
+				continue
+			final[dname][dest] = (split_name(os.path.basename(dest)[:-4] if dest.endswith(".zss") else os.path.basename(dest))[0], True)
+		# Moved snapshots & banks can't share their number with another one
+		for dname, content in final.items():
+			nums = {}
+			for path, (num, moved) in content.items():
+				try:
+					nums.setdefault(int(num), []).append((path, moved))
+				except ValueError:
+					pass
+			for num, items in nums.items():
+				if len(items) > 1 and any(moved for path, moved in items):
+					self.error("Number {} used more than once in {}: {}".format(str(num).zfill(3), dname, ", ".join(sorted(os.path.basename(path) for path, moved in items))))
+
+	def get_final_path(self, path):
+		"""Path after the banks are renamed"""
+		for src, dest in self.bank_moves.items():
+			if path.startswith(src + os.sep):
+				return dest + path[len(src):]
+		return path
+
+	def get_staging_path(self, path, i):
+		dname, fname = os.path.split(path)
+		return os.path.join(dname, ".{}.bulk-{}-{}".format(fname, os.getpid(), i))
+
+	def apply(self):
+		"""Apply the plan. Return the changed paths (removed, added). Raise OSError after rolling back."""
+		done = []
+		try:
+			# Files are moved before renaming banks, as their targets use the current bank names
+			deletes = {self.get_final_path(path): None for path in self.deletes}
+			for moves in (self.file_moves, self.bank_moves, deletes):
+				staged = []
+				for i, (src, dest) in enumerate(moves.items()):
+					tmp = self.get_staging_path(src, i)
+					os.rename(src, tmp)
+					done.append((src, tmp))
+					staged.append((tmp, dest))
+				for tmp, dest in staged:
+					if dest is None:
+						continue
+					if os.path.exists(dest):
+						raise FileExistsError("Target already exists: {}".format(dest))
+					os.rename(tmp, dest)
+					done.append((tmp, dest))
+		except OSError:
+			for src, dest in reversed(done):
+				try:
+					os.rename(dest, src)
+				except OSError as e:
+					logging.error("Can't roll back '{}' => {}".format(dest, e))
+			raise
+		# All done => remove the staged deletions
+		for i, path in enumerate(self.deletes):
+			tmp = self.get_staging_path(self.get_final_path(path), i)
+			try:
+				if os.path.isdir(tmp):
+					shutil.rmtree(tmp)
+				else:
+					os.remove(tmp)
+			except OSError as e:
+				logging.error("Can't remove '{}' => {}".format(tmp, e))
+		added = [self.get_final_path(dest) for dest in self.file_moves.values()]
+		added += list(self.bank_moves.values())
+		removed = list(self.file_moves) + list(self.bank_moves) + self.deletes
+		return removed, added
+
+# ------------------------------------------------------------------------------
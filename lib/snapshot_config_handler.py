@@ -23,7 +23,6 @@
 # ********************************************************************
 
 import os
-import re
 import json
 import base64
 import shutil
@@ -31,9 +30,126 @@ import base64
 import logging
 import tornado.web
 from collections import OrderedDict
+from tornado.iostream import StreamClosedError
 
-from lib.zynthian_config_handler import ZynthianBasicHandler
-from zyngine.zynthian_legacy_snapshot import zynthian_legacy_snapshot
+from lib.zynthian_config_handler import ZynthianBasicHandler, ZynthianAuthHandler
+from lib.snapshot_index import snapshot_index
+from lib.snapshot_search import snapshot_search
+from lib.snapshot_bulk import SnapshotBulkPlan
+from lib.stream_download import send_file, send_zip
+from lib.snapshot_edit import edit_snapshot, get_etag, get_midi_profile_values, escape_pointer_token, EditConflict
+
+# ------------------------------------------------------------------------------
+# Snapshot Tree
+#
+# Tree nodes are built from the snapshot catalogue listings. Banks are sent
+# with their program count and an empty node list, and their programs are
+# loaded when expanded. Snapshot content (prog_details) is loaded on selection.
+# ------------------------------------------------------------------------------
+
+
+def decode_path(path_b64):
+	"""Normalised path from a base64 URL argument. HTTP 400 if it can't be decoded."""
+	try:
+		return os.path.normpath(str(base64.b64decode(path_b64, validate=True), 'utf-8'))
+	except ValueError:
+		# Also binascii.Error & UnicodeDecodeError
+		raise tornado.web.HTTPError(400, "Invalid path: {}".format(path_b64))
+
+
+def get_int_argument(handler, name, default):
+	"""Non-negative integer query argument. HTTP 400 if it isn't one."""
+	try:
+		value = int(handler.get_argument(name, default))
+	except ValueError:
+		value = -1
+	if value < 0:
+		raise tornado.web.HTTPError(400, "Invalid {}: {}".format(name, handler.get_argument(name)))
+	return value
+
+
+def get_tree_nodes(directory, idx=0, _bank_num=None, _bank_name=None, expand=None, paths=None):
+	"""
+	Tree nodes for a snapshot directory. Subdirectories (banks) only get their
+	nodes if they are the expand directory. If a set of snapshot paths is
+	given, only those snapshots and the banks holding them are included, with
+	their nodes. Node ids follow the treeview order.
+	"""
+	snapshots = []
+	listing = snapshot_index.get_listing(directory)
+	if listing is None:
+		return snapshots
+	dnames = set(listing['dirs'])
+	for f in sorted(listing['dirs'] + listing['files']):
+		fullpath = os.path.join(directory, f)
+		if paths is not None:
+			if f in dnames:
+				prefix = fullpath + os.sep
+				if not any(path.startswith(prefix) for path in paths):
+					continue
+				expand = fullpath
+			elif fullpath not in paths:
+				continue
+		state = {}
+		if f in dnames:
+			node_type = "BANK"
+			parts = f.split("-", 1)
+			if f[0] == ".":
+				state["expanded"] = False
+			bank_num = parts[0]
+			if len(parts) == 2:
+				bank_name = parts[1]
+			else:
+				bank_name = ""
+			prog_name = ""
+			prog_num = ""
+			name = bank_name
+		else:
+			node_type = "SNAPSHOT"
+			fname = f[:-4]
+			if _bank_num is not None:
+				bank_num = _bank_num.zfill(3)
+				bank_name = _bank_name
+				parts = fname.split("-", 1)
+				prog_num = parts[0]
+				if len(parts) == 2:
+					prog_name = fname[len(prog_num)+1:]
+				else:
+					prog_name = ""
+			else:
+				bank_num = ''
+				bank_name = ''
+				prog_num = ''
+				prog_name = fname
+			name = prog_name
+
+		snapshot = {
+			'id': idx,
+			'text': f,
+			'name': name,
+			'state': state,
+			'fullpath': fullpath,
+			'node_type': node_type,
+			'bank_num': bank_num,
+			'bank_name': bank_name,
+			'prog_num': prog_num,
+			'prog_name': prog_name
+		}
+
+		idx += 1
+		if node_type == "BANK":
+			bank_listing = snapshot_index.get_listing(fullpath)
+			snapshot['tags'] = [str(len(bank_listing['files']) if bank_listing else 0)]
+			if fullpath == expand:
+				snapshot['nodes'] = get_tree_nodes(fullpath, idx, bank_num, bank_name, paths=paths)
+				snapshot['loaded'] = True
+				idx += len(snapshot['nodes'])
+			else:
+				snapshot['nodes'] = []
+
+		snapshots.append(snapshot)
+
+	return snapshots
 
 # ------------------------------------------------------------------------------
 # Snapshot Config Handler
@@ -51,7 +167,7 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 	def get(self, errors=None):
 		config=OrderedDict([])
 
-		ssdata = self.get_snapshots_data()
+		ssdata = self.get_snapshots_data(self.get_selected_bank())
 		#logging.debug(snapshot)
 
 		config['SNAPSHOTS'] = json.dumps(ssdata)
@@ -78,7 +194,7 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 				'save_as_last_state': lambda: self.do_save_as_last_state()
 			}[action]()
 
-		ssdata = self.get_snapshots_data()
+		ssdata = self.get_snapshots_data(self.get_selected_bank())
 		result['SNAPSHOTS'] = ssdata
 		result['SEL_NODE_ID'] = self.get_selected_node_id(ssdata)
 		result['BANKS'] = self.get_existing_banks(ssdata, True)
@@ -91,7 +207,7 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 
 	def do_new_bank(self):
 		result = {}
-		existing_banks = self.get_existing_banks(self.get_snapshots_data(), False)
+		existing_banks = self.get_existing_bank_nums()
 		new_bank_dname = self.get_argument('NEW_BANK_NUM', str(self.calculate_next_bank(existing_banks))).zfill(3)
 		if new_bank_dname in existing_banks:
 			result['errors'] = "Bank already exists!"
@@ -204,16 +320,27 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 		#logging.info("existingbanks: " + str(existing_banks))
 		return sorted(existing_banks)
 
+	def get_existing_bank_nums(self):
+		# Same as get_existing_banks(..., False), from the directory listing only
+		existing_banks = []
+		with os.scandir(self.SNAPSHOTS_DIRECTORY) as it:
+			for entry in it:
+				if entry.is_dir():
+					existing_banks.append(entry.name.split("-", 1)[0].zfill(3))
+		return sorted(existing_banks)
+
 	def get_snapshot_warning(self, snapshot_data):
 		duplicate_prog_nums = ''
 		for item in snapshot_data:
 			if 'nodes' in item:
 				bank_num = item['bank_num']
 				prev_prog_num = ''
-				for node_item in item['nodes']:
-					if prev_prog_num == node_item['prog_num']:
+				# Programs are not loaded for every bank => check the listings
+				for fname in snapshot_index.get_listing(item['fullpath'])['files']:
+					prog_num = fname[:-4].split("-", 1)[0]
+					if prev_prog_num == prog_num:
 						duplicate_prog_nums += "{}/{} ".format(bank_num, prev_prog_num)
-					prev_prog_num = node_item['prog_num']
+					prev_prog_num = prog_num
 		if duplicate_prog_nums:
 			return "Duplicate program numbers exist. Please rearrange your snapshots: {}".format(duplicate_prog_nums)
 		else:
@@ -225,81 +352,24 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 				return i
 		return ''
 
-	def get_snapshots_data(self):
-		return self.walk_directory(SnapshotConfigHandler.SNAPSHOTS_DIRECTORY)
-
-	def walk_directory(self, directory, idx=0, _bank_num=None, _bank_name=None):
-		snapshots = []
-		file_list = sorted(os.listdir(directory))
-		for f in file_list:
-			fullpath = os.path.join(directory, f)
-			state = {}
-			if os.path.isdir(fullpath):
-				node_type = "BANK"
-				parts = f.split("-", 1)
-				if f[0] == ".":
-					state["expanded"] = False
-				bank_num = parts[0]
-				if len(parts) == 2:
-					bank_name = parts[1]
-				else:
-					bank_name = ""
-				prog_name = ""
-				prog_num = ""
-				prog_details = ""
-				name = bank_name
-			else:
-				fname = f[:-4]
-				fext = f[-4:]
-				if fext == ".zss":
-					node_type = "SNAPSHOT"
-					if _bank_num is not None:
-						bank_num = _bank_num.zfill(3)
-						bank_name = _bank_name
-						parts = fname.split("-", 1)
-						prog_num = parts[0]
-						if len(parts) == 2:
-							prog_name = fname[len(prog_num)+1:]
-						else:
-							prog_name = ""
-					else:
-						bank_num = ''
-						bank_name = ''
-						prog_num = ''
-						prog_name = fname
-					name = prog_name
-
-					with open(fullpath) as ssfile:
-						try:
-							prog_details = zynthian_legacy_snapshot().convert_state(json.load(ssfile))
-						except:
-							pass
-						ssfile.close()
-				else:
-					continue
-
-			snapshot = {
-				'id': idx,
-				'text': f,
-				'name': name,
-				'state': state,
-				'fullpath': fullpath,
-				'node_type': node_type,
-				'bank_num': bank_num,
-				'bank_name': bank_name,
-				'prog_num': prog_num,
-				'prog_name': prog_name,
-				'prog_details': prog_details
-			}
-			
-			idx += 1
-			if os.path.isdir(fullpath):
-				snapshot['nodes'] = self.walk_directory(fullpath, idx, bank_num, bank_name)
-				idx+=len(snapshot['nodes'])
-
-			snapshots.append(snapshot)
+	def get_snapshots_data(self, sel_bank=None):
+		"""Banks (with their program count) & root snapshots. Programs are only included for the sel_bank directory."""
+		snapshot_index.start()
+		return get_tree_nodes(SnapshotConfigHandler.SNAPSHOTS_DIRECTORY, expand=sel_bank)
 
-		return snapshots
+	def get_selected_bank(self):
+		"""Directory of the bank holding the selected node after a POST action"""
+		bank_dname = self.get_argument('SEL_BANK', None)
+		if bank_dname:
+			return os.path.join(self.SNAPSHOTS_DIRECTORY, bank_dname)
+		try:
+			bank_num = int(self.get_argument('SEL_BANK_NUM'))
+			for bank_dname in snapshot_index.get_listing(self.SNAPSHOTS_DIRECTORY)['dirs']:
+				if int(bank_dname.split("-", 1)[0]) == bank_num:
+					return os.path.join(self.SNAPSHOTS_DIRECTORY, bank_dname)
+		except:
+			pass
+		return None
 
 	def get_selected_node_id(self, ssdata):
 		selected_node = 0
@@ -337,155 +407,197 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 		shutil.move(fpath, destination)
 
 
-class SnapshotRemoveChainHandler(tornado.web.RequestHandler):
-
-	def get_current_user(self):
-		return self.get_secure_cookie("user")
+class SnapshotTreeHandler(ZynthianAuthHandler):
+	"""
+	Lazy snapshot tree: GET /lib-snapshot/tree returns the banks & root
+	snapshots, GET /lib-snapshot/tree/<base64 bank path> the programs of a
+	bank. Both accept offset & limit arguments. Unchanged lists get a 304.
+	"""
 
 	@tornado.web.authenticated
-	def post(self, snapshot_file_b64, chain):
-		result = {}
-		snapshot_file = str(base64.b64decode(snapshot_file_b64), 'utf-8')
-		try:
-			logging.info("Removing chain {} in {}".format(chain, snapshot_file))
-			data = []
-			with open(snapshot_file, "r") as fp:
-				data = json.load(fp)
-				del data['chains'][chain]
-
-			with open(snapshot_file, "w") as fp:
-				json.dump(data, fp)
-
-			result = data
-
-		except Exception as err:
-			result['errors'] = str(err)
-			logging.error(err)
-
-		# JSON Ouput
-		if result:
-			self.write(result)
+	def get(self, dpath_b64=None):
+		root = SnapshotConfigHandler.SNAPSHOTS_DIRECTORY
+		snapshot_index.start()
+		if dpath_b64:
+			dpath = decode_path(dpath_b64)
+			if not dpath.startswith(root + os.sep) or snapshot_index.get_listing(dpath) is None:
+				raise tornado.web.HTTPError(404)
+			parts = os.path.basename(dpath).split("-", 1)
+			nodes = get_tree_nodes(dpath, 0, parts[0], parts[1] if len(parts) == 2 else "")
+		else:
+			nodes = get_tree_nodes(root)
+		offset = get_int_argument(self, 'offset', 0)
+		limit = get_int_argument(self, 'limit', len(nodes))
+		# Tornado's ETag (body hash) + no-cache => the browser revalidates & gets a 304 if unchanged
+		self.set_header('Cache-Control', "no-cache")
+		self.write({
+			'nodes': nodes[offset:offset + limit],
+			'offset': offset,
+			'total': len(nodes)
+		})
+
+
+class SnapshotSearchHandler(ZynthianAuthHandler):
+	"""
+	Snapshot tree filtered by a search query (GET /lib-snapshot/search?q=...),
+	on engines, presets, chain titles, MIDI channels, ZS3 & snapshot names.
+	"""
 
+	@tornado.web.authenticated
+	async def get(self):
+		query = self.get_argument('q', "")
+		snapshot_index.start()
+		paths = set(await snapshot_search.search(query))
+		self.write({
+			'nodes': get_tree_nodes(SnapshotConfigHandler.SNAPSHOTS_DIRECTORY, paths=paths),
+			'total': len(paths)
+		})
+
+
+class SnapshotBulkHandler(ZynthianAuthHandler):
+	"""
+	Batch of snapshot/bank operations (see lib.snapshot_bulk), posted as JSON:
+	{"ops": [...]}. They are validated together and applied atomically. The
+	response is a tree delta: removed & added paths, the root nodes and the
+	programs of the changed banks.
+	"""
 
-class SnapshotRemoveOptionHandler(tornado.web.RequestHandler):
+	@tornado.web.authenticated
+	def post(self):
+		root = SnapshotConfigHandler.SNAPSHOTS_DIRECTORY
+		try:
+			ops = json.loads(self.request.body)['ops']
+		except Exception as e:
+			self.write({'errors': "Invalid request: {}".format(e)})
+			return
+		plan = SnapshotBulkPlan(root, ops)
+		if plan.errors:
+			self.write({'errors': plan.errors})
+			return
+		try:
+			removed, added = plan.apply()
+		except OSError as e:
+			logging.error("Bulk snapshot operation failed => {}".format(e))
+			self.write({'errors': ["Nothing changed, operation failed: {}".format(e)]})
+			return
+		logging.info("Bulk snapshot operation: {} removed, {} added".format(len(removed), len(added)))
+		snapshot_index.start()
+		banks = {}
+		for path in added + [plan.get_final_path(path) for path in removed]:
+			dpath = os.path.dirname(path)
+			if dpath != root and dpath not in banks and os.path.isdir(dpath):
+				parts = os.path.basename(dpath).split("-", 1)
+				banks[dpath] = get_tree_nodes(dpath, 0, parts[0], parts[1] if len(parts) == 2 else "")
+		self.write({
+			'removed': removed,
+			'added': added,
+			'root': get_tree_nodes(root),
+			'banks': banks
+		})
+
+
+class SnapshotDetailsHandler(ZynthianAuthHandler):
+	"""Content of a snapshot (prog_details), with the file fingerprint as ETag"""
 
-	def get_current_user(self):
-		return self.get_secure_cookie("user")
+	@tornado.web.authenticated
+	async def get(self, fpath_b64):
+		fpath = decode_path(fpath_b64)
+		if not fpath.startswith(SnapshotConfigHandler.SNAPSHOTS_DIRECTORY + os.sep):
+			raise tornado.web.HTTPError(404)
+		snapshot_index.start()
+		record = await snapshot_index.get_record(fpath)
+		if record is None:
+			raise tornado.web.HTTPError(404)
+		self.set_header('Cache-Control', "no-cache")
+		self.set_header('Etag', get_etag(record['key']))
+		if self.check_etag_header():
+			self.set_status(304)
+			return
+		self.set_header('Content-Type', "application/json; charset=UTF-8")
+		self.write(json.dumps(await snapshot_index.get_details(fpath)))
+
+
+class SnapshotEditHandler(ZynthianAuthHandler):
+	"""
+	Edit a snapshot with a batch of JSON patch operations (see
+	lib.snapshot_edit), posted as a JSON list. With an If-Match header, the
+	snapshot must not have changed since it was read. The response has only
+	the changed pointers and their new values.
+	"""
+
+	def get_ops(self, *args):
+		return json.loads(self.request.body)
 
 	@tornado.web.authenticated
-	def post(self, snapshot_file_b64, remove_option_key):
+	async def post(self, snapshot_file_b64, *args):
 		result = {}
-		snapshot_file = str(base64.b64decode(snapshot_file_b64), 'utf-8')
 		try:
-			logging.info("Removing option {} in {}".format(remove_option_key, snapshot_file))
-			data = []
-			with open(snapshot_file, "r") as fp:
-				data = json.load(fp)
-				del data['midi_profile_state'][remove_option_key]
-
-			with open(snapshot_file, "w") as fp:
-				json.dump(data, fp)
+			snapshot_file = os.path.normpath(str(base64.b64decode(snapshot_file_b64), 'utf-8'))
+			if not snapshot_file.startswith(SnapshotConfigHandler.SNAPSHOTS_DIRECTORY + os.sep):
+				raise tornado.web.HTTPError(404)
+			ops = self.get_ops(*args)
+			changed, values, etag = await edit_snapshot(snapshot_file, ops, self.request.headers.get('If-Match'))
+			self.set_header('Etag', etag)
+			result['changed'] = changed
+			result['values'] = values
+
+		except EditConflict as err:
+			self.set_status(412)
+			result['errors'] = str(err)
+			logging.warning(err)
 
-			result = data
+		except tornado.web.HTTPError:
+			raise
 
 		except Exception as err:
 			result['errors'] = str(err)
 			logging.error(err)
 
 		# JSON Ouput
-		if result:
-			self.write(result)
+		self.write(result)
 
 
-class SnapshotAddOptionsHandler(tornado.web.RequestHandler):
-	PROFILES_DIRECTORY = "%s/midi-profiles" % os.environ.get("ZYNTHIAN_CONFIG_DIR")
+class SnapshotRemoveChainHandler(SnapshotEditHandler):
 
-	def get_current_user(self):
-		return self.get_secure_cookie("user")
+	def get_ops(self, chain):
+		logging.info("Removing chain {}".format(chain))
+		return [{'op': "remove", 'path': "/chains/" + escape_pointer_token(chain)}]
 
-	@tornado.web.authenticated
-	def post(self, snapshot_file_b64, midi_profile_script_b64):
-		result = {}
 
-		try:
-			snapshot_file = str(base64.b64decode(snapshot_file_b64), 'utf-8')
-			midi_profile_script = str(base64.b64decode(midi_profile_script_b64), 'utf-8')
-			logging.info("Add option values of {} into {}".format(midi_profile_script, snapshot_file))
-			data = []
-			with open(snapshot_file, "r") as fp:
-				data = json.load(fp)
-				fp.close()
-
-			p = re.compile("export ZYNTHIAN_MIDI_(\w*)=\"(.*)\"")
-			profile_values = {}
-			with open(midi_profile_script, "r") as midi_fp:
-				for line in midi_fp:
-					if line[0] == '#':
-						continue
-					m = p.match(line)
-					if m:
-						profile_values[m.group(1)] = m.group(2)
-				midi_fp.close()
-
-			for profile_value in profile_values:
-				data['midi_profile_state'][profile_value] = profile_values[profile_value]
-
-			with open(snapshot_file, "w") as fp:
-				json.dump(data, fp)
-				fp.close()
-
-			result = data
+class SnapshotRemoveOptionHandler(SnapshotEditHandler):
 
-		except Exception as err:
-			result['errors'] = str(err)
-			logging.error(err)
+	def get_ops(self, remove_option_key):
+		logging.info("Removing option {}".format(remove_option_key))
+		return [{'op': "remove", 'path': "/midi_profile_state/" + escape_pointer_token(remove_option_key)}]
 
-		# JSON Ouput
-		if result:
-			self.write(result)
 
+class SnapshotAddOptionsHandler(SnapshotEditHandler):
+
+	def get_ops(self, midi_profile_script_b64):
+		midi_profile_script = str(base64.b64decode(midi_profile_script_b64), 'utf-8')
+		logging.info("Add option values of {}".format(midi_profile_script))
+		profile_values = get_midi_profile_values(midi_profile_script)
+		# Merged into the current options
+		ops = []
+		for key, value in profile_values.items():
+			ops.append({'op': "add", 'path': "/midi_profile_state/" + escape_pointer_token(key), 'value': value})
+		return ops
 
-class SnapshotDownloadHandler(tornado.web.RequestHandler):
 
-	def get_current_user(self):
-		return self.get_secure_cookie("user")
+class SnapshotDownloadHandler(ZynthianAuthHandler):
 
 	@tornado.web.authenticated
-	def get(self, fpath_b64):
-		result = None
-		fpath = None
-		delete = False
+	async def get(self, fpath_b64):
+		fpath = decode_path(fpath_b64)
+		if not fpath.startswith(SnapshotConfigHandler.SNAPSHOTS_DIRECTORY + os.sep):
+			raise tornado.web.HTTPError(404)
 		try:
-			fpath = str(base64.b64decode(fpath_b64), 'utf-8')
-			dname, fname = os.path.split(fpath)
 			if os.path.isdir(fpath):
-				zfpath = TMP_DIR + "/" + fname
-				shutil.make_archive(zfpath, 'zip', fpath)
-				fpath = zfpath + ".zip"
-				fname += ".zip"
-				delete = True
-				mime_type = "application/zip"
+				# Zip is generated on the fly => no temporary file
+				await send_zip(self, fpath)
 			else:
-				delete = False
-				mime_type = "application/octet-stream"
-
-			self.set_header('Content-Type', mime_type)
-			self.set_header("Content-Description", "File Transfer")
-			self.set_header('Content-Disposition', 'attachment; filename="{}"'.format(fname))
-			with open(fpath, 'rb') as f:
-				while True:
-					data = f.read(4096)
-					if not data:
-						break
-					self.write(data)
-				self.finish()
-
-		except Exception as e:
-			logging.error(e)
-			result = {'errors': "Can't download file: {}".format(e)}
-
-		finally:
-			if fpath and delete:
-				os.remove(fpath)
-
-		return result
+				await send_file(self, fpath)
+		except FileNotFoundError:
+			raise tornado.web.HTTPError(404)
+		except StreamClosedError:
+			logging.debug("Download of '{}' cancelled".format(fpath))
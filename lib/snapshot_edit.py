@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Snapshot Document Editing
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import os
+import re
+import copy
+import json
+import shutil
+import asyncio
+import logging
+import threading
+
+from lib.snapshot_index import snapshot_index, get_file_key
+
+# ------------------------------------------------------------------------------
+# Snapshot Document Editing
+#
+# A batch of JSON patch operations (RFC 6902: add, remove, replace, move,
+# copy & test) is applied in memory to a snapshot, which is then written once
+# and atomically: temp file, fsync & rename. The result are the JSON pointers
+# changed by the batch, so the client doesn't need the whole document back.
+# The file key (mtime & size) is used as ETag, so edits based on an outdated
+# copy of the snapshot can be rejected.
+#
+# Snapshots are read, patched & written in a worker thread, one edit at a time.
+# ------------------------------------------------------------------------------
+
+# Serializes the edits running in worker threads
+edit_lock = threading.Lock()
+
+
+class PatchError(Exception):
+	pass
+
+
+class EditConflict(Exception):
+	pass
+
+
+def get_etag(key):
+	return '"{:x}-{:x}"'.format(*key)
+
+
+def escape_pointer_token(token):
+	return str(token).replace("~", "~0").replace("/", "~1")
+
+
+def parse_pointer(pointer):
+	"""JSON pointer => list of reference tokens"""
+	if pointer == "":
+		return []
+	if not pointer.startswith("/"):
+		raise PatchError("Invalid pointer: {}".format(pointer))
+	return [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+
+
+def get_list_index(container, token, append=False):
+	if append and token == "-":
+		return len(container)
+	if not token.isdigit() or (len(token) > 1 and token[0] == "0"):
+		raise PatchError("Invalid array index: {}".format(token))
+	index = int(token)
+	if index > len(container) or (index == len(container) and not append):
+		raise PatchError("Array index out of range: {}".format(token))
+	return index
+
+
+def resolve(doc, tokens):
+	for token in tokens:
+		try:
+			if isinstance(doc, list):
+				doc = doc[get_list_index(doc, token)]
+			elif isinstance(doc, dict):
+				doc = doc[token]
+			else:
+				raise KeyError(token)
+		except KeyError:
+			raise PatchError("Path not found: /{}".format("/".join(escape_pointer_token(t) for t in tokens)))
+	return doc
+
+
+def get_parent(doc, tokens):
+	if not tokens:
+		raise PatchError("The whole document can't be changed")
+	parent = resolve(doc, tokens[:-1])
+	if not isinstance(parent, (dict, list)):
+		raise PatchError("Not a container: /{}".format("/".join(escape_pointer_token(t) for t in tokens[:-1])))
+	return parent, tokens[-1]
+
+
+def add_value(doc, tokens, value):
+	parent, token = get_parent(doc, tokens)
+	if isinstance(parent, list):
+		parent.insert(get_list_index(parent, token, True), value)
+	else:
+		parent[token] = value
+
+
+def remove_value(doc, tokens):
+	parent, token = get_parent(doc, tokens)
+	value = resolve(parent, [token])
+	if isinstance(parent, list):
+		del parent[int(token)]
+	else:
+		del parent[token]
+	return value
+
+
+def apply_patch(doc, ops):
+	"""Apply JSON patch operations to doc, in place. Return the changed pointers, sorted."""
+	if not isinstance(ops, list):
+		raise PatchError("A patch must be a list of operations")
+	changed = set()
+	for op in ops:
+		try:
+			action = op['op']
+			path = op['path']
+			tokens = parse_pointer(path)
+			if action == "add":
+				add_value(doc, tokens, copy.deepcopy(op['value']))
+			elif action == "remove":
+				remove_value(doc, tokens)
+			elif action == "replace":
+				remove_value(doc, tokens)
+				add_value(doc, tokens, copy.deepcopy(op['value']))
+			elif action == "move":
+				from_tokens = parse_pointer(op['from'])
+				if tokens[:len(from_tokens)] == from_tokens and tokens != from_tokens:
+					raise PatchError("Can't move {} into itself".format(op['from']))
+				add_value(doc, tokens, remove_value(doc, from_tokens))
+				changed.add(op['from'])
+			elif action == "copy":
+				add_value(doc, tokens, copy.deepcopy(resolve(doc, parse_pointer(op['from']))))
+			elif action == "test":
+				if resolve(doc, tokens) != op['value']:
+					raise PatchError("Test failed: {}".format(path))
+				continue
+			else:
+				raise PatchError("Unknown operation: {}".format(action))
+		except (KeyError, TypeError, AttributeError) as e:
+			raise PatchError("Invalid operation {}: {}".format(op, e))
+		changed.add(path)
+	return sorted(changed)
+
+
+def write_json(fpath, data):
+	"""Replace a JSON file atomically, so it's never left half written"""
+	dname, fname = os.path.split(fpath)
+	# Not ending in .zss => ignored by the catalogue
+	tmp_fpath = os.path.join(dname, "." + fname + ".editing")
+	try:
+		with open(tmp_fpath, "w") as f:
+			json.dump(data, f)
+			f.flush()
+			os.fsync(f.fileno())
+		try:
+			shutil.copymode(fpath, tmp_fpath)
+		except OSError:
+			pass
+		os.replace(tmp_fpath, fpath)
+	except BaseException:
+		try:
+			os.remove(tmp_fpath)
+		except OSError:
+			pass
+		raise
+	# Make the rename itself durable
+	dfd = os.open(dname or ".", os.O_RDONLY)
+	try:
+		os.fsync(dfd)
+	finally:
+		os.close(dfd)
+
+
+def patch_file(fpath, ops, etag=None):
+	"""
+	Apply a JSON patch to a snapshot file. If etag is given, the file must
+	still have it. Return (changed pointers, {pointer: new value} for the
+	changed pointers still existing, new content or None if unchanged, new
+	file key).
+	"""
+	with edit_lock:
+		with open(fpath) as f:
+			key = get_file_key(fpath)
+			data = json.load(f)
+		if etag is not None and etag != get_etag(key):
+			raise EditConflict("Snapshot changed meanwhile: {}".format(fpath))
+		changed = apply_patch(data, ops)
+		values = {}
+		for pointer in changed:
+			try:
+				values[pointer] = resolve(data, parse_pointer(pointer))
+			except PatchError:
+				pass
+		if not changed:
+			return changed, values, None, key
+		write_json(fpath, data)
+		return changed, values, data, get_file_key(fpath)
+
+
+async def edit_snapshot(fpath, ops, etag=None):
+	"""
+	Apply a JSON patch to a snapshot file from a worker thread (see
+	patch_file) & update its catalogue record. Return (changed pointers,
+	{pointer: new value} for the changed pointers still existing, new etag).
+	"""
+	changed, values, data, key = await asyncio.get_running_loop().run_in_executor(None, patch_file, fpath, ops, etag)
+	if changed:
+		# Already parsed => don't parse it again. Pending inotify events must be read first.
+		snapshot_index.revalidate()
+		record = snapshot_index.records.get(fpath)
+		if record is not None and record['legacy'] is False:
+			snapshot_index.set_record(fpath, key, data, False)
+		logging.info("Edited snapshot {}: {}".format(fpath, ", ".join(changed)))
+	return changed, values, get_etag(key)
+
+# ------------------------------------------------------------------------------
+# MIDI profile scripts
+# ------------------------------------------------------------------------------
+
+
+MIDI_PROFILE_RE = re.compile(r"export ZYNTHIAN_MIDI_(\w*)=\"(.*)\"")
+
+# path => (file key, values)
+midi_profiles = {}
+
+
+def get_midi_profile_values(fpath):
+	"""ZYNTHIAN_MIDI_* values set by a MIDI profile script, without the prefix. Parsed once per file version."""
+	key = get_file_key(fpath)
+	try:
+		cached_key, values = midi_profiles[fpath]
+		if cached_key == key:
+			return dict(values)
+	except KeyError:
+		pass
+	values = {}
+	with open(fpath, "r") as f:
+		for line in f:
+			if line[0] == '#':
+				continue
+			m = MIDI_PROFILE_RE.match(line)
+			if m:
+				values[m.group(1)] = m.group(2)
+	midi_profiles[fpath] = (key, values)
+	return dict(values)
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,479 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Snapshot Metadata Index
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import os
+import json
+import asyncio
+import logging
+import tornado.ioloop
+from collections import OrderedDict
+
+from lib.lazy_handler import timed_import
+from lib.catalogue_file import CatalogueSaver
+from lib.library_index import Inotify, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE, IN_Q_OVERFLOW, IN_IGNORED, IN_ONLYDIR
+
+# ------------------------------------------------------------------------------
+# Snapshot Catalogue
+#
+# Directory listings and a summary of the chains & engines of the snapshot
+# files. Files are validated against their mtime & size and directories
+# against their mtime, so building the snapshot tree only lists the changed
+# directories and re-parses the changed files. Entries are also dropped from
+# inotify events on the listed directories.
+#
+# The catalogue is saved as a JSON-lines file next to the snapshots directory
+# and loaded at startup, so the first load after boot doesn't parse anything.
+# The parsed (converted) content of the snapshots isn't catalogued: only the
+# last DETAILS_CACHE_SIZE ones are kept, the others are parsed when needed.
+# Snapshots are parsed in worker threads, so requests needing them are async.
+# ------------------------------------------------------------------------------
+
+MY_DATA_DIR = os.environ.get('ZYNTHIAN_MY_DATA_DIR', "/zynthian/zynthian-my-data")
+SNAPSHOTS_DIR = MY_DATA_DIR + "/snapshots"
+CATALOGUE_FPATH = os.environ.get('ZYNTHIAN_WEBCONF_SNAPSHOT_CATALOGUE', MY_DATA_DIR + "/.snapshot-catalogue.jsonl")
+CATALOGUE_VERSION = 3
+
+# Seconds from a change to the catalogue being saved
+SAVE_DELAY = 5
+
+# Parsed snapshots kept in memory
+DETAILS_CACHE_SIZE = 32
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+
+
+def get_file_key(fpath):
+	st = os.stat(fpath)
+	return [st.st_mtime_ns, st.st_size]
+
+
+def convert_snapshot(text):
+	"""Return (converted state, True if it was in a legacy format) from a snapshot file's content"""
+	# zyngine is only loaded when a snapshot needs to be parsed
+	legacy_snapshot = timed_import("zyngine.zynthian_legacy_snapshot").zynthian_legacy_snapshot
+	state = legacy_snapshot().convert_state(json.loads(text))
+	# convert_state may change its argument in place => compare with a fresh copy
+	return state, state != json.loads(text)
+
+
+def read_snapshot(fpath):
+	with open(fpath) as f:
+		return convert_snapshot(f.read())
+
+
+def load_snapshot(fpath):
+	"""Return (converted state, legacy) of a snapshot file, or (None, False) if it can't be read"""
+	try:
+		return read_snapshot(fpath)
+	except Exception as e:
+		logging.warning("Can't read snapshot '{}' => {}".format(fpath, e))
+		return None, False
+
+
+def get_names(relpath):
+	"""Bank & program numbers and names from a snapshot path, relative to the snapshots directory"""
+	parts = relpath.split(os.sep)
+	fname = parts[-1][:-4]
+	if len(parts) == 1:
+		return {'bank_num': '', 'bank_name': '', 'prog_num': '', 'prog_name': fname}
+	bank_parts = parts[-2].split("-", 1)
+	prog_parts = fname.split("-", 1)
+	return {
+		'bank_num': bank_parts[0].zfill(3),
+		'bank_name': bank_parts[1] if len(bank_parts) == 2 else "",
+		'prog_num': prog_parts[0],
+		'prog_name': prog_parts[1] if len(prog_parts) == 2 else ""
+	}
+
+
+def get_summary(details):
+	"""Chains, engines & presets of a parsed snapshot"""
+	if not isinstance(details, dict):
+		return None
+	zs3_list = details.get('zs3') or {}
+	try:
+		processors = zs3_list['zs3-0']['processors'] or {}
+	except (KeyError, TypeError):
+		processors = {}
+	chains = []
+	engines = set()
+	chains_data = details.get('chains') or {}
+	for chain_id in sorted(chains_data):
+		chain = chains_data[chain_id]
+		procs = []
+		for slot in chain.get('slots') or []:
+			for proc_id, proc_type in slot.items():
+				proc_info = processors.get(proc_id) or {}
+				preset_info = proc_info.get('preset_info')
+				bank_info = proc_info.get('bank_info')
+				procs.append({
+					'engine': proc_type,
+					'bank': bank_info[2] if bank_info and len(bank_info) > 2 else "",
+					'preset': preset_info[2] if preset_info and len(preset_info) > 2 else ""
+				})
+				engines.add(proc_type)
+		chains.append({
+			'id': chain_id,
+			'title': chain.get('title') or "",
+			'midi_chan': chain.get('midi_chan'),
+			'processors': procs
+		})
+	return {
+		'chains': chains,
+		'engines': sorted(engines),
+		'zs3': [zs3.get('title') or zs3_id for zs3_id, zs3 in zs3_list.items() if isinstance(zs3, dict)]
+	}
+
+
+class SnapshotIndex:
+
+	def __init__(self, root=SNAPSHOTS_DIR, fpath=CATALOGUE_FPATH):
+		self.root = root
+		self.fpath = fpath
+		# path => {'key': [mtime_ns, size] or None if not parsed, 'summary', 'legacy', names...}
+		self.records = {}
+		# path => (key, parsed content), least recently used first
+		self.details = OrderedDict()
+		# path => (key, future) of the snapshots being parsed
+		self.parsing = {}
+		# path => {'mtime': mtime_ns or None if stale, 'dirs': [names], 'files': [names]}
+		self.dirs = {}
+		# Serialized catalogue lines, by path
+		self.lines = {}
+		self.inotify = None
+		self.wd_paths = {}
+		self.path_wds = {}
+		self.started = False
+		self.saver = CatalogueSaver(fpath, self.get_lines, SAVE_DELAY, "snapshot catalogue")
+		# Increased on every change to the catalogue
+		self.version = 0
+		self.validated_version = None
+
+	def start(self):
+		if self.started:
+			return
+		self.started = True
+		self.load()
+		try:
+			self.inotify = Inotify()
+			tornado.ioloop.IOLoop.current().add_handler(self.inotify.fd, self.on_inotify, tornado.ioloop.IOLoop.READ)
+		except Exception as e:
+			logging.warning("Snapshot index can't use inotify, validating by mtime & size only => {}".format(e))
+			self.inotify = None
+
+	# --------------------------------------------------------------------------
+	# Persistence
+	# --------------------------------------------------------------------------
+
+	def load(self):
+		try:
+			with open(self.fpath) as f:
+				header = json.loads(f.readline())
+				if header.get('version') != CATALOGUE_VERSION:
+					logging.info("Snapshot catalogue version changed, rebuilding it")
+					return
+				for line in f:
+					item = json.loads(line)
+					if 'dir' in item:
+						path = os.path.normpath(os.path.join(self.root, item.pop('dir')))
+						self.dirs[path] = item
+					else:
+						path = os.path.join(self.root, item.pop('path'))
+						self.records[path] = item
+					self.lines[path] = line
+		except FileNotFoundError:
+			return
+		except Exception as e:
+			logging.warning("Can't load snapshot catalogue '{}' => {}".format(self.fpath, e))
+			self.records = {}
+			self.dirs = {}
+			self.lines = {}
+			return
+		logging.info("Loaded snapshot catalogue: {} snapshots in {} directories".format(len(self.records), len(self.dirs)))
+
+	def changed(self, path):
+		self.lines.pop(path, None)
+		self.version += 1
+		if self.started:
+			self.saver.schedule()
+
+	def get_line(self, path):
+		try:
+			return self.lines[path]
+		except KeyError:
+			pass
+		relpath = os.path.relpath(path, self.root)
+		if path in self.dirs:
+			item = dict(self.dirs[path], dir=relpath)
+		else:
+			item = dict(self.records[path], path=relpath)
+		line = self.lines[path] = json.dumps(item, separators=(',', ':')) + "\n"
+		return line
+
+	def get_lines(self):
+		lines = [json.dumps({'version': CATALOGUE_VERSION}) + "\n"]
+		lines += [self.get_line(dpath) for dpath in self.dirs]
+		lines += [self.get_line(path) for path in self.records]
+		return lines
+
+	# --------------------------------------------------------------------------
+	# Directories
+	# --------------------------------------------------------------------------
+
+	def watch_dir(self, dpath):
+		if not self.inotify or dpath in self.path_wds:
+			return
+		try:
+			wd = self.inotify.add_watch(dpath, WATCH_MASK)
+		except OSError as e:
+			logging.debug("Snapshot index can't watch '{}' => {}".format(dpath, e))
+			return
+		self.wd_paths[wd] = dpath
+		self.path_wds[dpath] = wd
+
+	def unwatch_tree(self, dpath):
+		prefix = dpath + os.sep
+		for path in [p for p in self.path_wds if p == dpath or p.startswith(prefix)]:
+			wd = self.path_wds.pop(path)
+			del self.wd_paths[wd]
+			self.inotify.rm_watch(wd)
+
+	def list_dir(self, dpath):
+		"""List a snapshot directory, updating (and returning) its catalogue entry and watching it"""
+		self.watch_dir(dpath)
+		# Stat before listing => changes made meanwhile are seen next time
+		mtime = os.stat(dpath).st_mtime_ns
+		with os.scandir(dpath) as it:
+			entries = sorted(it, key=lambda entry: entry.name)
+		subdirs = []
+		files = []
+		for entry in entries:
+			try:
+				if entry.is_dir():
+					subdirs.append(entry.name)
+				elif entry.name.endswith(".zss"):
+					files.append(entry.name)
+			except OSError:
+				pass
+		self.update_dir(dpath, mtime, subdirs, files)
+		return self.dirs[dpath]
+
+	def update_dir(self, dpath, mtime, subdirs, files):
+		try:
+			old = self.dirs[dpath]
+		except KeyError:
+			old = {'mtime': None, 'dirs': [], 'files': []}
+		if old == {'mtime': mtime, 'dirs': subdirs, 'files': files}:
+			return
+		for name in set(old['dirs']) - set(subdirs):
+			self.remove_dir(os.path.join(dpath, name))
+		for name in set(old['files']) - set(files):
+			self.remove_record(os.path.join(dpath, name))
+		for name in files:
+			path = os.path.join(dpath, name)
+			if path not in self.records:
+				self.records[path] = dict(get_names(os.path.relpath(path, self.root)), key=None, summary=None, legacy=None)
+				self.changed(path)
+		self.dirs[dpath] = {'mtime': mtime, 'dirs': subdirs, 'files': files}
+		self.changed(dpath)
+
+	def remove_dir(self, dpath):
+		prefix = dpath + os.sep
+		for path in [p for p in self.dirs if p == dpath or p.startswith(prefix)]:
+			del self.dirs[path]
+			self.changed(path)
+		for path in [p for p in self.records if p.startswith(prefix)]:
+			self.remove_record(path)
+
+	def remove_record(self, path):
+		self.details.pop(path, None)
+		if self.records.pop(path, None) is not None:
+			self.changed(path)
+
+	def revalidate(self):
+		"""Bring the catalogue up to date, listing only the directories whose mtime changed"""
+		if self.inotify:
+			# Changes just made by this process may not have been read yet
+			self.on_inotify(self.inotify.fd, None)
+			if self.validated_version == self.version:
+				return
+		stack = [self.root]
+		seen = set()
+		while stack:
+			dpath = stack.pop()
+			try:
+				mtime = os.stat(dpath).st_mtime_ns
+				if dpath not in self.dirs or self.dirs[dpath]['mtime'] != mtime:
+					self.list_dir(dpath)
+				else:
+					self.watch_dir(dpath)
+			except OSError:
+				self.remove_dir(dpath)
+				continue
+			seen.add(dpath)
+			stack += [os.path.join(dpath, name) for name in self.dirs[dpath]['dirs']]
+		for dpath in [p for p in self.dirs if p not in seen]:
+			self.remove_dir(dpath)
+		self.validated_version = self.version
+
+	# --------------------------------------------------------------------------
+	# Snapshot files
+	# --------------------------------------------------------------------------
+
+	async def get_record(self, fpath):
+		"""Catalogue record of a snapshot file, parsing it if it changed. None if it doesn't exist."""
+		try:
+			key = get_file_key(fpath)
+		except OSError:
+			self.remove_record(fpath)
+			return None
+		try:
+			record = self.records[fpath]
+			if record['key'] == key:
+				return record
+		except KeyError:
+			pass
+		await self.parse(fpath, key)
+		return self.records.get(fpath)
+
+	async def parse(self, fpath, key):
+		"""
+		Parse a snapshot file having key in a worker thread, updating its
+		record. Return its content, None if it can't be read. Concurrent
+		requests for the same file version share the parsing.
+		"""
+		try:
+			parse_key, future = self.parsing[fpath]
+			if parse_key != key:
+				raise KeyError
+		except KeyError:
+			future = asyncio.get_running_loop().run_in_executor(None, load_snapshot, fpath)
+			future.add_done_callback(lambda f: self.on_parsed(fpath, key, f))
+			self.parsing[fpath] = (key, future)
+		# A cancelled request mustn't cancel the parsing shared with others
+		details, legacy = await asyncio.shield(future)
+		return details
+
+	def on_parsed(self, fpath, key, future):
+		if self.parsing.get(fpath, (None, None))[1] is future:
+			del self.parsing[fpath]
+		if future.cancelled():
+			return
+		# Removed meanwhile => don't add it back. If it changed, key doesn't match & it's parsed again.
+		if not os.path.isfile(fpath):
+			self.remove_record(fpath)
+			return
+		details, legacy = future.result()
+		self.set_record(fpath, key, details, legacy)
+
+	def set_record(self, fpath, key, details, legacy):
+		"""Store a snapshot file parsed somewhere else (i.e. a worker thread), read when it had key"""
+		record = dict(get_names(os.path.relpath(fpath, self.root)), key=key, summary=get_summary(details), legacy=legacy)
+		self.cache_details(fpath, key, details)
+		if self.records.get(fpath) != record:
+			self.records[fpath] = record
+			self.changed(fpath)
+		return self.records[fpath]
+
+	def cache_details(self, fpath, key, details):
+		self.details[fpath] = (key, details)
+		self.details.move_to_end(fpath)
+		while len(self.details) > DETAILS_CACHE_SIZE:
+			self.details.popitem(last=False)
+
+	async def get_details(self, fpath):
+		"""Parsed content of a snapshot file, or None if it can't be read"""
+		record = await self.get_record(fpath)
+		if record is None:
+			return None
+		try:
+			key, details = self.details[fpath]
+			if key == record['key']:
+				self.details.move_to_end(fpath)
+				return details
+		except KeyError:
+			pass
+		return await self.parse(fpath, record['key'])
+
+	async def get_records(self):
+		"""All the catalogue records, by path, up to date. The changed snapshots are parsed concurrently."""
+		self.revalidate()
+		parsing = []
+		for path, record in list(self.records.items()):
+			try:
+				key = get_file_key(path)
+			except OSError:
+				self.remove_record(path)
+				continue
+			if record['key'] != key:
+				parsing.append(self.parse(path, key))
+		await asyncio.gather(*parsing)
+		return self.records
+
+	def get_listing(self, dpath):
+		"""Catalogue entry of a snapshot directory ({'mtime', 'dirs', 'files'}, sorted names), or None if it doesn't exist"""
+		self.revalidate()
+		return self.dirs.get(dpath)
+
+	def get_count(self):
+		self.revalidate()
+		return len(self.records)
+
+	def on_inotify(self, fd, events):
+		for wd, mask, name in self.inotify.read_events():
+			if mask & IN_Q_OVERFLOW:
+				logging.warning("Snapshot index: inotify queue overflow, revalidating")
+				for info in self.dirs.values():
+					info['mtime'] = None
+				for record in self.records.values():
+					record['key'] = None
+				self.version += 1
+				continue
+			if mask & IN_IGNORED:
+				path = self.wd_paths.pop(wd, None)
+				if path is not None:
+					self.path_wds.pop(path, None)
+				continue
+			try:
+				dpath = self.wd_paths[wd]
+			except KeyError:
+				continue
+			path = os.path.join(dpath, name)
+			# Moved away directories keep their watches => drop them, listing the new path adds new ones
+			if mask & (IN_DELETE | IN_MOVED_FROM):
+				self.unwatch_tree(path)
+				self.remove_dir(path)
+				self.remove_record(path)
+			elif path in self.records:
+				# Re-parse on next access
+				self.records[path]['key'] = None
+			# Relist the parent on next access
+			if dpath in self.dirs:
+				self.dirs[dpath]['mtime'] = None
+			self.version += 1
+
+
+snapshot_index = SnapshotIndex()
+
+# ------------------------------------------------------------------------------
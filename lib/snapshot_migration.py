@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Legacy Snapshot Migration
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import os
+import json
+import shutil
+import asyncio
+import logging
+import jsonpickle
+from concurrent.futures import ThreadPoolExecutor
+import tornado.websocket
+
+from lib.snapshot_index import snapshot_index, convert_snapshot, get_file_key
+from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, ZynthianWebSocketMessage
+
+# ------------------------------------------------------------------------------
+# Legacy Snapshot Migration
+#
+# Snapshots saved in a legacy format are converted once, in a background
+# worker pool, and written back atomically, keeping the original file as
+# .zss.bak. Files already known by the catalogue to be in the current format
+# are skipped. Progress is pushed to the websocket subscribers.
+# Set ZYNTHIAN_WEBCONF_SNAPSHOT_MIGRATION=0 to disable it.
+# ------------------------------------------------------------------------------
+
+MIGRATION_ENABLED = os.environ.get('ZYNTHIAN_WEBCONF_SNAPSHOT_MIGRATION', "1") != "0"
+
+# Seconds from startup to the migration, so it doesn't compete with it
+START_DELAY = 30
+
+WORKERS = 2
+
+
+def migrate_file(fpath):
+	"""
+	Convert a snapshot file if it's in a legacy format. Return (key, state,
+	True if it was converted), key being the file's key once written.
+	"""
+	key = get_file_key(fpath)
+	with open(fpath) as f:
+		text = f.read()
+	state, legacy = convert_snapshot(text)
+	if not legacy:
+		return key, state, False
+	dname, fname = os.path.split(fpath)
+	bak_fpath = fpath + ".bak"
+	if not os.path.exists(bak_fpath):
+		shutil.copy2(fpath, bak_fpath)
+	# Not ending in .zss => ignored by the catalogue
+	tmp_fpath = os.path.join(dname, "." + fname + ".migrating")
+	try:
+		with open(tmp_fpath, "w") as f:
+			json.dump(state, f)
+			f.flush()
+			os.fsync(f.fileno())
+		# Changed meanwhile (e.g. saved from the UI) => leave it for the next run
+		if get_file_key(fpath) != key:
+			raise RuntimeError("modified while converting")
+		os.replace(tmp_fpath, fpath)
+	except BaseException:
+		try:
+			os.remove(tmp_fpath)
+		except OSError:
+			pass
+		raise
+	return get_file_key(fpath), state, True
+
+
+class SnapshotMigration:
+
+	def __init__(self):
+		self.subscribers = set()
+		self.task = None
+		self.progress = self.get_empty_progress()
+
+	@staticmethod
+	def get_empty_progress():
+		return {
+			'running': False,
+			'total': 0,
+			'done': 0,
+			'converted': 0,
+			'failed': 0
+		}
+
+	def start(self):
+		if MIGRATION_ENABLED:
+			asyncio.get_event_loop().call_later(START_DELAY, self.run)
+
+	def run(self):
+		"""Start a migration, unless it's already running"""
+		if self.task is None:
+			self.task = asyncio.ensure_future(self.migrate())
+
+	async def migrate(self):
+		try:
+			snapshot_index.start()
+			snapshot_index.revalidate()
+			# Not parsed yet (legacy None) or legacy => must be checked
+			fpaths = [path for path, record in snapshot_index.records.items() if record['legacy'] is not False]
+			self.progress = self.get_empty_progress()
+			if not fpaths:
+				return
+			self.progress['running'] = True
+			self.progress['total'] = len(fpaths)
+			self.notify()
+			loop = asyncio.get_running_loop()
+			with ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="snapshot_migration") as executor:
+				for fpath, future in [(fpath, loop.run_in_executor(executor, migrate_file, fpath)) for fpath in fpaths]:
+					try:
+						key, state, converted = await future
+						# Parsed anyway => feed the catalogue, unless the file is gone meanwhile
+						if fpath in snapshot_index.records:
+							snapshot_index.set_record(fpath, key, state, False)
+						if converted:
+							self.progress['converted'] += 1
+					except Exception as e:
+						self.progress['failed'] += 1
+						logging.warning("Can't convert legacy snapshot '{}' => {}".format(fpath, e))
+					self.progress['done'] += 1
+					self.notify()
+			self.progress['running'] = False
+			self.notify()
+			logging.info("Snapshot migration: {converted} of {total} converted, {failed} failed".format(**self.progress))
+		finally:
+			self.task = None
+
+	# --------------------------------------------------------------------------
+	# Websocket subscribers
+	# --------------------------------------------------------------------------
+
+	def subscribe(self, handler):
+		self.subscribers.add(handler)
+		self.send(handler, self.encode(self.progress))
+
+	def unsubscribe(self, handler):
+		self.subscribers.discard(handler)
+
+	def notify(self):
+		if self.subscribers:
+			message = self.encode(self.progress)
+			for handler in list(self.subscribers):
+				self.send(handler, message)
+
+	@staticmethod
+	def encode(data):
+		return jsonpickle.encode(ZynthianWebSocketMessage('SnapshotMigrationMessageHandler', data))
+
+	def send(self, handler, message):
+		try:
+			handler.websocket.write_message(message)
+		except tornado.websocket.WebSocketClosedError:
+			self.unsubscribe(handler)
+
+
+snapshot_migration = SnapshotMigration()
+
+
+class SnapshotMigrationMessageHandler(ZynthianWebSocketMessageHandler):
+
+	@classmethod
+	def is_registered_for(cls, handler_name):
+		return handler_name == 'SnapshotMigrationMessageHandler'
+
+	def on_websocket_message(self, message):
+		if message == 'SUBSCRIBE':
+			snapshot_migration.subscribe(self)
+		elif message == 'UNSUBSCRIBE':
+			snapshot_migration.unsubscribe(self)
+		elif message == 'START':
+			snapshot_migration.run()
+
+	def on_close(self):
+		snapshot_migration.unsubscribe(self)
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Snapshot Search Index
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import re
+import bisect
+
+from lib.snapshot_index import snapshot_index
+
+# ------------------------------------------------------------------------------
+# Snapshot Search Index
+#
+# Inverted index (term => snapshot paths) built from the snapshot catalogue
+# summaries. Before each search, only the snapshots whose catalogue record
+# changed since they were indexed are re-indexed.
+#
+# Words are indexed with their field ("engine:pianoteq"), so queries can mix
+# free words, matching any field, and field filters, e.g.
+# "pianoteq engine:dragonfly chan:3". Every query term must match (AND), as
+# a prefix of an indexed word.
+# ------------------------------------------------------------------------------
+
+FIELDS = ("name", "bank", "engine", "preset", "chain", "chan", "zs3")
+
+WORD_RE = re.compile(r"\w+")
+
+
+def get_words(text):
+	return WORD_RE.findall(str(text).lower())
+
+
+def get_terms(record):
+	"""Search terms of a catalogue record, as "field:word" strings"""
+	terms = set()
+
+	def add(field, text):
+		for word in get_words(text):
+			terms.add(field + ":" + word)
+
+	add("name", record['prog_name'])
+	add("bank", record['bank_name'])
+	add("bank", record['bank_num'])
+	summary = record.get('summary') or {}
+	for chain in summary.get('chains', []):
+		add("chain", chain['title'])
+		add("chain", chain['id'])
+		try:
+			# Chain ids may be zero padded
+			add("chain", int(chain['id']))
+		except (TypeError, ValueError):
+			pass
+		if chain['midi_chan'] is not None:
+			# 1-based, as shown in the UI
+			add("chan", chain['midi_chan'] + 1)
+		for proc in chain['processors']:
+			add("engine", proc['engine'])
+			add("preset", proc['preset'])
+			add("preset", proc['bank'])
+	for title in summary.get('zs3', []):
+		add("zs3", title)
+	return terms
+
+
+class SnapshotSearch:
+
+	def __init__(self):
+		# term => set of paths
+		self.postings = {}
+		# path => (catalogue key indexed, terms)
+		self.docs = {}
+		# Sorted terms, for prefix matching. None => must be rebuilt.
+		self.terms = None
+
+	async def update(self):
+		"""Re-index the snapshots that changed in the catalogue"""
+		records = await snapshot_index.get_records()
+		for path in [p for p in self.docs if p not in records]:
+			self.remove_doc(path)
+		for path, record in records.items():
+			try:
+				if self.docs[path][0] == record['key']:
+					continue
+				self.remove_doc(path)
+			except KeyError:
+				pass
+			terms = get_terms(record)
+			for term in terms:
+				try:
+					self.postings[term].add(path)
+				except KeyError:
+					self.postings[term] = {path}
+					self.terms = None
+			self.docs[path] = (record['key'], terms)
+
+	def remove_doc(self, path):
+		key, terms = self.docs.pop(path)
+		for term in terms:
+			paths = self.postings[term]
+			paths.discard(path)
+			if not paths:
+				del self.postings[term]
+				self.terms = None
+
+	def match_prefix(self, prefix):
+		"""Paths having a term starting with prefix"""
+		if self.terms is None:
+			self.terms = sorted(self.postings)
+		res = set()
+		i = bisect.bisect_left(self.terms, prefix)
+		while i < len(self.terms) and self.terms[i].startswith(prefix):
+			res |= self.postings[self.terms[i]]
+			i += 1
+		return res
+
+	def match(self, qterm):
+		"""Paths matching a query term ("field:words" or bare words), or None if it has no words"""
+		field, sep, text = qterm.partition(":")
+		if sep and field in FIELDS:
+			fields = (field,)
+		else:
+			fields = FIELDS
+			text = qterm
+		res = None
+		for word in get_words(text):
+			matches = set()
+			for f in fields:
+				matches |= self.match_prefix(f + ":" + word)
+			res = matches if res is None else res & matches
+		return res
+
+	async def search(self, query):
+		"""Sorted paths of the snapshots matching all the query terms"""
+		await self.update()
+		res = None
+		for qterm in query.split():
+			matches = self.match(qterm)
+			if matches is None:
+				continue
+			res = matches if res is None else res & matches
+			if not res:
+				break
+		return sorted(res or [])
+
+
+snapshot_search = SnapshotSearch()
+
+# ------------------------------------------------------------------------------
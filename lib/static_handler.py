@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Static Files Handler
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import os
+import gzip
+import logging
+import mimetypes
+import threading
+import tornado.web
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+# ------------------------------------------------------------------------------
+# Static assets
+#
+# - Compressible files get precompressed .gz (and .br, if brotli is available)
+#   siblings, served when the client accepts the encoding.
+# - Templates reference assets through asset_url(), which appends tornado's
+#   static file version (content hash, ?v=...). Requests carrying the current
+#   version are cached as immutable, any other one is revalidated.
+#   The static_path setting isn't used, as tornado would then serve the whole
+#   static_path directory from its own routes.
+# ------------------------------------------------------------------------------
+
+# URL prefix => directory
+STATIC_DIRS = {
+	'bower_components': 'bower_components',
+	'css': 'css',
+	'js': 'js',
+	'fonts': 'fonts',
+	'img': 'img'
+}
+
+COMPRESSIBLE_EXTENSIONS = ('.js', '.css', '.svg', '.html', '.json', '.map', '.txt', '.ttf', '.eot', '.otf', '.ico')
+COMPRESS_MIN_SIZE = 1024
+
+# Settings for the static file versions: asset paths are relative to the current directory
+STATIC_SETTINGS = {'static_path': "."}
+
+# Available encodings, in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')] if brotli else [('gzip', '.gz')]
+
+def get_accepted_encodings(accept):
+	"""Available encodings accepted by an Accept-Encoding header (q > 0), highest q first, then in order of preference"""
+	qvalues = {}
+	for item in accept.split(","):
+		parts = item.split(";")
+		coding = parts[0].strip().lower()
+		if not coding:
+			continue
+		q = 1.0
+		for param in parts[1:]:
+			name, sep, value = param.partition("=")
+			if name.strip().lower() == "q":
+				try:
+					q = float(value)
+				except ValueError:
+					q = 0.0
+		qvalues[coding] = q
+	# "*" stands for the encodings not listed
+	accepted = [(qvalues.get(encoding, qvalues.get("*", 0.0)), encoding, ext) for encoding, ext in ENCODINGS]
+	return [(encoding, ext) for q, encoding, ext in sorted(accepted, key=lambda item: -item[0]) if q > 0]
+
+
+def get_asset_fpath(url):
+	try:
+		prefix, rpath = url.lstrip('/').split('/', 1)
+		return os.path.join(STATIC_DIRS[prefix], rpath)
+	except (ValueError, KeyError):
+		return None
+
+
+def asset_url(handler, url):
+	"""Template helper: "/css/style.css" => "/css/style.css?v=<content hash>"."""
+	return ZynthianStaticFileHandler.make_static_url(STATIC_SETTINGS, url)
+
+
+def compress_file(fpath):
+	st = os.stat(fpath)
+	if st.st_size < COMPRESS_MIN_SIZE:
+		return
+	data = None
+	for encoding, ext in ENCODINGS:
+		cfpath = fpath + ext
+		try:
+			if os.stat(cfpath).st_mtime_ns >= st.st_mtime_ns:
+				continue
+		except OSError:
+			pass
+		if data is None:
+			with open(fpath, 'rb') as f:
+				data = f.read()
+		if encoding == 'br':
+			cdata = brotli.compress(data)
+		else:
+			cdata = gzip.compress(data, compresslevel=9, mtime=0)
+		# Not worth it => don't store it
+		if len(cdata) >= len(data):
+			continue
+		tmp_fpath = cfpath + ".tmp"
+		with open(tmp_fpath, 'wb') as f:
+			f.write(cdata)
+		os.replace(tmp_fpath, cfpath)
+
+
+def precompress_static(dirs=None):
+	"""Create/refresh compressed siblings for every compressible static file. Already up-to-date ones are skipped."""
+	if dirs is None:
+		dirs = STATIC_DIRS.values()
+	n = 0
+	for dpath in dirs:
+		for root, dnames, fnames in os.walk(dpath):
+			for fname in fnames:
+				if fname.endswith(COMPRESSIBLE_EXTENSIONS):
+					fpath = os.path.join(root, fname)
+					try:
+						compress_file(fpath)
+						# Version computed (and cached) now, not by the first request
+						ZynthianStaticFileHandler.get_version(STATIC_SETTINGS, fpath)
+						n += 1
+					except Exception as e:
+						logging.warning("Can't precompress '{}': {}".format(fpath, e))
+	logging.info("Precompressed static files: {}".format(n))
+
+
+def start_precompress_static():
+	thread = threading.Thread(target=precompress_static, name="precompress_static", daemon=True)
+	thread.start()
+	return thread
+
+# ------------------------------------------------------------------------------
+# Static File Handler
+# ------------------------------------------------------------------------------
+
+
+class ZynthianStaticFileHandler(tornado.web.StaticFileHandler):
+
+	@classmethod
+	def make_static_url(cls, settings, path, include_version=True):
+		"""Versioned URL of an asset, from its URL ("/css/style.css"). URLs out of STATIC_DIRS are returned as they are."""
+		fpath = get_asset_fpath(path)
+		if not include_version or fpath is None:
+			return path
+		version = cls.get_version(settings, fpath)
+		if version:
+			return "{}?v={}".format(path, version)
+		return path
+
+	def is_current_version(self, path):
+		"""True if the request is for the current version of the file (?v=...)"""
+		version = self.get_argument('v', None)
+		return bool(version) and version == self.get_version({'static_path': self.root}, path)
+
+	def get_cache_time(self, path, modified, mime_type):
+		# Any other version => revalidated (ETag / Last-Modified)
+		return self.CACHE_MAX_AGE if self.is_current_version(path) else 0
+
+	def initialize(self, path, default_filename=None):
+		super().initialize(path, default_filename)
+		self.content_encoding = None
+		self.original_path = None
+
+	def validate_absolute_path(self, root, absolute_path):
+		absolute_path = super().validate_absolute_path(root, absolute_path)
+		if absolute_path is None or not absolute_path.endswith(COMPRESSIBLE_EXTENSIONS):
+			return absolute_path
+		for encoding, ext in get_accepted_encodings(self.request.headers.get('Accept-Encoding', '')):
+			cpath = absolute_path + ext
+			try:
+				st = os.stat(cpath)
+				# Stale variants are ignored until regenerated
+				if st.st_mtime_ns >= os.stat(absolute_path).st_mtime_ns:
+					self.content_encoding = encoding
+					self.original_path = absolute_path
+					# Size & modification time must describe the file actually sent
+					self._stat_result = st
+					return cpath
+			except OSError:
+				pass
+		return absolute_path
+
+	def get_content_type(self):
+		if self.original_path:
+			mime_type, encoding = mimetypes.guess_type(self.original_path)
+			if mime_type:
+				return mime_type
+			return "application/octet-stream"
+		return super().get_content_type()
+
+	def set_extra_headers(self, path):
+		if self.content_encoding:
+			self.set_header('Content-Encoding', self.content_encoding)
+		if self.absolute_path.endswith(COMPRESSIBLE_EXTENSIONS) or self.original_path:
+			self.set_header('Vary', 'Accept-Encoding')
+		if self.is_current_version(path):
+			self.set_header('Cache-Control', "public, max-age={}, immutable".format(self.CACHE_MAX_AGE))
+
+
+if __name__ == "__main__":
+	# Install-time precompression: python3 -m lib.static_handler
+	logging.basicConfig(level=logging.INFO)
+	precompress_static()
+
+# ------------------------------------------------------------------------------
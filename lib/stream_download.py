@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Streaming Downloads
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import io
+import os
+import time
+import zipfile
+
+# ------------------------------------------------------------------------------
+# Streaming Downloads
+#
+# Files and zip archives of directories are sent chunk by chunk, waiting for
+# each chunk to be flushed to the client (backpressure), so memory use stays
+# flat and no temporary archive is written to the SD card. Zip archives are
+# generated on the fly, using data descriptors because the output can't be
+# seeked. Already compressed files are stored, not deflated.
+# ------------------------------------------------------------------------------
+
+CHUNK_SIZE = 64 * 1024
+
+STORED_EXTENSIONS = (
+	".zip", ".gz", ".bz2", ".xz", ".7z", ".rar",
+	".ogg", ".oga", ".mp3", ".flac", ".opus", ".m4a",
+	".sf3", ".png", ".jpg", ".jpeg", ".gif"
+)
+
+
+class ZipOutput(io.RawIOBase):
+	"""Unseekable output for ZipFile, holding the generated data until it's taken"""
+
+	def __init__(self):
+		super().__init__()
+		self.chunks = []
+		self.size = 0
+
+	def writable(self):
+		return True
+
+	def write(self, data):
+		self.chunks.append(bytes(data))
+		self.size += len(data)
+		return len(data)
+
+	def take(self):
+		data = b"".join(self.chunks)
+		self.chunks = []
+		self.size = 0
+		return data
+
+
+def set_download_headers(handler, fname, mime_type):
+	handler.set_header('Content-Type', mime_type)
+	handler.set_header("Content-Description", "File Transfer")
+	handler.set_header('Content-Disposition', 'attachment; filename="{}"'.format(fname))
+
+
+async def send_file(handler, fpath, fname=None, mime_type="application/octet-stream"):
+	"""Send a file as attachment, with Content-Length"""
+	if fname is None:
+		fname = os.path.basename(fpath)
+	with open(fpath, 'rb') as f:
+		set_download_headers(handler, fname, mime_type)
+		handler.set_header('Content-Length', os.fstat(f.fileno()).st_size)
+		while True:
+			data = f.read(CHUNK_SIZE)
+			if not data:
+				break
+			handler.write(data)
+			await handler.flush()
+
+
+def get_zip_info(fpath, arcname, st):
+	"""Entry for a file, or a directory if arcname ends with '/'"""
+	# Zip timestamps can't be earlier than 1980
+	zinfo = zipfile.ZipInfo(arcname, time.localtime(max(st.st_mtime, 315532800))[0:6])
+	zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+	if zinfo.is_dir():
+		zinfo.external_attr |= 0x10
+		return zinfo
+	# Known size => ZIP64 extra fields are used only when needed
+	zinfo.file_size = st.st_size
+	if fpath.lower().endswith(STORED_EXTENSIONS):
+		zinfo.compress_type = zipfile.ZIP_STORED
+	else:
+		zinfo.compress_type = zipfile.ZIP_DEFLATED
+	return zinfo
+
+
+async def send_zip(handler, dpath, fname=None):
+	"""Send a zip archive of a directory's content (same layout as shutil.make_archive) as attachment"""
+	if fname is None:
+		fname = os.path.basename(dpath) + ".zip"
+	set_download_headers(handler, fname, "application/zip")
+	out = ZipOutput()
+
+	async def send():
+		handler.write(out.take())
+		await handler.flush()
+
+	with zipfile.ZipFile(out, "w") as zf:
+		for root, dirs, files in os.walk(dpath):
+			dirs.sort()
+			for name in dirs:
+				fpath = os.path.join(root, name)
+				try:
+					zf.writestr(get_zip_info(fpath, os.path.relpath(fpath, dpath) + "/", os.stat(fpath)), b"")
+				except OSError:
+					pass
+			for name in sorted(files):
+				fpath = os.path.join(root, name)
+				try:
+					src = open(fpath, 'rb')
+				except OSError:
+					continue
+				with src, zf.open(get_zip_info(fpath, os.path.relpath(fpath, dpath), os.fstat(src.fileno())), 'w') as dest:
+					while True:
+						data = src.read(CHUNK_SIZE)
+						if not data:
+							break
+						dest.write(data)
+						if out.size >= CHUNK_SIZE:
+							await send()
+		# Central directory is written on close
+	await send()
+
+# ------------------------------------------------------------------------------
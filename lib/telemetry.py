@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# System Telemetry Collector
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import os
+import time
+import socket
+import logging
+from array import array
+
+import psutil
+import tornado.ioloop
+
+# ------------------------------------------------------------------------------
+# Ring Buffer
+# ------------------------------------------------------------------------------
+
+
+class RingBuffer:
+	"""Fixed size circular buffer backed by an array.array"""
+
+	def __init__(self, size, typecode='f'):
+		self.size = size
+		self.data = array(typecode, [0] * size)
+		self.pos = 0
+		self.count = 0
+
+	def append(self, value):
+		self.data[self.pos] = value
+		self.pos = (self.pos + 1) % self.size
+		if self.count < self.size:
+			self.count += 1
+
+	def last(self, default=None):
+		if self.count == 0:
+			return default
+		return self.data[self.pos - 1]
+
+	def get(self, n=None):
+		"""Return the last n values (all by default), oldest first."""
+		if n is None or n > self.count:
+			n = self.count
+		start = self.pos - n
+		if start >= 0:
+			return self.data[start:self.pos].tolist()
+		return self.data[start:].tolist() + self.data[:self.pos].tolist()
+
+# ------------------------------------------------------------------------------
+# System readers (no subprocesses)
+# ------------------------------------------------------------------------------
+
+
+def read_meminfo():
+	info = {}
+	with open("/proc/meminfo") as f:
+		for line in f:
+			parts = line.split()
+			if len(parts) >= 2:
+				info[parts[0][:-1]] = int(parts[1]) * 1024
+	return info
+
+
+def read_cpu_times():
+	with open("/proc/stat") as f:
+		parts = f.readline().split()
+	values = [int(v) for v in parts[1:]]
+	idle = values[3] + (values[4] if len(values) > 4 else 0)
+	return sum(values), idle
+
+
+def read_temperature(zone="/sys/class/thermal/thermal_zone0/temp"):
+	try:
+		with open(zone) as f:
+			return int(f.read().strip()) / 1000.0
+	except (OSError, ValueError):
+		return None
+
+
+def read_throttled(fpath="/sys/devices/platform/soc/soc:firmware/get_throttled"):
+	"""Firmware throttling flags (same as "vcgencmd get_throttled"), or None if not available"""
+	try:
+		with open(fpath) as f:
+			return int(f.read().strip(), 16)
+	except (OSError, ValueError):
+		return None
+
+
+def get_volume_usage(path):
+	st = os.statvfs(path)
+	total = st.f_blocks * st.f_frsize
+	free = st.f_bavail * st.f_frsize
+	used = (st.f_blocks - st.f_bfree) * st.f_frsize
+	return total, used, free
+
+
+def get_ipv4_addresses():
+	ips = []
+	for ifname, addrs in psutil.net_if_addrs().items():
+		if ifname == "lo":
+			continue
+		for addr in addrs:
+			if addr.family == socket.AF_INET:
+				ips.append(addr.address)
+	return ips
+
+
+def get_os_release():
+	try:
+		with open("/etc/os-release") as f:
+			for line in f:
+				if line.startswith("PRETTY_NAME="):
+					return line.split("=", 1)[1].strip().strip('"')
+	except OSError:
+		pass
+	return "???"
+
+
+def format_size(nbytes, suffixes="KMGTP"):
+	"""Human readable size, like "df -h" does."""
+	value = float(nbytes)
+	unit = ""
+	for s in suffixes:
+		if value < 1024:
+			break
+		value /= 1024
+		unit = s
+	if unit and value < 10:
+		return "{:.1f}{}".format(value, unit)
+	return "{:.0f}{}".format(value, unit)
+
+# ------------------------------------------------------------------------------
+# Telemetry Collector
+# ------------------------------------------------------------------------------
+
+
+class TelemetryCollector:
+	"""
+	Samples system state every tick seconds on the event loop. This is the only
+	sampler of /proc & /sys: listeners (i.e. the metrics history) get every
+	sample. Latest values are served to the dashboard from memory and a short
+	history, one value per interval, is kept in ring buffers.
+	"""
+
+	series_names = ("time", "cpu_load", "temperature", "ram_used", "swap_used", "sd_used")
+
+	def __init__(self, interval=5, size=720, tick=1):
+		self.interval = interval
+		self.tick = tick
+		self.series = {name: RingBuffer(size, 'd' if name == "time" else 'f') for name in self.series_names}
+		self.latest = None
+		self.listeners = []
+		self.cpu_times = None
+		# CPU times & time of the last history value
+		self.series_cpu_times = None
+		self.series_ts = None
+		# Disk usage & IPs, read once per interval
+		self.slow = None
+		self.os_release = None
+		self.periodic = None
+
+	def start(self):
+		if self.periodic is None:
+			self.sample()
+			self.periodic = tornado.ioloop.PeriodicCallback(self.sample, self.tick * 1000)
+			self.periodic.start()
+
+	def stop(self):
+		if self.periodic:
+			self.periodic.stop()
+			self.periodic = None
+
+	def add_listener(self, callback):
+		"""
+		Call callback(sample) on every sample, with 'time', 'cpu_load' (None
+		on the first sample), 'temperature' & 'throttled' (None if not
+		available), 'ram_total', 'ram_used', 'ram_free', 'swap_total' &
+		'swap_used' (bytes).
+		"""
+		self.listeners.append(callback)
+
+	@staticmethod
+	def get_cpu_load(cpu_times, prev_cpu_times):
+		if not prev_cpu_times:
+			return None
+		dtotal = cpu_times[0] - prev_cpu_times[0]
+		didle = cpu_times[1] - prev_cpu_times[1]
+		return 100.0 * (dtotal - didle) / dtotal if dtotal > 0 else 0.0
+
+	def sample(self):
+		try:
+			ts = time.time()
+
+			cpu_times = read_cpu_times()
+			cpu_load = self.get_cpu_load(cpu_times, self.cpu_times)
+			self.cpu_times = cpu_times
+
+			mem = read_meminfo()
+			ram_total = mem.get('MemTotal', 0)
+			ram_free = mem.get('MemAvailable', mem.get('MemFree', 0))
+			swap_total = mem.get('SwapTotal', 0)
+
+			sample = {
+				'time': ts,
+				'cpu_load': cpu_load,
+				'temperature': read_temperature(),
+				'throttled': read_throttled(),
+				'ram_total': ram_total,
+				'ram_used': ram_total - ram_free,
+				'ram_free': ram_free,
+				'swap_total': swap_total,
+				'swap_used': swap_total - mem.get('SwapFree', 0)
+			}
+		except Exception as e:
+			logging.error("Can't sample telemetry: {}".format(e))
+			return
+
+		for callback in self.listeners:
+			try:
+				callback(sample)
+			except Exception as e:
+				logging.error("Telemetry listener {} failed => {}".format(callback, e))
+
+		try:
+			# Half a tick of slack, so timer jitter doesn't skip a value
+			if self.series_ts is None or ts - self.series_ts >= self.interval - self.tick / 2:
+				self.update_series(sample)
+			self.latest = dict(sample, cpu_load=cpu_load or 0.0, **self.slow)
+		except Exception as e:
+			logging.error("Can't sample telemetry: {}".format(e))
+
+	def update_series(self, sample):
+		"""Read the slower sources & add a value to the history, averaging the CPU load over the interval"""
+		sd_total, sd_used, sd_free = get_volume_usage("/")
+		self.slow = {
+			'sd_total': sd_total,
+			'sd_used': sd_used,
+			'sd_free': sd_free,
+			'ips': get_ipv4_addresses()
+		}
+
+		ts = sample['time']
+		cpu_load = self.get_cpu_load(self.cpu_times, self.series_cpu_times)
+		if cpu_load is None:
+			cpu_load = sample['cpu_load'] or 0.0
+		self.series_cpu_times = self.cpu_times
+		self.series_ts = ts
+
+		temperature = sample['temperature']
+		self.series['time'].append(ts)
+		self.series['cpu_load'].append(cpu_load)
+		self.series['temperature'].append(temperature if temperature is not None else float('nan'))
+		self.series['ram_used'].append(sample['ram_used'] / 1048576)
+		self.series['swap_used'].append(sample['swap_used'] / 1048576)
+		self.series['sd_used'].append(sd_used / 1048576)
+
+	def get_latest(self):
+		# Not started (or first sample failed) => sample on demand
+		if self.latest is None:
+			self.sample()
+		return self.latest
+
+	def get_history(self, name, n=None):
+		return self.series[name].get(n)
+
+	def get_os_info(self):
+		if self.os_release is None:
+			self.os_release = get_os_release()
+		return self.os_release
+
+
+telemetry = TelemetryCollector()
+
+# ------------------------------------------------------------------------------
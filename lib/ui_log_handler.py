@@ -34,6 +34,7 @@ from multiprocessing import Queue
 from subprocess import check_output
 from lib.tail_thread import TailThread, AsynchronousFileReader
 
+from lib.service_status import service_status
 from lib.zynthian_config_handler import ZynthianBasicHandler
 from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, ZynthianWebSocketMessage
 
@@ -136,6 +137,7 @@ class UiLogMessageHandler(ZynthianWebSocketMessageHandler):
 			max_trials -= 1
 
 		check_output("(systemctl start %s)&" % next_service, shell=True)
+		service_status.invalidate()
 
 
 	def do_start_debug_logging(self):
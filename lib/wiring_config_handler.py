@@ -26,12 +26,12 @@ import os
 import re
 import logging
 import tornado.web
-from subprocess import check_output
 
 from zyngui.zynthian_gui import zynthian_gui
 from zynconf import CustomSwitchActionType, ZynSensorActionType
 
-from lib.dashboard_handler import DashboardHandler
+from lib.async_subprocess import check_output
+from lib.i2c_inventory import i2c_inventory
 from lib.zynthian_config_handler import ZynthianConfigHandler
 
 
@@ -40,15 +40,22 @@ from lib.zynthian_config_handler import ZynthianConfigHandler
 # ------------------------------------------------------------------------------
 
 
-ADS1115_I2C_ADDRESS = ""
-MCP4728_I2C_ADDRESS = ""
+# Preset values replaced by the autodetected chip address, taken from the
+# cached I2C inventory.
+ADS1115_AUTODETECT = "@ADS1115"
+MCP4728_AUTODETECT = "@MCP4728"
 
-for i2chip in DashboardHandler.get_i2c_chips():
-	parts = i2chip.split('@')
-	if parts[0] == 'ADS1115':
-		ADS1115_I2C_ADDRESS = parts[1]
-	elif parts[0] == 'MCP4728':
-		MCP4728_I2C_ADDRESS = parts[1]
+
+async def get_zynaptik_i2c_addresses():
+	addresses = {'ADS1115': "", 'MCP4728': ""}
+	try:
+		for i2chip in await i2c_inventory.get_chips():
+			parts = i2chip.split('@')
+			if parts[0] in addresses:
+				addresses[parts[0]] = parts[1]
+	except Exception as e:
+		logging.error("Can't detect I2C chips: {}".format(e))
+	return addresses
 
 # ------------------------------------------------------------------------------
 # Wiring Configuration
@@ -57,6 +64,9 @@ for i2chip in DashboardHandler.get_i2c_chips():
 
 class WiringConfigHandler(ZynthianConfigHandler):
 	PROFILES_DIRECTORY = "{}/wiring-profiles".format(os.environ.get("ZYNTHIAN_CONFIG_DIR"))
+	rebuild_zyncoder_flag = False
+	resolved_wiring_presets = None
+	resolved_wiring_presets_version = None
 
 	wiring_presets = {
 		"MINI_V2": {
@@ -78,8 +88,8 @@ class WiringConfigHandler(ZynthianConfigHandler):
 			'ZYNTHIAN_WIRING_MCP23017_INTA_PIN': "",
 			'ZYNTHIAN_WIRING_MCP23017_INTB_PIN': "",
 			'ZYNTHIAN_WIRING_ZYNAPTIK_CONFIG': "Zynface-V5 (16xDIO + 4xAD + 4xDA)",
-			'ZYNTHIAN_WIRING_ZYNAPTIK_ADS1115_I2C_ADDRESS': ADS1115_I2C_ADDRESS,
-			'ZYNTHIAN_WIRING_ZYNAPTIK_MCP4728_I2C_ADDRESS': MCP4728_I2C_ADDRESS,
+			'ZYNTHIAN_WIRING_ZYNAPTIK_ADS1115_I2C_ADDRESS': ADS1115_AUTODETECT,
+			'ZYNTHIAN_WIRING_ZYNAPTIK_MCP4728_I2C_ADDRESS': MCP4728_AUTODETECT,
 			'ZYNTHIAN_WIRING_ZYNTOF_CONFIG': "",
 			'ZYNTHIAN_WIRING_LAYOUT_CUSTOM_PROFILE': 'v5_zynface'
 		},
@@ -139,8 +149,8 @@ class WiringConfigHandler(ZynthianConfigHandler):
 			'ZYNTHIAN_WIRING_MCP23017_INTA_PIN': "27",
 			'ZYNTHIAN_WIRING_MCP23017_INTB_PIN': "25",
 			'ZYNTHIAN_WIRING_ZYNAPTIK_CONFIG': "Zynaptik-3 (4xAD + 4xDA)",
-			'ZYNTHIAN_WIRING_ZYNAPTIK_ADS1115_I2C_ADDRESS': ADS1115_I2C_ADDRESS,
-			'ZYNTHIAN_WIRING_ZYNAPTIK_MCP4728_I2C_ADDRESS': MCP4728_I2C_ADDRESS,
+			'ZYNTHIAN_WIRING_ZYNAPTIK_ADS1115_I2C_ADDRESS': ADS1115_AUTODETECT,
+			'ZYNTHIAN_WIRING_ZYNAPTIK_MCP4728_I2C_ADDRESS': MCP4728_AUTODETECT,
 			'ZYNTHIAN_WIRING_ZYNTOF_CONFIG': "2",
 			'ZYNTHIAN_WIRING_LAYOUT_CUSTOM_PROFILE': 'v4_studio'
 		},
@@ -152,8 +162,8 @@ class WiringConfigHandler(ZynthianConfigHandler):
 			'ZYNTHIAN_WIRING_MCP23017_INTA_PIN': "27",
 			'ZYNTHIAN_WIRING_MCP23017_INTB_PIN': "25",
 			'ZYNTHIAN_WIRING_ZYNAPTIK_CONFIG': "Zynaptik-3 (4xAD + 4xDA)",
-			'ZYNTHIAN_WIRING_ZYNAPTIK_ADS1115_I2C_ADDRESS': ADS1115_I2C_ADDRESS,
-			'ZYNTHIAN_WIRING_ZYNAPTIK_MCP4728_I2C_ADDRESS': MCP4728_I2C_ADDRESS,
+			'ZYNTHIAN_WIRING_ZYNAPTIK_ADS1115_I2C_ADDRESS': ADS1115_AUTODETECT,
+			'ZYNTHIAN_WIRING_ZYNAPTIK_MCP4728_I2C_ADDRESS': MCP4728_AUTODETECT,
 			'ZYNTHIAN_WIRING_ZYNTOF_CONFIG': "",
 			'ZYNTHIAN_WIRING_LAYOUT_CUSTOM_PROFILE': 'v4_studio'
 		},
@@ -165,8 +175,8 @@ class WiringConfigHandler(ZynthianConfigHandler):
 			'ZYNTHIAN_WIRING_MCP23017_INTA_PIN': "2",
 			'ZYNTHIAN_WIRING_MCP23017_INTB_PIN': "7",
 			'ZYNTHIAN_WIRING_ZYNAPTIK_CONFIG': "Zynaptik-2 (16xDIO + 4xAD + 4xDA)",
-			'ZYNTHIAN_WIRING_ZYNAPTIK_ADS1115_I2C_ADDRESS': ADS1115_I2C_ADDRESS,
-			'ZYNTHIAN_WIRING_ZYNAPTIK_MCP4728_I2C_ADDRESS': MCP4728_I2C_ADDRESS,
+			'ZYNTHIAN_WIRING_ZYNAPTIK_ADS1115_I2C_ADDRESS': ADS1115_AUTODETECT,
+			'ZYNTHIAN_WIRING_ZYNAPTIK_MCP4728_I2C_ADDRESS': MCP4728_AUTODETECT,
 			'ZYNTHIAN_WIRING_ZYNTOF_CONFIG': "2",
 			'ZYNTHIAN_WIRING_LAYOUT_CUSTOM_PROFILE': 'v4_studio'
 		},
@@ -178,8 +188,8 @@ class WiringConfigHandler(ZynthianConfigHandler):
 			'ZYNTHIAN_WIRING_MCP23017_INTA_PIN': "2",
 			'ZYNTHIAN_WIRING_MCP23017_INTB_PIN': "7",
 			'ZYNTHIAN_WIRING_ZYNAPTIK_CONFIG': "Zynaptik-2 (16xDIO + 4xAD + 4xDA)",
-			'ZYNTHIAN_WIRING_ZYNAPTIK_ADS1115_I2C_ADDRESS': ADS1115_I2C_ADDRESS,
-			'ZYNTHIAN_WIRING_ZYNAPTIK_MCP4728_I2C_ADDRESS': MCP4728_I2C_ADDRESS,
+			'ZYNTHIAN_WIRING_ZYNAPTIK_ADS1115_I2C_ADDRESS': ADS1115_AUTODETECT,
+			'ZYNTHIAN_WIRING_ZYNAPTIK_MCP4728_I2C_ADDRESS': MCP4728_AUTODETECT,
 			'ZYNTHIAN_WIRING_ZYNTOF_CONFIG': "",
 			'ZYNTHIAN_WIRING_LAYOUT_CUSTOM_PROFILE': 'v4_studio'
 		},
@@ -365,8 +375,8 @@ class WiringConfigHandler(ZynthianConfigHandler):
 			'ZYNTHIAN_WIRING_ZYNTOF_CONFIG': ""
 		},
 		"CUSTOM": {
-			'ZYNTHIAN_WIRING_ZYNAPTIK_ADS1115_I2C_ADDRESS': ADS1115_I2C_ADDRESS,
-			'ZYNTHIAN_WIRING_ZYNAPTIK_MCP4728_I2C_ADDRESS': MCP4728_I2C_ADDRESS
+			'ZYNTHIAN_WIRING_ZYNAPTIK_ADS1115_I2C_ADDRESS': ADS1115_AUTODETECT,
+			'ZYNTHIAN_WIRING_ZYNAPTIK_MCP4728_I2C_ADDRESS': MCP4728_AUTODETECT
 		}
 	}
 
@@ -384,15 +394,17 @@ class WiringConfigHandler(ZynthianConfigHandler):
 			cuia_param = ""
 		return cuia_name, cuia_param
 
-	def prepare(self):
-		super().prepare()
+	async def prepare(self):
+		await super().prepare()
 		self.current_custom_profile = os.environ.get('ZYNTHIAN_WIRING_LAYOUT_CUSTOM_PROFILE', "")
 		self.load_custom_profiles()
 
 
 	@tornado.web.authenticated
-	def get(self, errors=None):
+	async def get(self, errors=None):
 		config = {}
+		wiring_presets = await self.get_wiring_presets()
+		i2c_addr = await get_zynaptik_i2c_addresses()
 
 		if os.environ.get('ZYNTHIAN_KIT_VERSION') != 'Custom':
 			custom_options_disabled = True
@@ -412,11 +424,21 @@ class WiringConfigHandler(ZynthianConfigHandler):
 			'type': 'select',
 			'title': 'Wiring Layout',
 			'value': wiring_layout,
-			'options': list(self.wiring_presets.keys()),
-			'presets': self.wiring_presets,
+			'options': list(wiring_presets.keys()),
+			'presets': wiring_presets,
 			'disabled': custom_options_disabled,
 			'refresh_on_change': True,
-			'div_class': "col-sm-12"
+			'div_class': "col-sm-10 col-xs-12"
+		}
+		config['zynthian_wiring_i2c_rescan_script'] = {
+			'type': 'button',
+			'title': 'Rescan I2C',
+			'button_type': 'button',
+			'class': 'btn-theme btn-block',
+			'icon' : 'fa fa-refresh',
+			'script_file': 'wiring_i2c_rescan.js',
+			'div_class': "col-sm-2 col-xs-12",
+			'inline': 1
 		}
 
 		if wiring_layout.startswith("Z2"):
@@ -574,7 +596,7 @@ class WiringConfigHandler(ZynthianConfigHandler):
 			config['ZYNTHIAN_WIRING_ZYNAPTIK_ADS1115_I2C_ADDRESS'] = {
 				'type': 'select',
 				'title': "ADS1115 I2C Address",
-				'value': os.environ.get('ZYNTHIAN_WIRING_ZYNAPTIK_ADS1115_I2C_ADDRESS', ADS1115_I2C_ADDRESS),
+				'value': os.environ.get('ZYNTHIAN_WIRING_ZYNAPTIK_ADS1115_I2C_ADDRESS', i2c_addr['ADS1115']),
 				'options': ['', '0x48', '0x49', '0x4A', '0x4B'],
 				'advanced': True,
 				'disabled': custom_options_disabled,
@@ -583,7 +605,7 @@ class WiringConfigHandler(ZynthianConfigHandler):
 			config['ZYNTHIAN_WIRING_ZYNAPTIK_MCP4728_I2C_ADDRESS'] = {
 				'type': 'select',
 				'title': "MCP4728 I2C Address",
-				'value': os.environ.get('ZYNTHIAN_WIRING_ZYNAPTIK_MCP4728_I2C_ADDRESS', MCP4728_I2C_ADDRESS),
+				'value': os.environ.get('ZYNTHIAN_WIRING_ZYNAPTIK_MCP4728_I2C_ADDRESS', i2c_addr['MCP4728']),
 				'options': ['', '0x60', '0x61', '0x62', '0x63', '0x64', '0x65', '0x66', '0x67'],
 				'advanced': True,
 				'disabled': custom_options_disabled,
@@ -596,11 +618,11 @@ class WiringConfigHandler(ZynthianConfigHandler):
 			}
 			config['ZYNTHIAN_WIRING_ZYNAPTIK_ADS1115_I2C_ADDRESS'] = {
 				'type': 'hidden',
-				'value': os.environ.get('ZYNTHIAN_WIRING_ZYNAPTIK_ADS1115_I2C_ADDRESS', ADS1115_I2C_ADDRESS)
+				'value': os.environ.get('ZYNTHIAN_WIRING_ZYNAPTIK_ADS1115_I2C_ADDRESS', i2c_addr['ADS1115'])
 			}
 			config['ZYNTHIAN_WIRING_ZYNAPTIK_MCP4728_I2C_ADDRESS'] = {
 				'type': 'hidden',
-				'value': os.environ.get('ZYNTHIAN_WIRING_ZYNAPTIK_MCP4728_I2C_ADDRESS', MCP4728_I2C_ADDRESS)
+				'value': os.environ.get('ZYNTHIAN_WIRING_ZYNAPTIK_MCP4728_I2C_ADDRESS', i2c_addr['MCP4728'])
 			}
 
 		if zyntof_config_flag:
@@ -1071,7 +1093,7 @@ class WiringConfigHandler(ZynthianConfigHandler):
 
 
 	@tornado.web.authenticated
-	def post(self):
+	async def post(self):
 		command = self.get_argument('_command', '')
 		logging.info("COMMAND = {}".format(command))
 		self.request_data = self.get_request_data()
@@ -1095,6 +1117,10 @@ class WiringConfigHandler(ZynthianConfigHandler):
 			self.current_custom_profile = fname
 			self.load_custom_profiles()
 			self.config_env(self.request_data)
+		elif command == "RESCAN_I2C":
+			errors = None
+			await i2c_inventory.rescan()
+			self.config_env(self.request_data)
 		elif command == "DELETE":
 			fname = self.get_argument('ZYNTHIAN_WIRING_LAYOUT_CUSTOM_PROFILE', '')
 			errors = self.delete_custom_profile(fname)
@@ -1103,8 +1129,10 @@ class WiringConfigHandler(ZynthianConfigHandler):
 			self.config_env(self.request_data)
 		else:
 			errors = self.update_config(self.request_data)
+			if self.rebuild_zyncoder_flag:
+				await self.rebuild_zyncoder()
 
-		self.get(errors)
+		await self.get(errors)
 
 
 	def get_request_data(self):
@@ -1148,11 +1176,18 @@ class WiringConfigHandler(ZynthianConfigHandler):
 				self.restart_ui_flag = True
 				break
 
+		# Different hardware may be attached => detect I2C chips again
+		try:
+			if data['ZYNTHIAN_WIRING_LAYOUT'][0] != os.environ.get('ZYNTHIAN_WIRING_LAYOUT'):
+				i2c_inventory.invalidate()
+		except KeyError:
+			pass
+
 		errors = super().update_config(data)
 
-		if self.restart_ui_flag:
-			self.rebuild_zyncoder()
-		else:
+		# Rebuilding is awaited by the caller, so it doesn't block the event loop
+		self.rebuild_zyncoder_flag = self.restart_ui_flag
+		if not self.restart_ui_flag:
 			self.reload_wiring_layout_flag = True
 
 		if self.reboot_flag:
@@ -1314,11 +1349,25 @@ class WiringConfigHandler(ZynthianConfigHandler):
 			logging.warning("Can't delete wiring custom profile '{}': {}".format(fpath, e))
 
 
+	# Return wiring presets with autodetected I2C addresses filled in
+	@classmethod
+	async def get_wiring_presets(cls):
+		i2c_addr = await get_zynaptik_i2c_addresses()
+		# Resolved again after every I2C rescan
+		if cls.resolved_wiring_presets is None or cls.resolved_wiring_presets_version != i2c_inventory.version:
+			autodetect = {ADS1115_AUTODETECT: i2c_addr['ADS1115'], MCP4728_AUTODETECT: i2c_addr['MCP4728']}
+			cls.resolved_wiring_presets = {
+				name: {k: autodetect.get(v, v) for k, v in preset.items()} for name, preset in cls.wiring_presets.items()
+			}
+			cls.resolved_wiring_presets_version = i2c_inventory.version
+		return cls.resolved_wiring_presets
+
+
 	@classmethod
-	def rebuild_zyncoder(cls):
+	async def rebuild_zyncoder(cls):
 		try:
 			cmd="cd %s/zyncoder/build;cmake ..;make" % os.environ.get('ZYNTHIAN_DIR')
-			check_output(cmd, shell=True)
+			await check_output(cmd, timeout=600)
 		except Exception as e:
 			logging.error("Rebuilding Zyncoder Library: %s" % e)
 
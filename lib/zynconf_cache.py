@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# ********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Zynconf Config Cache
+#
+# Copyright (C) 2024 Fernando Moyano <jofemodo@zynthian.org>
+#
+# ********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+# ********************************************************************
+
+import os
+import logging
+import threading
+
+import zynconf
+from lib.metrics import metrics
+
+# ------------------------------------------------------------------------------
+# Zynconf Config Cache
+# ------------------------------------------------------------------------------
+
+
+class ZynconfCache:
+	"""
+	Keeps the parsed envars & MIDI profile in memory, reloading them only
+	when the files change (inode, size or mtime). Cached values are applied
+	to os.environ on every load, so handlers see the same environment as if
+	zynconf had re-parsed the files.
+	"""
+
+	def __init__(self):
+		self.lock = threading.RLock()
+		self.config = None
+		self.config_key = None
+		self.midi_config = None
+		self.midi_fpath = None
+		self.midi_key = None
+
+	@staticmethod
+	def get_file_key(fpath):
+		try:
+			st = os.stat(fpath)
+			return st.st_ino, st.st_size, st.st_mtime_ns
+		except OSError:
+			return None
+
+	@staticmethod
+	def set_env(config):
+		for vn, val in config.items():
+			os.environ[vn] = val
+
+	def load_config(self):
+		with self.lock:
+			fpath = zynconf.get_config_fpath()
+			key = self.get_file_key(fpath)
+			if self.config is None or key is None or key != self.config_key:
+				logging.debug("Loading config from '{}'".format(fpath))
+				# Stat before reading, so a concurrent write invalidates on next call
+				self.config = zynconf.load_config(set_env=True, fpath=fpath)
+				self.config_key = key
+			else:
+				self.set_env(self.config)
+			return self.config
+
+	def load_midi_config(self):
+		with self.lock:
+			fpath = zynconf.get_midi_config_fpath()
+			key = self.get_file_key(fpath)
+			if self.midi_config is None or key is None or key != self.midi_key or fpath != self.midi_fpath:
+				logging.debug("Loading MIDI config from '{}'".format(fpath))
+				self.midi_config = zynconf.load_midi_config(set_env=True, fpath=fpath)
+				self.midi_fpath = fpath
+				self.midi_key = key
+			else:
+				self.set_env(self.midi_config)
+			return self.midi_config
+
+	def save_config(self, config, updsys=False):
+		with self.lock:
+			fpath = zynconf.get_config_fpath()
+			prev_key = self.get_file_key(fpath)
+			with metrics.timed("zynconf"):
+				errors = zynconf.save_config(config, updsys=updsys)
+			# Update cached values in place if the cache was in sync with the file before saving
+			if self.config is not None and prev_key is not None and prev_key == self.config_key:
+				self.config.update({vn: str(val) for vn, val in config.items()})
+				self.config_key = self.get_file_key(fpath)
+			else:
+				self.invalidate()
+			return errors
+
+	def invalidate(self):
+		with self.lock:
+			self.config = None
+			self.config_key = None
+			self.midi_config = None
+			self.midi_fpath = None
+			self.midi_key = None
+
+
+zynconf_cache = ZynconfCache()
+
+# ------------------------------------------------------------------------------
@@ -23,13 +23,19 @@
 #********************************************************************
 
 import os
+import time
 import liblo
 import logging
+import asyncio
 import tornado.web
-from time import sleep
-from subprocess import check_output
+import tornado.escape
+import tornado.ioloop
 
 import zynconf
+from lib.zynconf_cache import zynconf_cache
+from lib.service_status import service_status
+from lib.async_subprocess import check_output
+from lib.metrics import metrics, current_route
 
 #Avoid unwanted debug messages from zynconf module
 zynconf_logger = logging.getLogger('zynconf')
@@ -41,11 +47,53 @@ zynconf_logger.setLevel(logging.INFO)
 
 zynthian_ui_osc_addr = liblo.Address('localhost', 1370,liblo.UDP)
 
+#------------------------------------------------------------------------------
+# Zynthian Auth Handler
+#------------------------------------------------------------------------------
+
+class ZynthianAuthHandler(tornado.web.RequestHandler):
+	"""
+	Base of the handlers needing login but not the zynthian config (JSON APIs,
+	downloads, ...): same session cookie check & request metrics as
+	ZynthianBasicHandler.
+	"""
+
+	# Request metrics. Requests can fail before prepare() is called (i.e. 405, bad path arguments).
+	metrics_ts = None
+	bytes_sent = 0
+
+
+	def get_current_user(self):
+		return self.get_secure_cookie("user", max_age_days=5200)
+
+
+	def prepare(self):
+		self.metrics_ts = time.monotonic()
+		current_route.set(type(self).__name__)
+
+
+	def on_finish(self):
+		if self.metrics_ts is not None:
+			latency = time.monotonic() - self.metrics_ts
+		else:
+			latency = self.request.request_time()
+		metrics.observe_request(type(self).__name__, self.request.method, self.get_status(), latency, self.bytes_sent)
+
+
+	def write(self, chunk):
+		if isinstance(chunk, dict):
+			# Encoded here, as tornado does, so its size can be counted
+			self.set_header("Content-Type", "application/json; charset=UTF-8")
+			chunk = tornado.escape.json_encode(chunk)
+		chunk = tornado.escape.utf8(chunk)
+		self.bytes_sent += len(chunk)
+		super().write(chunk)
+
 #------------------------------------------------------------------------------
 # Zynthian Basic Handler
 #------------------------------------------------------------------------------
 
-class ZynthianBasicHandler(tornado.web.RequestHandler):
+class ZynthianBasicHandler(ZynthianAuthHandler):
 
 	reboot_flag = False
 	restart_ui_flag = False
@@ -59,13 +107,12 @@ class ZynthianBasicHandler(tornado.web.RequestHandler):
 	reboot_flag_fpath = "/tmp/zynthian_reboot"
 
 
-	def get_current_user(self):
-		return self.get_secure_cookie("user", max_age_days=5200)
-
+	async def prepare(self):
+		super().prepare()
 
-	def prepare(self):
-		zynconf.load_config()
-		zynconf.load_midi_config()
+		with metrics.timed("zynconf"):
+			zynconf_cache.load_config()
+			zynconf_cache.load_midi_config()
 
 		self.read_reboot_flag()
 		self.genjson=False
@@ -78,7 +125,11 @@ class ZynthianBasicHandler(tornado.web.RequestHandler):
 		# Send NOP CUIA to wake-up zynthian
 		liblo.send(zynthian_ui_osc_addr, "/CUIA/NOP")
 
+		# A service was started/stopped => don't show its previous state
+		await service_status.wait_fresh()
+
 	def on_finish(self):
+		super().on_finish()
 		if self.restart_webconf_flag:
 			self.restart_webconf()
 
@@ -130,37 +181,57 @@ class ZynthianBasicHandler(tornado.web.RequestHandler):
 			self.render("config.html", body=body, config=config, title=title, errors=errors)
 
 
-	def is_service_active(self, service):
-		return zynconf.is_service_active(service)
+	@staticmethod
+	def is_service_active(service):
+		return service_status.is_active(service)
+
+
+	@staticmethod
+	def run_background(coro_func):
+		# Not awaited => the response is sent meanwhile. Errors are logged by the coroutine.
+		tornado.ioloop.IOLoop.current().spawn_callback(coro_func)
 
 
 	def power_off(self):
+		self.run_background(self.do_power_off)
+
+
+	async def do_power_off(self):
 		try:
 			if self.is_service_active("zynthian"):
 				liblo.send(zynthian_ui_osc_addr, "/CUIA/POWER_OFF", ("s", "CONFIRM"))
-				sleep(5)
-			check_output("killall -SIGQUIT zynthian_gui.py; sleep 5; poweroff", shell=True)
+				await asyncio.sleep(5)
+			await check_output("killall -SIGQUIT zynthian_gui.py; sleep 5; poweroff", timeout=None)
 		except Exception as e:
 			logging.error("Power Off: {}".format(e))
 
 
 	def reboot(self):
+		self.reboot_flag = False
+		self.run_background(self.do_reboot)
+
+
+	async def do_reboot(self):
 		try:
-			self.reboot_flag = False
 			if os.path.isfile(self.reboot_flag_fpath):
 				os.remove(self.reboot_flag_fpath)
 			if self.is_service_active("zynthian"):
 				liblo.send(zynthian_ui_osc_addr, "/CUIA/REBOOT", ("s", "CONFIRM"))
-				sleep(5)
-			check_output("killall -SIGINT zynthian_gui.py; sleep 5; reboot", shell=True)
+				await asyncio.sleep(5)
+			await check_output("killall -SIGINT zynthian_gui.py; sleep 5; reboot", timeout=None)
 		except Exception as e:
 			logging.error("Reboot: {}".format(e))
 
 
 	def restart_ui(self):
+		self.restart_ui_flag = False
+		self.run_background(self.do_restart_ui)
+
+
+	async def do_restart_ui(self):
 		try:
-			check_output("systemctl restart zynthian", shell=True)
-			self.restart_ui_flag = False
+			await check_output("systemctl restart zynthian", timeout=None)
+			service_status.invalidate()
 			if os.path.isfile(self.restart_ui_flag_fpath):
 				os.remove(self.restart_ui_flag_fpath)
 		except Exception as e:
@@ -168,9 +239,13 @@ class ZynthianBasicHandler(tornado.web.RequestHandler):
 
 
 	def restart_webconf(self):
+		self.restart_webconf_flag = False
+		self.run_background(self.do_restart_webconf)
+
+
+	async def do_restart_webconf(self):
 		try:
-			check_output("systemctl restart zynthian-webconf", shell=True)
-			self.restart_webconf_flag = False
+			await check_output("systemctl restart zynthian-webconf", timeout=None)
 			if os.path.isfile(self.restart_webconf_flag_fpath):
 				os.remove(self.restart_webconf_flag_fpath)
 		except Exception as e:
@@ -193,11 +268,11 @@ class ZynthianBasicHandler(tornado.web.RequestHandler):
 
 
 	def persist_update_sys_flag(self):
-		check_output("touch /zynthian_update_sys", shell=True)
+		open("/zynthian_update_sys", "a").close()
 
 
 	def persist_reboot_flag(self):
-		check_output(f"touch {self.reboot_flag_fpath}", shell=True)
+		open(self.reboot_flag_fpath, "a").close()
 
 
 	def read_reboot_flag(self):
@@ -208,6 +283,7 @@ class ZynthianBasicHandler(tornado.web.RequestHandler):
 	def update_sys(cls):
 		try:
 			zynconf.update_sys()
+			service_status.invalidate()
 			if os.path.isfile("/zynthian_update_sys"):
 				os.remove("/zynthian_update_sys")
 		except Exception as e:
@@ -231,7 +307,7 @@ class ZynthianConfigHandler(ZynthianBasicHandler):
 			if vn[0]!='_':
 				sconfig[vn]=config[vn][0]
 
-		zynconf.save_config(sconfig, updsys=True)
+		zynconf_cache.save_config(sconfig, updsys=True)
 
 
 	def config_env(self, config):
@@ -22,19 +22,36 @@
 #
 # ********************************************************************
 
+import time
 import logging
 import asyncio
 import jsonpickle
 import tornado.websocket
 
+from lib.metrics import metrics
+from lib.lazy_handler import timed_import
+
 # ------------------------------------------------------------------------------
 # Zynthian Websocket Handling
 # ------------------------------------------------------------------------------
 
+# handler_name => module defining the message handler, imported on first use
+message_handler_modules = {}
+
+
+def register_message_handler_module(handler_name, module_name):
+	message_handler_modules[handler_name] = module_name
+
+
 def ZynthianWebSocketMessageHandlerFactory(handler_name, websocket):
 	for cls in ZynthianWebSocketMessageHandler.__subclasses__():
 		if cls.is_registered_for(handler_name):
 			return cls(handler_name, websocket)
+	# Message handlers register by subclassing => load the lazy module & retry
+	module_name = message_handler_modules.pop(handler_name, None)
+	if module_name:
+		timed_import(module_name)
+		return ZynthianWebSocketMessageHandlerFactory(handler_name, websocket)
 	raise ValueError
 
 
@@ -77,7 +94,6 @@ class ZynthianWebSocketMessage(object):
 
 
 class ZynthianWebSocketHandler(tornado.websocket.WebSocketHandler):
-	handlers = []
 
 	def check_origin(self, origin):
 		return True
@@ -85,18 +101,28 @@ class ZynthianWebSocketHandler(tornado.websocket.WebSocketHandler):
 	# the client connected
 	def open(self):
 		logging.info("New client connected to ZynthianWebSocketHandler")
+		# handler_name => message handler of this connection, reused for every
+		# message to it & closed when the client disconnects
+		self.handlers = {}
 
 	# the client sent the message
 	def on_message(self, message):
 		if message:
+			ts = time.monotonic()
 			decoded_message = jsonpickle.decode(message)
 			logging.info("incoming ws message %s " % decoded_message)
-			handler = ZynthianWebSocketMessageHandlerFactory(decoded_message['handler_name'], self)
+			handler_name = decoded_message['handler_name']
+			try:
+				handler = self.handlers[handler_name]
+			except KeyError:
+				handler = ZynthianWebSocketMessageHandlerFactory(handler_name, self)
+				self.handlers[handler_name] = handler
 			handler.on_websocket_message(decoded_message['data'])
-			self.handlers.append(handler)
+			metrics.observe_ws_message(handler_name, time.monotonic() - ts)
 
 	# client disconnected
 	def on_close(self):
 		logging.info("Client disconnected")
-		for handler in self.handlers:
+		for handler in self.handlers.values():
 			handler.on_close()
+		self.handlers.clear()
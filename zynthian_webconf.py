@@ -35,38 +35,81 @@ import tornado_xstatic
 from terminado import TermSocket, SingleTermManager
 
 sys.path.append(os.environ.get('ZYNTHIAN_UI_DIR'))
-from zyncoder.zyncore import lib_zyncore_init_minimal
-lib_zyncore_init_minimal()
+
+from lib.lazy_handler import timed_import, lazy_handler, log_import_report
+timed_import("zyncoder.zyncore").lib_zyncore_init_minimal()
+
+# Background services, timed one by one (dependencies first) for the import report
+telemetry = timed_import("lib.telemetry").telemetry
+git_info = timed_import("lib.git_info").git_info
+library_index = timed_import("lib.library_index").library_index
+i2c_inventory = timed_import("lib.i2c_inventory").i2c_inventory
+metrics_history = timed_import("lib.metrics_history").metrics_history
+jack_monitor = timed_import("lib.jack_monitor").jack_monitor
+snapshot_index = timed_import("lib.snapshot_index").snapshot_index
+snapshot_migration = timed_import("lib.snapshot_migration").snapshot_migration
+preset_search = timed_import("lib.preset_search").preset_search
+service_status = timed_import("lib.service_status").service_status
 
 from lib.login_handler import LoginHandler, LogoutHandler
-from lib.dashboard_handler import DashboardHandler
-from lib.audio_config_handler import AudioConfigHandler
-from lib.display_config_handler import DisplayConfigHandler
-from lib.reboot_handler import RebootHandler
-from lib.reboot_handler import RebootConfirmedHandler
-from lib.poweroff_handler import PoweroffHandler
-from lib.security_config_handler import SecurityConfigHandler
-from lib.ui_config_handler import UiConfigHandler
-from lib.ui_keybind_handler import UiKeybindHandler
-from lib.kit_config_handler import KitConfigHandler
-from lib.wiring_config_handler import WiringConfigHandler
-from lib.hwoptions_config_handler import HWOptionsConfigHandler
-from lib.wifi_config_handler import WifiConfigHandler
-from lib.snapshot_config_handler import SnapshotConfigHandler, SnapshotRemoveOptionHandler, SnapshotAddOptionsHandler, SnapshotDownloadHandler, SnapshotRemoveChainHandler
-from lib.midi_config_handler import MidiConfigHandler
-from lib.upload_handler import UploadHandler
-from lib.system_backup_handler import SystemBackupHandler
-from lib.software_update_handler import SoftwareUpdateHandler
-from lib.presets_config_handler import PresetsConfigHandler
-from lib.zynthian_websocket_handler import ZynthianWebSocketHandler
-from lib.pianoteq_handler import PianoteqHandler
-from lib.captures_config_handler import CapturesConfigHandler
-from lib.engines_handler import EnginesHandler
-from lib.ui_log_handler import UiLogHandler
-from lib.midi_log_handler import MidiLogHandler
-from lib.repository_handler import RepositoryHandler
-from lib.audio_mixer_handler import AudioConfigMessageHandler, AudioMixerHandler
+from lib.zynthian_websocket_handler import ZynthianWebSocketHandler, register_message_handler_module
 from lib.zynterm_handler import ZyntermHandler
+from lib.metrics_handler import MetricsHandler, MetricsHistoryHandler
+from lib.static_handler import ZynthianStaticFileHandler, asset_url, start_precompress_static
+
+# ------------------------------------------------------------------------------
+# Lazy loaded handlers
+#
+# Handler modules pull zyngui/zyngine, jack, mido, etc. and some of them probe
+# hardware. They are imported on the first request to their URL instead of at
+# startup.
+# ------------------------------------------------------------------------------
+
+DashboardHandler = lazy_handler("lib.dashboard_handler", "DashboardHandler")
+AudioConfigHandler = lazy_handler("lib.audio_config_handler", "AudioConfigHandler")
+DisplayConfigHandler = lazy_handler("lib.display_config_handler", "DisplayConfigHandler")
+RebootHandler = lazy_handler("lib.reboot_handler", "RebootHandler")
+RebootConfirmedHandler = lazy_handler("lib.reboot_handler", "RebootConfirmedHandler")
+PoweroffHandler = lazy_handler("lib.poweroff_handler", "PoweroffHandler")
+SecurityConfigHandler = lazy_handler("lib.security_config_handler", "SecurityConfigHandler")
+UiConfigHandler = lazy_handler("lib.ui_config_handler", "UiConfigHandler")
+UiKeybindHandler = lazy_handler("lib.ui_keybind_handler", "UiKeybindHandler")
+KitConfigHandler = lazy_handler("lib.kit_config_handler", "KitConfigHandler")
+WiringConfigHandler = lazy_handler("lib.wiring_config_handler", "WiringConfigHandler")
+HWOptionsConfigHandler = lazy_handler("lib.hwoptions_config_handler", "HWOptionsConfigHandler")
+WifiConfigHandler = lazy_handler("lib.wifi_config_handler", "WifiConfigHandler")
+SnapshotConfigHandler = lazy_handler("lib.snapshot_config_handler", "SnapshotConfigHandler")
+SnapshotRemoveOptionHandler = lazy_handler("lib.snapshot_config_handler", "SnapshotRemoveOptionHandler")
+SnapshotAddOptionsHandler = lazy_handler("lib.snapshot_config_handler", "SnapshotAddOptionsHandler")
+SnapshotDownloadHandler = lazy_handler("lib.snapshot_config_handler", "SnapshotDownloadHandler")
+SnapshotTreeHandler = lazy_handler("lib.snapshot_config_handler", "SnapshotTreeHandler")
+SnapshotDetailsHandler = lazy_handler("lib.snapshot_config_handler", "SnapshotDetailsHandler")
+SnapshotSearchHandler = lazy_handler("lib.snapshot_config_handler", "SnapshotSearchHandler")
+SnapshotBulkHandler = lazy_handler("lib.snapshot_config_handler", "SnapshotBulkHandler")
+SnapshotRemoveChainHandler = lazy_handler("lib.snapshot_config_handler", "SnapshotRemoveChainHandler")
+SnapshotEditHandler = lazy_handler("lib.snapshot_config_handler", "SnapshotEditHandler")
+MidiConfigHandler = lazy_handler("lib.midi_config_handler", "MidiConfigHandler")
+UploadHandler = lazy_handler("lib.upload_handler", "UploadHandler", stream_request_body=True)
+SystemBackupHandler = lazy_handler("lib.system_backup_handler", "SystemBackupHandler")
+SoftwareUpdateHandler = lazy_handler("lib.software_update_handler", "SoftwareUpdateHandler")
+PresetsConfigHandler = lazy_handler("lib.presets_config_handler", "PresetsConfigHandler")
+PresetSearchHandler = lazy_handler("lib.presets_config_handler", "PresetSearchHandler")
+PianoteqHandler = lazy_handler("lib.pianoteq_handler", "PianoteqHandler")
+CapturesConfigHandler = lazy_handler("lib.captures_config_handler", "CapturesConfigHandler")
+EnginesHandler = lazy_handler("lib.engines_handler", "EnginesHandler")
+UiLogHandler = lazy_handler("lib.ui_log_handler", "UiLogHandler")
+MidiLogHandler = lazy_handler("lib.midi_log_handler", "MidiLogHandler")
+RepositoryHandler = lazy_handler("lib.repository_handler", "RepositoryHandler")
+AudioMixerHandler = lazy_handler("lib.audio_mixer_handler", "AudioMixerHandler")
+
+# Websocket message handlers living in lazy loaded modules
+register_message_handler_module('AudioConfigMessageHandler', "lib.audio_mixer_handler")
+register_message_handler_module('DashboardMessageHandler', "lib.dashboard_handler")
+register_message_handler_module('MidiLogMessageHandler', "lib.midi_log_handler")
+register_message_handler_module('SoftwareUpdateMessageHandler', "lib.software_update_handler")
+register_message_handler_module('RestoreMessageHandler', "lib.system_backup_handler")
+register_message_handler_module('UiLogMessageHandler', "lib.ui_log_handler")
+register_message_handler_module('UploadProgressHandler', "lib.upload_handler")
 
 # ------------------------------------------------------------------------------
 
@@ -132,7 +175,8 @@ def make_app():
 		"template_whitespace": "single",
 		"cookie_secret": get_cookie_secret(),
 		"login_url": "/login",
-		"upload_progress_handler": dict()
+		"upload_progress_handler": dict(),
+		"ui_methods": {'asset_url': asset_url}
 		#"autoescape": None
 	}
 
@@ -142,22 +186,29 @@ def make_app():
 		(r"/mockup/(.*)$", tornado.web.StaticFileHandler, {'path': 'mockup'}),
 		#(r'/()$', tornado.web.StaticFileHandler, {'path': 'html', "default_filename": "index.html"}),
 		(r"/(.*\.html)$", tornado.web.StaticFileHandler, {'path': 'html'}),
-		(r"/(favicon\.ico)$", tornado.web.StaticFileHandler, {'path': 'img'}),
-		(r"/fonts/(.*)$", tornado.web.StaticFileHandler, {'path': 'fonts'}),
-		(r"/img/(.*)$", tornado.web.StaticFileHandler, {'path': 'img'}),
-		(r"/css/(.*)$", tornado.web.StaticFileHandler, {'path': 'css'}),
-		(r"/js/(.*)$", tornado.web.StaticFileHandler, {'path': 'js'}),
+		(r"/(favicon\.ico)$", ZynthianStaticFileHandler, {'path': 'img'}),
+		(r"/fonts/(.*)$", ZynthianStaticFileHandler, {'path': 'fonts'}),
+		(r"/img/(.*)$", ZynthianStaticFileHandler, {'path': 'img'}),
+		(r"/css/(.*)$", ZynthianStaticFileHandler, {'path': 'css'}),
+		(r"/js/(.*)$", ZynthianStaticFileHandler, {'path': 'js'}),
 		#(r"/captures/(.*)$", tornado.web.StaticFileHandler, {'path': 'captures'}),
-		(r"/bower_components/(.*)$", tornado.web.StaticFileHandler, {'path': 'bower_components'}),
+		(r"/bower_components/(.*)$", ZynthianStaticFileHandler, {'path': 'bower_components'}),
 		(r"/login", LoginHandler),
 		(r"/logout", LogoutHandler),
 		(r"/lib-snapshot$", SnapshotConfigHandler),
 		(r"/lib-snapshot/ajax/(.*)$", SnapshotConfigHandler),
 		(r"/lib-snapshot/download/(.*)$", SnapshotDownloadHandler),
+		(r"/lib-snapshot/tree$", SnapshotTreeHandler),
+		(r"/lib-snapshot/tree/(.*)$", SnapshotTreeHandler),
+		(r"/lib-snapshot/details/(.*)$", SnapshotDetailsHandler),
+		(r"/lib-snapshot/search$", SnapshotSearchHandler),
+		(r"/lib-snapshot/bulk$", SnapshotBulkHandler),
+		(r"/lib-snapshot/edit/(.*)$", SnapshotEditHandler),
 		(r"/lib-snapshot/remove/(.*)/(.*)$", SnapshotRemoveOptionHandler),
 		(r"/lib-snapshot/remove-chain/(.*)/(.*)$", SnapshotRemoveChainHandler),
 		(r"/lib-snapshot/add/(.*)/(.*)$", SnapshotAddOptionsHandler),
 		(r"/lib-presets$", PresetsConfigHandler),
+		(r"/lib-presets/find$", PresetSearchHandler),
 		(r"/lib-presets/(.*)$", PresetsConfigHandler),
 		(r"/lib-presets/(.*)/(.*)$", PresetsConfigHandler),
 		(r"/lib-captures$", CapturesConfigHandler),
@@ -185,6 +236,8 @@ def make_app():
 		(r"/sys-poweroff$", PoweroffHandler),
 		(r'/upload$', UploadHandler),
 		(r"/ws$", ZynthianWebSocketHandler),
+		(r"/metrics$", MetricsHandler),
+		(r"/metrics/history$", MetricsHistoryHandler),
 		(r"/zynterm", ZyntermHandler),
 		(r"/zynterm_ws", TermSocket, {'term_manager': term_manager}),
 		(r"/xstatic/(.*)", tornado_xstatic.XStaticFileHandler, {'allowed_modules': ['termjs']})
@@ -192,6 +245,18 @@ def make_app():
 
 
 async def amain():
+	log_import_report()
+	start_precompress_static()
+	telemetry.start()
+	service_status.start()
+	git_info.start_update_check()
+	library_index.start()
+	i2c_inventory.start()
+	metrics_history.start()
+	jack_monitor.start()
+	snapshot_index.start()
+	snapshot_migration.start()
+	preset_search.start()
 	app = make_app()
 	app.listen(os.environ.get('ZYNTHIAN_WEBCONF_PORT', 80), max_body_size=MAX_STREAMED_SIZE)
 	app.listen(443, max_body_size=MAX_STREAMED_SIZE, ssl_options={